@@ -0,0 +1,149 @@
+"""
+MusicNBrain Admission - Concurrency governor for chat turns
+A chat turn runs the agent, which may call Gemini several times. At most
+`max_running` turns run at once; the rest wait in per-user queues that are
+served round-robin, so one teacher pasting ten rosters cannot starve the
+others. A turn that would wait too long is turned away early with a
+Retry-After hint instead of timing out later:
+
+    429  this user already has `max_queued_per_user` turns waiting
+    503  the shared queue is full, or the wait exceeded `max_wait_seconds`
+
+All state lives on the event loop, so no locks are needed.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CHAT_MAX_CONCURRENT_TURNS = int(os.getenv("CHAT_MAX_CONCURRENT_TURNS", "8"))
+CHAT_MAX_QUEUED_TURNS = int(os.getenv("CHAT_MAX_QUEUED_TURNS", "64"))
+CHAT_MAX_QUEUED_PER_USER = int(os.getenv("CHAT_MAX_QUEUED_PER_USER", "3"))
+CHAT_MAX_QUEUE_WAIT_SECONDS = float(os.getenv("CHAT_MAX_QUEUE_WAIT_SECONDS", "20"))
+
+
+class Overloaded(Exception):
+    """Raised when a turn is not admitted; carries the HTTP status and Retry-After seconds."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Admission:
+    """A running slot. release() is idempotent, so every exit path may call it."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._started = time.perf_counter()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(time.perf_counter() - self._started)
+
+
+class AdmissionController:
+    def __init__(self, max_running: int = CHAT_MAX_CONCURRENT_TURNS, max_queued: int = CHAT_MAX_QUEUED_TURNS,
+                 max_queued_per_user: int = CHAT_MAX_QUEUED_PER_USER,
+                 max_wait_seconds: float = CHAT_MAX_QUEUE_WAIT_SECONDS):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.max_wait_seconds = max_wait_seconds
+        self.running = 0
+        self.queued = 0
+        # user -> waiting futures; the first user in the dict is served next
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        # Moving average of turn duration, for Retry-After estimates
+        self._turn_seconds = 5.0
+
+    def retry_after(self) -> int:
+        """Seconds until a newcomer would likely get a slot (1-60)."""
+        waves = (self.running + self.queued) / max(1, self.max_running)
+        return max(1, min(60, math.ceil(waves * self._turn_seconds)))
+
+    def _update_gauges(self) -> None:
+        metrics.ADMISSION_RUNNING.set(self.running)
+        metrics.ADMISSION_QUEUE_DEPTH.set(self.queued)
+
+    def _reject(self, status_code: int, reason: str, detail: str) -> Overloaded:
+        metrics.ADMISSION_REJECTIONS.inc(reason=reason)
+        logger.warning(f"Turn rejected ({reason}): {self.running} running, {self.queued} queued")
+        return Overloaded(status_code, detail, self.retry_after())
+
+    async def acquire(self, user_id: str) -> Admission:
+        """Wait for a running slot; raises Overloaded when the turn should be retried later."""
+        if self.running < self.max_running and not self.queued:
+            self.running += 1
+            self._update_gauges()
+            metrics.ADMISSION_WAIT_SECONDS.observe(0.0, outcome="admitted")
+            return Admission(self)
+
+        waiting = self._queues.get(user_id)
+        if waiting is not None and len(waiting) >= self.max_queued_per_user:
+            raise self._reject(429, "user_queue_full",
+                               "You already have requests waiting. Please wait for them to finish.")
+        if self.queued >= self.max_queued:
+            raise self._reject(503, "queue_full", "The assistant is busy right now. Please try again shortly.")
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user_id, deque()).append(future)
+        self.queued += 1
+        self._update_gauges()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            if not future.done():
+                self._withdraw(user_id, future)
+                metrics.ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, outcome="timeout")
+                raise self._reject(503, "timeout", "The assistant is busy right now. Please try again shortly.")
+        except asyncio.CancelledError:
+            # The client went away while waiting; give back a slot granted meanwhile
+            if future.done():
+                self._release(None)
+            else:
+                self._withdraw(user_id, future)
+            raise
+        metrics.ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, outcome="admitted")
+        return Admission(self)
+
+    def _withdraw(self, user_id: str, future: asyncio.Future) -> None:
+        future.cancel()
+        waiting = self._queues.get(user_id)
+        if waiting is not None and future in waiting:
+            waiting.remove(future)
+            self.queued -= 1
+            if not waiting:
+                del self._queues[user_id]
+        self._update_gauges()
+
+    def _release(self, seconds: Optional[float]) -> None:
+        self.running -= 1
+        if seconds is not None:
+            self._turn_seconds = 0.8 * self._turn_seconds + 0.2 * seconds
+        # Hand freed slots to waiting users in round-robin order
+        while self.running < self.max_running and self._queues:
+            user_id, waiting = next(iter(self._queues.items()))
+            future = waiting.popleft()
+            self.queued -= 1
+            if waiting:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            if not future.done():
+                future.set_result(None)
+                self.running += 1
+        self._update_gauges()
@@ -3,16 +3,25 @@ MusicNBrain Agent - Concert Program Assistant
 Uses Google ADK to orchestrate MCP tools via natural language.
 """
 
+import asyncio
+import atexit
+import functools
 import os
+import socket
+import subprocess
 import sys
+import threading
+import time
 import logging
 from dotenv import load_dotenv
 from google.adk.agents import Agent
+from google.adk.tools import FunctionTool
 from google.adk.tools.mcp_tool import McpToolset
-from google.adk.tools.mcp_tool.mcp_session_manager import StdioConnectionParams
+from google.adk.tools.mcp_tool.mcp_session_manager import StdioConnectionParams, StreamableHTTPConnectionParams
 from mcp import StdioServerParameters
 
-logging.basicConfig(level=logging.DEBUG)
+import metrics
+
 logger = logging.getLogger(__name__)
 
 load_dotenv()
@@ -40,6 +49,7 @@ You have access to tools that can:
 3. Fix errors in the program data based on natural language instructions
 4. View the current program data
 5. Update concert metadata (title, date, time, venue)
+6. Schedule the program: slot times, intermissions and rooms for multi-room festivals
 
 **HOW TO HELP TEACHERS:**
 
@@ -48,6 +58,10 @@ When a teacher pastes text and asks to generate a program PDF:
 2. Then call `generate_program_pdf` to create the PDF
 3. Tell the teacher the PDF is ready and show them what's in it
 
+When a teacher uploads a photo of a printed or handwritten program:
+1. Call `parse_program_text` with the `image_ref` from the upload notice (and any concert details they gave)
+2. Then continue as above
+
 When a teacher says there's an error (e.g. "Tommy Chen should be Tommy Chang"):
 1. Call `fix_program_data` with their correction instruction
 2. Then call `generate_program_pdf` to regenerate the PDF
@@ -56,6 +70,11 @@ When a teacher says there's an error (e.g. "Tommy Chen should be Tommy Chang"):
 When a teacher wants to update concert details:
 1. Call `update_concert_info` with the new details
 
+When a teacher asks for start times, a timetable, or a festival across several rooms:
+1. Call `schedule_program` with what they told you (start time, number or names of rooms, session and intermission lengths, when the day ends, siblings who must not overlap)
+2. Tell them when each room starts and ends; offer to generate the PDF, which then shows the slot times
+3. To change a setting later, call `schedule_program` again with only that setting; corrections made with `fix_program_data` re-solve the timetable automatically
+
 When a teacher wants to see the current program:
 1. Call `get_current_program`
 
@@ -86,17 +105,162 @@ Teacher: "There's a spelling error. Tommy Chen should be Tommy Chang"
 → "Fixed! Tommy Chang's name has been corrected and the PDF has been regenerated."
 """
 
+# ============================================================
+# Session pinning - every tool call works on the caller's own program
+# ============================================================
+def pin_tool_session(tool, args, tool_context):
+    """Inject the ADK session id so the MCP tools read and write that session's program."""
+    args["session_id"] = tool_context.session.id
+    _start_tool_timer(tool, args, tool_context)
+    return None
+
+
+# ============================================================
+# Tool timing - the agent-side latency includes the MCP stdio hop;
+# compare with musicnbrain_tool_duration_seconds from the server
+# ============================================================
+_running_tools = {}  # function_call_id -> (start time, span or None)
+
+
+def _start_tool_timer(tool, args, tool_context):
+    span = metrics.start_span(f"agent.tool.{tool.name}", session_id=tool_context.session.id)
+    if span is not None:
+        # The MCP server parents its own tool span under this one
+        args["trace_parent"] = metrics.format_trace_parent(span.context)
+    _running_tools[tool_context.function_call_id] = (time.perf_counter(), span)
+
+
+def _finish_tool_timer(tool, tool_context, outcome: str) -> None:
+    started = _running_tools.pop(tool_context.function_call_id, None)
+    if started is None:
+        return
+    start, span = started
+    metrics.AGENT_TOOL_SECONDS.observe(time.perf_counter() - start, tool=tool.name)
+    if span is not None:
+        span.end(outcome=outcome)
+
+
+def record_tool_result(tool, args, tool_context, tool_response):
+    _finish_tool_timer(tool, tool_context, "ok")
+    return None
+
+
+def record_tool_error(tool, args, tool_context, error):
+    _finish_tool_timer(tool, tool_context, "error")
+    return None
+
+
 # Path to the MCP server script
 MCP_SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mcp_server.py")
 
 # ============================================================
-# Initialize the Agent with MCP tools
+# Tool transport
+#   stdio      - the agent spawns `python mcp_server.py` and talks JSON-RPC
+#                over its pipes (default)
+#   inprocess  - the tool functions are imported and called directly as
+#                ADK function tools: no second interpreter, no serialization
+#   http       - one warm MCP server over streamable HTTP, shared by every
+#                API worker; MCP_HTTP_URL points at an external one (run it
+#                under the process manager), otherwise the first worker
+#                starts it on MCP_HTTP_PORT and every worker restarts it if
+#                the port goes away
+# The session_id and trace_parent injection in the callbacks above works
+# the same way for all three.
 # ============================================================
-concert_agent = Agent(
-    model="gemini-2.5-flash",
-    name="musicnbrain_agent",
-    instruction=agent_instruction,
-    tools=[
+MCP_TRANSPORT = os.getenv("MCP_TRANSPORT", "stdio")
+MCP_HTTP_URL = os.getenv("MCP_HTTP_URL", "")
+MCP_HTTP_PORT = int(os.getenv("MCP_HTTP_PORT", "8765"))
+# How often each worker checks that the shared HTTP server it started is still up
+MCP_HTTP_CHECK_SECONDS = float(os.getenv("MCP_HTTP_CHECK_SECONDS", "2"))
+
+
+def _off_event_loop(fn):
+    """Run a blocking tool function in a worker thread (signature and docstring kept for the schema)."""
+    @functools.wraps(fn)
+    async def run(**kwargs):
+        return await asyncio.to_thread(fn, **kwargs)
+    return run
+
+
+def _port_open(port: int) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+
+def start_http_server(port: int = MCP_HTTP_PORT, timeout: float = 60) -> str:
+    """Start the MCP HTTP server unless one is already listening on the port; returns its URL."""
+    url = f"http://127.0.0.1:{port}/mcp"
+    if _port_open(port):
+        return url
+    process = subprocess.Popen([sys.executable, MCP_SERVER_PATH, "--http", "--port", str(port)],
+                               env=os.environ.copy())
+    atexit.register(process.terminate)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        # Another worker may have won the race for the port; its server will do
+        if _port_open(port):
+            return url
+        if process.poll() is not None:
+            break
+        time.sleep(0.05)
+    raise RuntimeError(f"MCP HTTP server did not start on port {port}")
+
+
+class SharedServerToolset(McpToolset):
+    """
+    McpToolset for the shared HTTP server. Its sessions live on the server,
+    so after a restart they are gone: drop them and connect again.
+    """
+
+    async def get_tools(self, readonly_context=None):
+        try:
+            return await super().get_tools(readonly_context)
+        except ConnectionError as e:
+            logger.warning(f"MCP HTTP session lost ({e}); reconnecting")
+            await self.close()
+            return await super().get_tools(readonly_context)
+
+
+def supervise_http_server(port: int = MCP_HTTP_PORT, interval: float = MCP_HTTP_CHECK_SECONDS) -> threading.Thread:
+    """
+    Keep the shared MCP HTTP server up from this worker. The server is a
+    child of whichever worker started it and goes when that worker exits or
+    restarts; the other workers then start a new one (only one binds the
+    port) and their SharedServerToolsets reconnect on the next call.
+    """
+    def watch():
+        while True:
+            time.sleep(interval)
+            if _port_open(port):
+                continue
+            logger.warning(f"MCP HTTP server on port {port} is gone; restarting it")
+            try:
+                start_http_server(port)
+            except RuntimeError as e:
+                logger.error(f"Could not restart the MCP HTTP server: {e}")
+
+    thread = threading.Thread(target=watch, name="mcp-http-supervisor", daemon=True)
+    thread.start()
+    return thread
+
+
+def build_concert_tools(transport: str = MCP_TRANSPORT) -> list:
+    if transport == "inprocess":
+        import mcp_server
+        return [FunctionTool(_off_event_loop(fn)) for fn in mcp_server.TOOLS]
+    if transport == "http":
+        url = MCP_HTTP_URL
+        if not url:
+            url = start_http_server()
+            supervise_http_server()
+        return [SharedServerToolset(connection_params=StreamableHTTPConnectionParams(
+            url=url, timeout=30, sse_read_timeout=120))]
+    if transport != "stdio":
+        raise ValueError(f"Unknown MCP_TRANSPORT {transport!r} (expected stdio, inprocess or http)")
+    return [
         McpToolset(
             connection_params=StdioConnectionParams(
                 server_params=StdioServerParameters(
@@ -108,4 +272,17 @@ concert_agent = Agent(
             )
         )
     ]
+
+
+# ============================================================
+# Initialize the Agent with MCP tools
+# ============================================================
+concert_agent = Agent(
+    model="gemini-2.5-flash",
+    name="musicnbrain_agent",
+    instruction=agent_instruction,
+    before_tool_callback=pin_tool_session,
+    after_tool_callback=record_tool_result,
+    on_tool_error_callback=record_tool_error,
+    tools=build_concert_tools()
 )
@@ -0,0 +1,87 @@
+"""
+MusicNBrain Batch Render - Render many program PDFs in parallel
+reportlab's doc.build is CPU-bound and holds the GIL, so batches are spread
+over a pool of worker processes. Results are yielded as each PDF finishes.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _warm_worker() -> None:
+    """Pool initializer: pay the reportlab import once per worker, not per job."""
+    import pdf_renderer  # noqa: F401
+    import reportlab.platypus  # noqa: F401
+
+
+def render_job(job: dict) -> dict:
+    """
+    Worker entry point. Renders job["program"] with job["theme"] to
+    job["output_path"] (atomically), skipping the work if the file exists.
+    """
+    from pdf_renderer import render_program_pdf
+
+    start = time.perf_counter()
+    output_path = job["output_path"]
+    if os.path.exists(output_path):
+        return {"index": job["index"], "cached": True, "seconds": 0.0, "bytes": os.path.getsize(output_path)}
+
+    tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        render_program_pdf(job["program"], job["theme"], tmp_path)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return {
+        "index": job["index"],
+        "cached": False,
+        "seconds": round(time.perf_counter() - start, 4),
+        "bytes": os.path.getsize(output_path),
+    }
+
+
+class BatchRenderer:
+    """A lazily started process pool for render_job."""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: the server process has threads, which fork does not copy safely
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_worker,
+            )
+            logger.info(f"Started batch render pool with {self.max_workers} workers")
+        return self._pool
+
+    async def render_all(self, jobs: list) -> AsyncIterator[dict]:
+        """Submit every job and yield results (or {"index", "error"}) in completion order."""
+        pool = self._get_pool()
+
+        async def run(job: dict) -> dict:
+            try:
+                return await asyncio.wrap_future(pool.submit(render_job, job))
+            except Exception as e:
+                logger.error(f"Batch render of program {job['index']} failed: {e}")
+                return {"index": job["index"], "error": str(e)}
+
+        for done in asyncio.as_completed([run(job) for job in jobs]):
+            yield await done
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
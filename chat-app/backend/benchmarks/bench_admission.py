@@ -0,0 +1,120 @@
+"""
+Benchmark: /api/chat under a burst, without and with admission control.
+A stub runner stands in for the agent: each turn needs `--turn-ms` of model
+time from a backend that serves `--capacity` turns at full speed and shares
+itself between the rest (so every extra turn in flight slows all of them,
+as an overloaded model endpoint does). A burst of requests from a handful
+of users is sent through the real FastAPI app; reports latency of the
+answered turns and how many were turned away with 429/503.
+
+    python benchmarks/bench_admission.py [--requests 200] [--users 20] [--capacity 8]
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class SharedBackend:
+    """Processor-sharing model of the LLM endpoint."""
+
+    def __init__(self, capacity: int, turn_seconds: float):
+        self.capacity = capacity
+        self.turn_seconds = turn_seconds
+        self.in_flight = 0
+        self.peak = 0
+
+    async def serve(self) -> None:
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            remaining = self.turn_seconds
+            while remaining > 0:
+                step = 0.01
+                await asyncio.sleep(step)
+                remaining -= step * min(1.0, self.capacity / self.in_flight)
+        finally:
+            self.in_flight -= 1
+
+
+def _percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+async def run_burst(args, governed: bool) -> None:
+    import httpx
+    from google.adk.events import Event
+    from google.genai import types
+
+    import main
+    from admission import AdmissionController
+
+    backend = SharedBackend(args.capacity, args.turn_ms / 1000)
+
+    class StubRunner:
+        async def run_async(self, user_id, session_id, new_message, run_config=None):
+            await backend.serve()
+            yield Event(author="concert_assistant", content=types.Content(role="model", parts=[
+                types.Part(text="Your program is ready.")
+            ]))
+
+    main.runner = StubRunner()
+    await main.ensure_runtime()  # builds only the session store, outside the timed burst
+    main.admission = (AdmissionController(max_running=args.capacity) if governed
+                      else AdmissionController(max_running=10 ** 9))
+
+    latencies, statuses = [], Counter()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one(i: int):
+            start = time.perf_counter()
+            response = await client.post("/api/chat", data={
+                "message": "Make the program", "user_id": f"user-{i % args.users}",
+                "session_id": f"{'gov' if governed else 'raw'}-{i}",
+            })
+            statuses[response.status_code] += 1
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - start
+
+    label = f"admission (max {args.capacity} running)" if governed else "unbounded"
+    rejected = statuses[429] + statuses[503]
+    failed = args.requests - len(latencies) - rejected
+    print(f"  {label:<28} answered {len(latencies):>4}  p50 {_percentile(latencies, 0.5):6.2f}s  "
+          f"p99 {_percentile(latencies, 0.99):6.2f}s  rejected {rejected:>4} "
+          f"(429: {statuses[429]}, 503: {statuses[503]})  failed {failed:>3}  peak in flight {backend.peak:>4}  "
+          f"burst done in {elapsed:5.1f}s")
+
+
+async def run(args) -> None:
+    print(f"{args.requests} requests from {args.users} users, {args.turn_ms} ms turns, backend capacity {args.capacity}")
+    await run_burst(args, governed=False)
+    await run_burst(args, governed=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--capacity", type=int, default=8)
+    parser.add_argument("--turn-ms", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ["PREWARM"] = "0"
+    os.chdir(tempfile.mkdtemp(prefix="musicnbrain-bench-"))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark: batch PDF throughput, serial vs the process pool.
+Renders N distinct programs with the built-in themes and reports PDFs per second.
+
+    python benchmarks/bench_batch_render.py [--programs 60] [--rows 25] [--workers N]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_render import BatchRenderer, render_job  # noqa: E402
+
+STYLES = ["elegant", "modern", "minimal", "classic"]
+
+
+def make_jobs(directory: str, programs: int, rows: int) -> list:
+    import mcp_server
+
+    jobs = []
+    for index in range(programs):
+        program = {
+            "concert_title": f"Studio Recital {index + 1}",
+            "concert_date": "June 14, 2026",
+            "concert_time": "2:00 PM",
+            "concert_venue": "Recital Hall",
+            "performances": [
+                {"order": i + 1, "student_name": f"Student {index}-{i}", "piece_name": f"Sonatina No. {i} (Clementi)",
+                 "instrument": "Piano", "estimated_duration_minutes": 3 + i % 4}
+                for i in range(rows)
+            ],
+        }
+        theme = mcp_server.PRESET_THEMES[STYLES[index % len(STYLES)]]
+        jobs.append({"index": index, "program": program, "theme": theme,
+                     "output_path": os.path.join(directory, f"{index}.pdf")})
+    return jobs
+
+
+async def run_pool(jobs: list, workers: int) -> float:
+    renderer = BatchRenderer(max_workers=workers)
+    # Start the workers (and their reportlab import) before timing
+    async for _ in renderer.render_all([dict(jobs[0], output_path=jobs[0]["output_path"] + ".warm")]):
+        pass
+    start = time.perf_counter()
+    async for result in renderer.render_all(jobs):
+        assert "error" not in result, result
+    elapsed = time.perf_counter() - start
+    renderer.shutdown()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--programs", type=int, default=60)
+    parser.add_argument("--rows", type=int, default=25)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as serial_dir, tempfile.TemporaryDirectory() as pool_dir:
+        serial_jobs = make_jobs(serial_dir, args.programs, args.rows)
+        render_job(dict(serial_jobs[0], output_path=os.path.join(serial_dir, "warm.pdf")))
+        start = time.perf_counter()
+        for job in serial_jobs:
+            render_job(job)
+        serial = time.perf_counter() - start
+
+        pooled = asyncio.run(run_pool(make_jobs(pool_dir, args.programs, args.rows), args.workers))
+
+    print(f"{args.programs} programs x {args.rows} rows")
+    print(f"serial:            {serial:6.2f} s   {args.programs / serial:6.1f} PDFs/s")
+    print(f"pool ({args.workers:>2} workers): {pooled:6.2f} s   {args.programs / pooled:6.1f} PDFs/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark: one-shot vs chunked concurrent LLM parsing of a large free-text
+roster. The fake model answers with one performance per input line and takes
+longer the more rows it has to write, like a real model generating output.
+
+    python benchmarks/bench_chunked_parse.py [--rows 400] [--seconds-per-row 0.01]
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_genai import FakeGenAIClient  # noqa: E402
+
+_INPUT_MARKER = "Input text to parse:\n"
+
+
+def _input_rows(prompt: str) -> list:
+    text = prompt.split(_INPUT_MARKER, 1)[1]
+    return [line for line in text.splitlines() if line.strip()]
+
+
+def respond(prompt: str) -> str:
+    import json
+
+    rows = []
+    for line in _input_rows(prompt):
+        name = re.search(r"(Student \d+)", line).group(1)
+        rows.append({"student_name": name, "piece_name": "Sonatina (Clementi)", "instrument": "Piano",
+                     "estimated_duration_minutes": 3, "confidence": 0.9})
+    return json.dumps({"performances": rows})
+
+
+def roster(rows: int) -> str:
+    # Sentences without list markers or delimiters: the local parser gives up
+    return "\n".join(f"After that Student {i} plays a Clementi sonatina on piano" for i in range(1, rows + 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=400)
+    parser.add_argument("--base-latency", type=float, default=0.3, help="Seconds per model call")
+    parser.add_argument("--seconds-per-row", type=float, default=0.01, help="Extra seconds per row generated")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="musicnbrain-bench-")
+    os.environ["CACHE_DB_PATH"] = os.path.join(scratch, "cache.sqlite3")
+    os.environ["RENDER_CACHE_DIR"] = os.path.join(scratch, "programs")
+    os.chdir(scratch)
+
+    import llm
+    import mcp_server
+
+    fake = FakeGenAIClient(
+        respond, latency=lambda prompt: args.base_latency + args.seconds_per_row * len(_input_rows(prompt)))
+    llm.set_client(fake)
+    text = roster(args.rows)
+
+    print(f"{args.rows} free-text rows, model time {args.base_latency}s + {args.seconds_per_row}s/row")
+    for label, chunk_rows in (("one prompt", args.rows + 1), (f"chunks of {mcp_server.PARSE_CHUNK_ROWS}", mcp_server.PARSE_CHUNK_ROWS)):
+        mcp_server.PARSE_CHUNK_ROWS = chunk_rows
+        fake.calls = 0
+        start = time.perf_counter()
+        performances, _ = mcp_server._parse_performances(text)
+        elapsed = time.perf_counter() - start
+        in_order = [p["student_name"] for p in performances] == [f"Student {i}" for i in range(1, args.rows + 1)]
+        print(f"{label:<16} {elapsed:6.2f} s   {fake.calls:3d} calls   {len(performances)} rows   in order: {in_order}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark: image ingest for photographed programs. Synthetic phone photos
+(noisy, EXIF-tagged 12 MP JPEG and a large PNG scan) go through
+image_ingest.ingest_image; reports stored size vs the upload, the base64
+payload the model receives inline, and ingest time for new and re-sent photos.
+
+    python benchmarks/bench_image_ingest.py [--repeat 3]
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def synthetic_photo(fmt: str, size=(4032, 3024)) -> bytes:
+    """A handwritten-looking list on paper with sensor noise, as a phone would save it."""
+    from PIL import Image, ImageDraw
+
+    page = Image.new("L", size, 235)
+    draw = ImageDraw.Draw(page)
+    for i in range(40):
+        draw.text((200, 100 + i * 70), f"{i + 1}. Student {i + 1} - Sonatina in C (Clementi), piano, 3 min", fill=20)
+    photo = Image.blend(page, Image.effect_noise(size, 25), 0.15).convert("RGB")
+
+    output = io.BytesIO()
+    if fmt == "jpeg":
+        exif = Image.Exif()
+        exif[0x0112] = 6  # orientation: rotated, as portrait phone photos are
+        exif[0x010F] = "PhoneCo"
+        photo.save(output, "JPEG", quality=92, exif=exif)
+    else:
+        photo.save(output, "PNG")
+    return output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="musicnbrain-bench-"))
+    import image_ingest
+
+    print(f"{'upload':<14} {'sent':>9} {'stored':>9} {'inline b64':>11} {'ratio':>7} {'ingest':>9} {'re-sent':>9}")
+    for label, fmt in (("12 MP JPEG", "jpeg"), ("12 MP PNG", "png")):
+        data = synthetic_photo(fmt)
+        new_times, dedupe_times = [], []
+        for _ in range(args.repeat):
+            for name in os.listdir(image_ingest.IMAGE_DIR) if os.path.isdir(image_ingest.IMAGE_DIR) else []:
+                os.remove(os.path.join(image_ingest.IMAGE_DIR, name))
+            start = time.perf_counter()
+            result = image_ingest.ingest_image(data)
+            new_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            image_ingest.ingest_image(data)
+            dedupe_times.append(time.perf_counter() - start)
+
+        inline = (result["stored_bytes"] + 2) // 3 * 4
+        print(f"{label:<14} {len(data) / 1024:>7.0f}KB {result['stored_bytes'] / 1024:>7.0f}KB "
+              f"{inline / 1024:>9.0f}KB {len(data) / result['stored_bytes']:>6.1f}x "
+              f"{statistics.median(new_times) * 1000:>7.0f}ms {statistics.median(dedupe_times) * 1000:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
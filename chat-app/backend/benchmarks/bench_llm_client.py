@@ -0,0 +1,69 @@
+"""
+Benchmark: per-call overhead of a fresh GenAI client vs the shared pooled one.
+Runs against a local stub HTTP endpoint, so it measures client construction
+and connection setup only (no TLS, no model time).
+
+    python benchmarks/bench_llm_client.py [--calls 200]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_genai_server import StubGenAIServer  # noqa: E402
+
+
+def _timed(fn, calls: int) -> list:
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _report(label: str, samples: list) -> None:
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<22} mean {statistics.mean(samples):7.2f} ms   p50 {statistics.median(samples):7.2f} ms   p95 {p95:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    with StubGenAIServer(reply_text='{"ok": true}') as server:
+        os.environ.pop("PROJECT_ID", None)
+        os.environ["GOOGLE_API_KEY"] = "stub-key"
+        os.environ["GENAI_BASE_URL"] = server.url
+
+        import llm
+
+        def fresh_client_call():
+            # What every tool call used to do: build a client, then call it
+            client = llm._build_client()
+            client.models.generate_content(model=llm.DEFAULT_MODEL, contents=["ping"])
+
+        def pooled_client_call():
+            llm.generate_text("ping")
+
+        # Warm up imports and the shared client's connection
+        fresh_client_call()
+        pooled_client_call()
+
+        fresh = _timed(fresh_client_call, args.calls)
+        pooled = _timed(pooled_client_call, args.calls)
+
+    print(f"{args.calls} calls against {server.url}")
+    _report("fresh client per call", fresh)
+    _report("shared pooled client", pooled)
+    print(f"saved per call: {statistics.mean(fresh) - statistics.mean(pooled):.2f} ms (mean)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark: tail latency of model calls with retries and hedging. The local
+stub endpoint answers most requests in 40-80 ms, but a few land on a "slow
+replica" (1-2 s, sometimes 4 s) and some fail with 503. The same calls run
+as a single request each (the old behaviour), with jittered retries, and
+with retries plus p95 hedging, and streamed (as program parses are) with
+retries and hedging before the first piece; reports latency percentiles,
+failures and how many requests each call cost.
+
+    python benchmarks/bench_llm_tail.py [--calls 500] [--concurrency 8] [--error-rate 0.05]
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_genai_server import StubGenAIServer  # noqa: E402
+
+MODES = {
+    "single request": {"LLM_MAX_ATTEMPTS": 1, "LLM_HEDGE": False},
+    "retries": {"LLM_MAX_ATTEMPTS": 3, "LLM_HEDGE": False},
+    "retries + hedging": {"LLM_MAX_ATTEMPTS": 3, "LLM_HEDGE": True},
+    "streamed + hedging": {"LLM_MAX_ATTEMPTS": 3, "LLM_HEDGE": True, "stream": True},
+}
+
+
+def slow_replica_latency(seed: int):
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def latency() -> float:
+        with lock:
+            roll, jitter = rng.random(), rng.random()
+        if roll < 0.01:
+            return 4.0
+        if roll < 0.06:
+            return 1.0 + jitter
+        return 0.04 + 0.04 * jitter
+
+    return latency
+
+
+def _percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def run_mode(llm, server, label: str, settings: dict, calls: int, concurrency: int) -> None:
+    import asyncio
+
+    settings = dict(settings)
+    stream = settings.pop("stream", False)
+    for name, value in settings.items():
+        setattr(llm, name, value)
+    llm._retry_budget = llm.RetryBudget()
+    llm._latencies = llm.LatencyTracker()
+    llm._first_chunk_latencies = llm.LatencyTracker()
+
+    async def call():
+        if stream:
+            return "".join([text async for text in llm.stream_text_async("List the performances.")])
+        return await llm.generate_text_async("List the performances.")
+
+    async def batch(count: int) -> tuple:
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, failures = [], 0
+
+        async def one():
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await call()
+                except Exception:
+                    failures += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(one() for _ in range(count)))
+        return latencies, failures
+
+    # Warm-up calls give the hedge its latency history (and the client its connections)
+    llm.run_coroutine(batch(100))
+    sent_before = server.requests
+    latencies, failures = llm.run_coroutine(batch(calls))
+    extra = (server.requests - sent_before) / calls - 1
+
+    ms = [x * 1000 for x in latencies]
+    print(f"  {label:<18} p50 {_percentile(ms, 0.5):6.0f} ms  p95 {_percentile(ms, 0.95):6.0f} ms"
+          f"  p99 {_percentile(ms, 0.99):6.0f} ms  failed {failures:>3}  extra requests {extra:+.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with StubGenAIServer(reply_text='{"performances": []}', latency=slow_replica_latency(args.seed),
+                         error_rate=args.error_rate, seed=args.seed) as server:
+        os.environ.pop("PROJECT_ID", None)
+        os.environ["GOOGLE_API_KEY"] = "stub-key"
+        os.environ["GENAI_BASE_URL"] = server.url
+
+        import logging
+
+        import llm
+
+        logging.getLogger("llm").setLevel(logging.ERROR)
+        print(f"{args.calls} calls, concurrency {args.concurrency}, 5% slow (1-2 s), 1% very slow (4 s), "
+              f"{args.error_rate:.0%} errors")
+        for label, settings in MODES.items():
+            random.seed(args.seed)
+            run_mode(llm, server, label, settings, args.calls, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
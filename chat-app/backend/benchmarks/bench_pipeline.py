@@ -0,0 +1,337 @@
+"""
+Benchmark: hot paths of the program pipeline, fully offline.
+
+  - generate_program_pdf, list vs table layout, 5 / 50 / 500 / 2000 performances
+  - parse_program_text and fix_program_data with a fake GenAI client (canned JSON)
+  - one /api/chat turn through FastAPI with a stub ADK runner
+
+Each case runs in its own subprocess (inside a scratch directory) so peak RSS
+is per case. Reports median wall time, peak RSS and PDF size, and compares
+against the saved baseline.
+
+    python benchmarks/bench_pipeline.py                  # run everything, compare with baseline
+    python benchmarks/bench_pipeline.py --only render    # cases whose name contains "render"
+    python benchmarks/bench_pipeline.py --save-baseline  # record the results as the new baseline
+"""
+
+import argparse
+import copy
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baselines", "pipeline.json")
+RESULT_PREFIX = "BENCH_RESULT "
+
+RENDER_SIZES = (5, 50, 500, 2000)
+RENDER_LAYOUTS = {"list": "elegant", "table": "modern"}
+
+INSTRUMENTS = ("Piano", "Violin", "Cello", "Flute", "Guitar", "Voice")
+
+
+# ============================================================
+# Synthetic programs and canned model replies
+# ============================================================
+def make_performances(n: int) -> list:
+    return [
+        {
+            "order": i + 1,
+            "student_name": f"Student {i + 1}",
+            "piece_name": f"Sonatina No. {i % 12 + 1} in C (Clementi)",
+            "instrument": INSTRUMENTS[i % len(INSTRUMENTS)],
+            "estimated_duration_minutes": 2 + i % 5,
+        }
+        for i in range(n)
+    ]
+
+
+def csv_roster(n: int) -> str:
+    rows = ["Student,Piece,Instrument,Duration"]
+    rows += [f"{p['student_name']},{p['piece_name']},{p['instrument']},{p['estimated_duration_minutes']} min"
+             for p in make_performances(n)]
+    return "\n".join(rows)
+
+
+def free_text_roster(n: int) -> str:
+    # No list markers or delimiters, so the local parser hands it all to the LLM
+    return " ".join(
+        f"After that {p['student_name']} plays {p['piece_name']} on {p['instrument'].lower()} "
+        f"for about {p['estimated_duration_minutes']} minutes."
+        for p in make_performances(n)
+    )
+
+
+def canned_responder(num_rows: int):
+    parsed = json.dumps({"performances": [dict(p, confidence=0.9) for p in make_performances(num_rows)]})
+    patch = json.dumps([{"op": "replace", "path": "/performances/16/instrument", "value": "Cello"}])
+
+    def respond(prompt: str) -> str:
+        if "concert program parser" in prompt:
+            return parsed
+        if "data correction assistant" in prompt:
+            return patch
+        raise ValueError("Unexpected prompt in benchmark")
+
+    return respond
+
+
+# ============================================================
+# Cases: setup(rows) returns {"run": fn(i) -> extra metrics, "reset": fn()}
+# ============================================================
+def _install_fake_llm(num_rows: int):
+    import llm
+    from fake_genai import FakeGenAIClient
+
+    fake = FakeGenAIClient(canned_responder(num_rows))
+    llm.set_client(fake)
+    return fake
+
+
+def setup_render(style: str, rows: int) -> dict:
+    import mcp_server
+    from render_cache import find_artifact_ids
+
+    program = mcp_server.PROGRAM_STORE.get("bench")
+    program["performances"] = make_performances(rows)
+
+    def run(i: int) -> dict:
+        # A fresh title each run so the render cache never answers
+        result = mcp_server.generate_program_pdf(concert_title=f"Bench Recital {i}", style=style,
+                                                 session_id="bench")
+        artifact_ids = find_artifact_ids(result)
+        if not artifact_ids:
+            raise RuntimeError(result)
+        return {"pdf_bytes": os.path.getsize(mcp_server.RENDER_CACHE.path_for(artifact_ids[0]))}
+
+    return {"run": run}
+
+
+def setup_parse(raw_text: str, rows: int) -> dict:
+    import mcp_server
+
+    fake = _install_fake_llm(rows)
+
+    def run(i: int) -> dict:
+        result = mcp_server.parse_program_text(raw_text, session_id="bench")
+        if result.startswith("Error"):
+            raise RuntimeError(result)
+        return {"llm_calls": fake.calls}
+
+    def reset():
+        mcp_server.PARSE_CACHE.clear()
+        fake.calls = 0
+
+    return {"run": run, "reset": reset}
+
+
+def setup_fix(instruction: str, rows: int, llm_calls: int) -> dict:
+    import mcp_server
+
+    fake = _install_fake_llm(rows)
+    program = mcp_server.PROGRAM_STORE.get("bench")
+    original = make_performances(rows)
+
+    def run(i: int) -> dict:
+        result = mcp_server.fix_program_data(instruction, session_id="bench")
+        if result.startswith("Error"):
+            raise RuntimeError(result)
+        # A phrasing the local path cannot take at face value must reach the model
+        if fake.calls != llm_calls:
+            raise RuntimeError(f"expected {llm_calls} model call(s) for {instruction!r}, got {fake.calls}")
+        return {"llm_calls": fake.calls}
+
+    def reset():
+        program["performances"] = copy.deepcopy(original)
+        fake.calls = 0
+
+    return {"run": run, "reset": reset}
+
+
+def setup_chat(rows: int) -> dict:
+    from fastapi.testclient import TestClient
+    from google.adk.events import Event
+    from google.genai import types
+
+    import main
+    from render_cache import artifact_marker
+
+    artifact_id = "0" * 64
+
+    class StubRunner:
+        """Replays a canned parse -> render -> answer turn without a model or MCP server."""
+
+        async def run_async(self, user_id, session_id, new_message, run_config=None):
+            yield Event(author="concert_assistant", content=types.Content(role="model", parts=[
+                types.Part(function_call=types.FunctionCall(name="generate_program_pdf", args={"style": "elegant"}))
+            ]))
+            yield Event(author="concert_assistant", content=types.Content(role="user", parts=[
+                types.Part(function_response=types.FunctionResponse(
+                    name="generate_program_pdf",
+                    response={"result": f"Done! Download: /static/programs/{artifact_id}.pdf {artifact_marker(artifact_id)}"},
+                ))
+            ]))
+            yield Event(author="concert_assistant", content=types.Content(role="model", parts=[
+                types.Part(text=f"Your program with {rows} performances is ready.")
+            ]))
+
+    main.runner = StubRunner()
+    client = TestClient(main.app)
+    client.__enter__()
+    message = csv_roster(rows)
+
+    def run(i: int) -> dict:
+        response = client.post("/api/chat", data={"message": message, "session_id": f"bench-{i}"})
+        response.raise_for_status()
+        if not response.json().get("generated_file"):
+            raise RuntimeError(response.text)
+        return {}
+
+    return {"run": run}
+
+
+def build_cases() -> dict:
+    cases = {}
+    for layout, style in RENDER_LAYOUTS.items():
+        for rows in RENDER_SIZES:
+            cases[f"render_{layout}_{rows}"] = (setup_render, (style, rows))
+    cases["parse_freetext_llm_50"] = (setup_parse, (free_text_roster(50), 50))
+    cases["parse_csv_local_500"] = (setup_parse, (csv_roster(500), 500))
+    cases["parse_csv_local_2000"] = (setup_parse, (csv_roster(2000), 2000))
+    cases["fix_local_500"] = (setup_fix, ("Student 250 should be Student Two-Fifty", 500, 0))
+    cases["fix_llm_500"] = (setup_fix, ("Please put Student 17 on cello instead", 500, 1))
+    cases["fix_llm_order_500"] = (setup_fix, ("Student 250 should be last", 500, 1))
+    cases["fix_llm_instrument_500"] = (setup_fix, ("Student 250 is actually playing viola", 500, 1))
+    cases["chat_turn"] = (setup_chat, (20,))
+    return cases
+
+
+# ============================================================
+# Child: run one case and print its metrics
+# ============================================================
+def _peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_case(name: str, repeat: int) -> dict:
+    setup, args = build_cases()[name]
+    case = setup(*args)
+    reset = case.get("reset", lambda: None)
+
+    # One untimed run warms imports, fonts and the theme
+    reset()
+    case["run"](-1)
+    rss_before_kb = _peak_rss_kb()
+
+    samples, extra = [], {}
+    for i in range(repeat):
+        reset()
+        start = time.perf_counter()
+        extra = case["run"](i) or {}
+        samples.append(time.perf_counter() - start)
+
+    return {
+        "seconds": round(statistics.median(samples), 5),
+        "min_seconds": round(min(samples), 5),
+        "repeat": repeat,
+        "peak_rss_kb": _peak_rss_kb(),
+        "rss_growth_kb": _peak_rss_kb() - rss_before_kb,
+        **extra,
+    }
+
+
+# ============================================================
+# Parent: run cases in subprocesses, report and compare
+# ============================================================
+def spawn_case(name: str, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory(prefix="musicnbrain-bench-") as scratch:
+        env = dict(os.environ)
+        env.pop("PROJECT_ID", None)
+        env.setdefault("GOOGLE_API_KEY", "bench-key")
+        env["CACHE_DB_PATH"] = os.path.join(scratch, "cache.sqlite3")
+        env["RENDER_CACHE_DIR"] = os.path.join(scratch, "programs")
+        # The chat case stubs the runner; a background warm-up would only add noise
+        env["PREWARM"] = "0"
+        env["PYTHONPATH"] = os.pathsep.join([BACKEND_DIR, BENCH_DIR, env.get("PYTHONPATH", "")])
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", name, "--repeat", str(repeat)],
+            cwd=scratch, env=env, capture_output=True, text=True,
+        )
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    tail = "\n".join(proc.stderr.splitlines()[-15:])
+    raise RuntimeError(f"Case {name} failed (exit {proc.returncode}):\n{tail}")
+
+
+def _format_row(name: str, result: dict, baseline: dict, threshold: float) -> str:
+    pdf = f"{result['pdf_bytes'] / 1024:8.1f} KB" if "pdf_bytes" in result else " " * 11
+    line = (f"{name:<24} {result['seconds'] * 1000:10.2f} ms  "
+            f"rss {result['peak_rss_kb'] / 1024:7.1f} MB  {pdf}")
+    base = baseline.get(name)
+    if base and base.get("seconds"):
+        change = (result["seconds"] - base["seconds"]) / base["seconds"]
+        flag = "  REGRESSION" if change > threshold else ""
+        line += f"  vs baseline {change:+7.1%}{flag}"
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help="Run only cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case (median is reported)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results to the baseline file")
+    parser.add_argument("--threshold", type=float, default=0.20, help="Slowdown that counts as a regression")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(RESULT_PREFIX + json.dumps(run_case(args.child, args.repeat)))
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+
+    names = [name for name in build_cases() if not args.only or args.only in name]
+    results, regressions = {}, []
+    for name in names:
+        result = spawn_case(name, args.repeat)
+        results[name] = result
+        print(_format_row(name, result, baseline, args.threshold), flush=True)
+        base = baseline.get(name)
+        if base and base.get("seconds") and result["seconds"] > base["seconds"] * (1 + args.threshold):
+            regressions.append(name)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        merged = dict(baseline, **results)
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPU",
+                "results": merged,
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Benchmark: festival scheduling. Builds a synthetic festival of N
+performances (mostly piano and strings, with harp, drum kit and mallet
+pieces spread through it, duets, students playing twice and sibling
+pairs), solves it for several rooms with and without setup grouping, and
+reports solve time, stage setups, how unevenly the rooms finish and idle
+waits. Every timetable is checked exhaustively: no performer or sibling
+pair on two stages at once, no overlapping slots in a room, no session
+longer than allowed, nothing before the start time or after the end of
+the day. A one-row edit is then re-solved keeping rooms, as a correction
+to a published timetable is, and the festival is squeezed into fewer
+rooms so it has to run over several days.
+
+    python benchmarks/bench_scheduler.py [--performances 2000] [--rooms 6] [--siblings 100] [--repeat 5]
+"""
+
+import argparse
+import random
+import re
+import statistics
+import sys
+import os
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import parse_clock, performer_names, schedule  # noqa: E402
+
+INSTRUMENTS = [("Piano", 50), ("Violin", 14), ("Cello", 8), ("Voice", 8), ("Flute", 6), ("Guitar", 4),
+               ("Harp", 4), ("Drum kit", 3), ("Marimba", 3)]
+SESSION_MINUTES = 90
+START = "9:00 AM"
+DAY_END = "10:00 PM"
+
+
+def festival(performances: int, sibling_pairs: int, seed: int) -> tuple:
+    """(program rows, sibling groups as names)."""
+    rng = random.Random(seed)
+    instruments = [name for name, weight in INSTRUMENTS for _ in range(weight)]
+    siblings = [[f"student {2 * i} fam{i}", f"student {2 * i + 1} fam{i}"] for i in range(sibling_pairs)]
+    solo_names = [name for pair in siblings for name in pair]
+    rows = []
+    for i in range(performances):
+        roll = rng.random()
+        if roll < 0.05 and siblings:
+            # Siblings playing a duet together
+            a, b = rng.choice(siblings)
+            name, instrument = f"{a} & {b}", "Piano duet"
+        elif roll < 0.15 and solo_names:
+            # A sibling's solo, or a student's second piece
+            name, instrument = rng.choice(solo_names), rng.choice(instruments)
+        else:
+            name, instrument = f"Student {i} Solo", rng.choice(instruments)
+        rows.append({"order": i + 1, "student_name": name, "piece_name": f"Piece {i}",
+                     "instrument": instrument, "estimated_duration_minutes": rng.choice([2, 3, 3, 4, 4, 5, 6, 8])})
+    return rows, siblings
+
+
+_SLOT = re.compile(r"^(\d{2}):(\d{2})(?: \(\+(\d+)d\))?$")
+
+
+def minutes(slot: str) -> int:
+    hours, mins, days = _SLOT.match(slot).groups()
+    return int(days or 0) * 24 * 60 + int(hours) * 60 + int(mins)
+
+
+def violations(result: dict, siblings: list) -> list:
+    """Every overlap the timetable must not have, found pair by pair."""
+    family = {name: f"family:{i}" for i, group in enumerate(siblings) for name in group}
+    by_key, by_room = defaultdict(list), defaultdict(list)
+    for row in result["performances"]:
+        interval = (minutes(row["slot"]), minutes(row["slot_end"]), row)
+        people = performer_names(row["student_name"])
+        for key in {f"person:{name}" for name in people} | {family[name] for name in people if name in family}:
+            by_key[key].append(interval)
+        by_room[row["room"]].append(interval)
+
+    problems = []
+    for key, intervals in list(by_key.items()) + list(by_room.items()):
+        for i, (start_a, end_a, row_a) in enumerate(intervals):
+            for start_b, end_b, row_b in intervals[i + 1:]:
+                if start_a < end_b and start_b < end_a:
+                    problems.append(f"{key}: #{row_a['order']} and #{row_b['order']} overlap")
+    for room in result["rooms"]:
+        for session in room["sessions"]:
+            if minutes(session["end"]) - minutes(session["start"]) > SESSION_MINUTES:
+                problems.append(f"{room['room']}: session {session['start']}-{session['end']} runs long")
+    # Every performance starts and ends on one day, between the start time and the end of the day
+    first, last = parse_clock(START), parse_clock(DAY_END)
+    for row in result["performances"]:
+        begin, end = minutes(row["slot"]), minutes(row["slot_end"])
+        if begin % (24 * 60) < first or end - begin // (24 * 60) * 24 * 60 > last:
+            problems.append(f"#{row['order']} at {row['slot']}-{row['slot_end']} is outside the day")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--performances", type=int, default=2000)
+    parser.add_argument("--rooms", type=int, default=6)
+    parser.add_argument("--siblings", type=int, default=100, help="Sibling pairs that must not overlap")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rows, siblings = festival(args.performances, args.siblings, args.seed)
+    print(f"{args.performances} performances, {args.rooms} rooms, {args.siblings} sibling pairs, "
+          f"{SESSION_MINUTES}-minute sessions, days {START}-{DAY_END}")
+    for label, group_setups in (("grouped setups", True), ("program order", False)):
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = schedule(rows, start=START, rooms=args.rooms, session_minutes=SESSION_MINUTES,
+                              siblings=siblings, group_setups=group_setups, day_end=DAY_END)
+            timings.append(time.perf_counter() - start)
+        ends = [minutes(room["end"]) for room in result["rooms"]]
+        problems = violations(result, siblings)
+        print(f"  {label:<15} solve {statistics.median(timings) * 1000:6.0f} ms   setups {result['changeovers']:>4}   "
+              f"rooms finish within {max(ends) - min(ends):>3} min   waits {result['waits']:>4} min   "
+              f"ends {result['end']:<12} days {result['days']}   violations {len(problems)}")
+        for problem in problems[:5]:
+            print(f"    {problem}")
+
+    # A correction to one row re-solves the published timetable: nobody should change rooms
+    published = schedule(rows, start=START, rooms=args.rooms, session_minutes=SESSION_MINUTES, siblings=siblings,
+                         day_end=DAY_END)
+    edited = [dict(row) for row in published["performances"]]
+    edited[len(edited) // 2]["estimated_duration_minutes"] += 3
+    start = time.perf_counter()
+    result = schedule(edited, start=START, rooms=args.rooms, session_minutes=SESSION_MINUTES,
+                      siblings=siblings, keep_rooms=True, day_end=DAY_END)
+    elapsed = time.perf_counter() - start
+    before = {row["program_position"]: row for row in published["performances"]}
+    moved = sum(before[row["program_position"]]["room"] != row["room"] for row in result["performances"])
+    shifted = sum(before[row["program_position"]]["slot"] != row["slot"] for row in result["performances"])
+    print(f"  re-solve after a one-row edit   {elapsed * 1000:6.0f} ms   room changes {moved}   "
+          f"slots shifted {shifted}   violations {len(violations(result, siblings))}")
+
+    # Too few rooms for one day: the rest must continue the next morning, not run through the night
+    rooms = max(1, args.rooms // 2)
+    result = schedule(rows, start=START, rooms=rooms, session_minutes=SESSION_MINUTES, siblings=siblings,
+                      day_end=DAY_END)
+    latest = max(minutes(row["slot_end"]) % (24 * 60) for row in result["performances"])
+    problems = violations(result, siblings)
+    print(f"  {rooms} rooms over {result['days']} days   latest end of a day {latest // 60:02d}:{latest % 60:02d}   "
+          f"ends {result['end']:<12} violations {len(problems)}")
+    for problem in problems[:5]:
+        print(f"    {problem}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark: streamed parsing of a large free-text roster. The local stub
+endpoint streams the reply for N rows (first piece after --ttft seconds,
+then one piece every --interval seconds). Reports when the first rows and
+all rows reached the session's parse progress, against waiting for the
+whole reply and json.loads as before, and how many rows survive a reply
+cut off halfway.
+
+    python benchmarks/bench_streaming_parse.py [--rows 400] [--ttft 0.3] [--interval 0.015]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_genai_server import StubGenAIServer  # noqa: E402
+
+
+def roster(rows: int) -> str:
+    # Sentences without list markers or delimiters: the local parser gives up
+    return "\n".join(f"After that Student {i} plays a Clementi sonatina on piano" for i in range(1, rows + 1))
+
+
+def reply(rows: int) -> str:
+    return json.dumps({"performances": [
+        {"order": i, "student_name": f"Student {i}", "piece_name": "Sonatina in C (Clementi)", "instrument": "Piano",
+         "estimated_duration_minutes": 3, "confidence": 0.9}
+        for i in range(1, rows + 1)
+    ]}, indent=2)
+
+
+def timed_parse(mcp_server, text: str, session_id: str) -> tuple:
+    """(seconds to the first published rows, seconds to the result, rows, tool result)."""
+    saves = []
+    original_save = mcp_server.PROGRAM_STORE.save
+
+    def save(sid):
+        saves.append((time.perf_counter(), len(mcp_server.PROGRAM_STORE.get(sid).get("parse_progress", ()))))
+        original_save(sid)
+
+    mcp_server.PROGRAM_STORE.save = save
+    mcp_server.PARSE_CACHE.clear()
+    start = time.perf_counter()
+    try:
+        result = mcp_server.parse_program_text(text, session_id=session_id)
+    finally:
+        mcp_server.PROGRAM_STORE.save = original_save
+    elapsed = time.perf_counter() - start
+    first = next((at - start for at, count in saves if count), elapsed)
+    return first, elapsed, len(mcp_server.PROGRAM_STORE.get(session_id)["performances"]), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=400)
+    parser.add_argument("--ttft", type=float, default=0.3, help="Seconds to the first streamed piece")
+    parser.add_argument("--interval", type=float, default=0.015, help="Seconds between streamed pieces")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="musicnbrain-bench-")
+    os.environ["CACHE_DB_PATH"] = os.path.join(scratch, "cache.sqlite3")
+    os.environ["RENDER_CACHE_DIR"] = os.path.join(scratch, "programs")
+    os.chdir(scratch)
+
+    full_reply = reply(args.rows)
+    with StubGenAIServer(reply_text=full_reply, latency=args.ttft, stream_interval=args.interval) as server:
+        os.environ.pop("PROJECT_ID", None)
+        os.environ["GOOGLE_API_KEY"] = "stub-key"
+        os.environ["GENAI_BASE_URL"] = server.url
+
+        import llm
+        import mcp_server
+
+        # One prompt for the whole roster, as the stub answers every prompt with all rows
+        mcp_server.PARSE_CHUNK_ROWS = args.rows + 1
+        text = roster(args.rows)
+        prompt = mcp_server._parse_prompt(text)
+        server.stream_interval, warm_interval = 0.0, server.stream_interval
+        llm.generate_text("warm up")
+        list(llm.stream_many(["warm up"]))
+        server.stream_interval = warm_interval
+
+        print(f"{args.rows} rows, first piece after {args.ttft}s, a piece every {args.interval}s")
+        start = time.perf_counter()
+        rows = json.loads(llm.generate_text(prompt))["performances"]
+        whole = time.perf_counter() - start
+        print(f"  whole reply + json.loads   first rows {whole:6.2f} s   all rows {whole:6.2f} s   {len(rows)} rows")
+
+        first, elapsed, count, _ = timed_parse(mcp_server, text, "bench-stream")
+        print(f"  streamed parse             first rows {first:6.2f} s   all rows {elapsed:6.2f} s   {count} rows")
+
+        server.truncate_at = len(full_reply) // 2
+        try:
+            old_rows = len(json.loads(llm.generate_text(prompt))["performances"])
+        except json.JSONDecodeError:
+            old_rows = 0
+        _, _, count, result = timed_parse(mcp_server, text, "bench-truncated")
+        print(f"  reply cut off halfway      whole-reply parse keeps {old_rows} rows, streamed parse keeps {count}")
+        print(f"    {result.splitlines()[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark: MCP tool transports (agent.MCP_TRANSPORT).
+
+Each transport runs in a fresh interpreter so cold start is real:
+
+    startup    - from building the tools to the first tool call returning
+                 (stdio spawns the server, http starts the shared server,
+                 inprocess imports the tool module)
+    per call   - median and p95 of get_current_program and
+                 update_concert_info through the ADK tool interface, the
+                 same path the agent takes
+
+    python benchmarks/bench_transport.py [--calls 200] [--only stdio,inprocess,http]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRANSPORTS = ("stdio", "http", "inprocess")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _p95(samples: list) -> float:
+    return sorted(samples)[int(len(samples) * 0.95) - 1]
+
+
+async def _measure(transport: str, calls: int) -> dict:
+    from google.adk.agents.invocation_context import InvocationContext
+    from google.adk.sessions import InMemorySessionService
+    from google.adk.tools.tool_context import ToolContext
+
+    import agent
+
+    service = InMemorySessionService()
+    session = await service.create_session(app_name="bench", user_id="bench")
+    tool_context = ToolContext(InvocationContext(
+        session_service=service, invocation_id="bench", agent=agent.concert_agent, session=session))
+
+    start = time.perf_counter()
+    tools = agent.build_concert_tools(transport)
+    toolsets = [tool for tool in tools if isinstance(tool, agent.McpToolset)]
+    for toolset in toolsets:
+        tools = await toolset.get_tools()
+    by_name = {tool.name: tool for tool in tools}
+    await by_name["get_current_program"].run_async(args={"session_id": "bench"}, tool_context=tool_context)
+    startup = time.perf_counter() - start
+
+    results = {"transport": transport, "startup_seconds": startup}
+    for name, args in (("get_current_program", {"session_id": "bench"}),
+                       ("update_concert_info", {"session_id": "bench", "venue": "Jordan Hall"})):
+        samples = []
+        for _ in range(calls):
+            call_start = time.perf_counter()
+            await by_name[name].run_async(args=dict(args), tool_context=tool_context)
+            samples.append(time.perf_counter() - call_start)
+        results[name] = {"median_ms": statistics.median(samples) * 1000, "p95_ms": _p95(samples) * 1000}
+
+    for toolset in toolsets:
+        await toolset.close()
+    return results
+
+
+def run_child(transport: str, calls: int) -> None:
+    # The stdio/http servers inherit this environment, so they use the scratch cache too
+    scratch = tempfile.mkdtemp(prefix="musicnbrain-bench-")
+    os.environ["CACHE_DB_PATH"] = os.path.join(scratch, "cache.sqlite3")
+    os.environ["RENDER_CACHE_DIR"] = os.path.join(scratch, "programs")
+    os.environ["MCP_HTTP_PORT"] = str(_free_port())
+    # Importing the agent must not start anything; the measured build does
+    os.environ["MCP_TRANSPORT"] = "stdio"
+    os.chdir(scratch)
+    sys.path.insert(0, BACKEND_DIR)
+
+    result = asyncio.run(_measure(transport, calls))
+    print("BENCH_RESULT " + json.dumps(result), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--only", default=",".join(TRANSPORTS))
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.calls)
+        return
+
+    print(f"{'transport':<10} {'startup':>9}   {'get_current_program':>22}   {'update_concert_info':>22}")
+    print(f"{'':<10} {'':>9}   {'median':>10} {'p95':>11}   {'median':>10} {'p95':>11}")
+    for transport in args.only.split(","):
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", transport, "--calls", str(args.calls)],
+            capture_output=True, text=True,
+        )
+        lines = [line for line in child.stdout.splitlines() if line.startswith("BENCH_RESULT ")]
+        if not lines:
+            print(f"{transport:<10} failed:\n{child.stderr[-2000:]}")
+            continue
+        result = json.loads(lines[-1][len("BENCH_RESULT "):])
+        get, update = result["get_current_program"], result["update_concert_info"]
+        print(f"{transport:<10} {result['startup_seconds']:>8.2f}s   "
+              f"{get['median_ms']:>8.2f}ms {get['p95_ms']:>9.2f}ms   "
+              f"{update['median_ms']:>8.2f}ms {update['p95_ms']:>9.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark: event-loop responsiveness while an upload is saved. A ticker
+coroutine measures the longest stall of the loop while a large upload is
+written by the old synchronous shutil.copyfileobj and by UploadStore
+(chunked copy on a worker thread). Also reports disk use after the same
+file is uploaded repeatedly.
+
+    python benchmarks/bench_upload.py [--mb 100] [--copies 5]
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def _max_stall(work) -> tuple:
+    """(seconds the work took, longest gap between 1 ms ticks while it ran)."""
+    stalls = [0.0]
+    done = asyncio.Event()
+
+    async def ticker():
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stalls.append(now - last)
+            last = now
+
+    ticking = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - start
+    done.set()
+    await ticking
+    return elapsed, max(stalls)
+
+
+def _upload(path: str):
+    from starlette.datastructures import UploadFile
+
+    return UploadFile(open(path, "rb"), filename="roster.csv")
+
+
+async def run(args) -> None:
+    from upload_store import UploadStore
+
+    source = os.path.join(os.getcwd(), "source.csv")
+    with open(source, "wb") as f:
+        f.write(os.urandom(args.mb * 1024 * 1024))
+
+    async def old_copy():
+        upload = _upload(source)
+        os.makedirs("static/uploads", exist_ok=True)
+        with open(f"static/uploads/{upload.filename}", "wb+") as f:
+            shutil.copyfileobj(upload.file, f)
+        upload.file.close()
+
+    store = UploadStore("uploads", max_file_bytes=(args.mb + 1) * 1024 * 1024,
+                        session_quota_bytes=10 ** 12, total_quota_bytes=10 ** 12)
+
+    async def store_copy():
+        upload = _upload(source)
+        await store.save_upload(upload, "bench")
+        upload.file.close()
+
+    print(f"{args.mb} MB upload")
+    for label, work in (("copyfileobj in handler", old_copy), ("UploadStore (thread)", store_copy)):
+        elapsed, stall = await _max_stall(work)
+        print(f"  {label:<24} {elapsed * 1000:8.0f} ms   longest loop stall {stall * 1000:8.1f} ms")
+
+    for _ in range(args.copies - 1):
+        await store_copy()
+    print(f"  {args.copies} identical uploads use {store.total_bytes / (1024 * 1024):.0f} MB on disk")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=int, default=100)
+    parser.add_argument("--copies", type=int, default=5)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="musicnbrain-bench-"))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
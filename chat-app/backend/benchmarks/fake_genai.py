@@ -0,0 +1,76 @@
+"""
+In-process fake of the GenAI client for offline benchmarks.
+Install it with llm.set_client(FakeGenAIClient(responder)); every
+generate_content call returns responder(prompt) as the response text,
+after an optional simulated model latency (seconds, or a function of the
+prompt for latency that grows with the output). Streamed calls get the same
+text in pieces, with the latency spread over them.
+"""
+
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Union
+
+
+def _prompt_text(contents) -> str:
+    if isinstance(contents, str):
+        return contents
+    return "\n".join(part if isinstance(part, str) else str(part) for part in contents)
+
+
+class _Models:
+    def __init__(self, client: "FakeGenAIClient"):
+        self._client = client
+
+    def generate_content(self, model: str, contents, config=None):
+        return self._client._respond(contents)
+
+
+class _AsyncModels:
+    def __init__(self, client: "FakeGenAIClient"):
+        self._client = client
+
+    async def generate_content(self, model: str, contents, config=None):
+        await asyncio.sleep(self._client._latency_for(contents))
+        return self._client._reply(contents)
+
+    async def generate_content_stream(self, model: str, contents, config=None):
+        latency = self._client._latency_for(contents)
+        text = self._client._reply(contents).text
+        size = self._client.stream_chunk_chars
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+        async def stream():
+            for piece in pieces:
+                await asyncio.sleep(latency / len(pieces))
+                yield SimpleNamespace(text=piece)
+
+        return stream()
+
+
+class FakeGenAIClient:
+    """Deterministic stand-in for google.genai.Client (models.generate_content only)."""
+
+    def __init__(self, responder: Callable[[str], str], latency: Union[float, Callable[[str], float]] = 0.0,
+                 stream_chunk_chars: int = 256):
+        self.responder = responder
+        self.latency = latency
+        self.stream_chunk_chars = stream_chunk_chars
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.models = _Models(self)
+        self.aio = SimpleNamespace(models=_AsyncModels(self))
+
+    def _latency_for(self, contents) -> float:
+        return self.latency(_prompt_text(contents)) if callable(self.latency) else self.latency
+
+    def _reply(self, contents):
+        with self._lock:
+            self.calls += 1
+        return SimpleNamespace(text=self.responder(_prompt_text(contents)))
+
+    def _respond(self, contents):
+        time.sleep(self._latency_for(contents))
+        return self._reply(contents)
@@ -0,0 +1,107 @@
+"""
+Cold-start report for the API server.
+
+    1. `python -X importtime -c "import main"`: total import time and the
+       slowest top-level packages (cumulative, self time of their modules summed)
+    2. time-to-healthy: from launching uvicorn to the first 200 from /api/health
+
+Both run in a scratch directory with PREWARM=0 so the numbers describe the
+request path, not the background warm-up.
+
+    python benchmarks/startup_report.py [--top 15] [--budget 1.0]
+
+Exits 1 if time-to-healthy exceeds --budget seconds.
+"""
+
+import argparse
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def _environment(scratch: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": BACKEND_DIR,
+        "PREWARM": "0",
+        "CACHE_DB_PATH": os.path.join(scratch, "cache.sqlite3"),
+        "SESSION_DB_PATH": os.path.join(scratch, "sessions.sqlite3"),
+        "RENDER_CACHE_DIR": os.path.join(scratch, "programs"),
+        "METRICS_DIR": os.path.join(scratch, "metrics"),
+    })
+    return env
+
+
+def import_report(scratch: str) -> tuple:
+    """(total seconds, {top-level package: self seconds summed over its modules})"""
+    child = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                           cwd=scratch, env=_environment(scratch), capture_output=True, text=True)
+    if child.returncode != 0:
+        raise RuntimeError(child.stderr[-2000:])
+
+    total = 0.0
+    by_package = defaultdict(float)
+    for line in child.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        by_package[module.split(".")[0]] += int(self_us) / 1e6
+        if module == "main":
+            total = int(cumulative_us) / 1e6
+    return total, dict(by_package)
+
+
+def time_to_healthy(scratch: str, timeout: float = 30) -> float:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=scratch, env=_environment(scratch), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"/api/health did not answer within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15, help="Packages to list")
+    parser.add_argument("--budget", type=float, default=1.0, help="Maximum seconds to a healthy /api/health")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="musicnbrain-startup-")
+    total, by_package = import_report(scratch)
+    print(f"import main: {total:.3f} s")
+    for package, seconds in sorted(by_package.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {package:<28} {seconds:7.3f} s")
+
+    healthy = time_to_healthy(scratch)
+    print(f"time to healthy /api/health: {healthy:.3f} s (budget {args.budget:.1f} s)")
+    sys.exit(1 if healthy > args.budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Local stub of the Gemini generateContent endpoint for offline benchmarks.
+Answers every POST with a canned model reply over HTTP/1.1 keep-alive, with
+optional injected latency and error rate. streamGenerateContent requests get
+the reply as server-sent events, `stream_chunk_chars` characters at a time
+`stream_interval` seconds apart (plain requests wait as long, then get it
+all), optionally cut off after `truncate_at` characters (as when the model
+hits its output limit).
+"""
+
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.requests += 1
+
+        delay = server.latency() if callable(server.latency) else server.latency
+        if delay:
+            time.sleep(delay)
+
+        if server.error_rate and server.rng.random() < server.error_rate:
+            body = json.dumps({"error": {"code": 503, "message": "injected failure", "status": "UNAVAILABLE"}})
+            status = 503
+        elif "streamGenerateContent" in self.path:
+            self._stream_reply(server)
+            return
+        else:
+            text = server.text()
+            if server.stream_interval:
+                time.sleep(server.stream_interval * (len(server.pieces(text)) - 1))
+            body = json.dumps({
+                "candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                                "finishReason": "STOP" if server.truncate_at is None else "MAX_TOKENS"}],
+                "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": 10, "totalTokenCount": 20},
+            })
+            status = 200
+
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream_reply(self, server):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        pieces = server.pieces(server.text())
+        for i, piece in enumerate(pieces):
+            if i and server.stream_interval:
+                time.sleep(server.stream_interval)
+            event = {"candidates": [{"content": {"role": "model", "parts": [{"text": piece}]}}]}
+            if i == len(pieces) - 1:
+                event["candidates"][0]["finishReason"] = "STOP" if server.truncate_at is None else "MAX_TOKENS"
+            data = f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class StubGenAIServer(ThreadingHTTPServer):
+    """
+    Usage:
+        with StubGenAIServer(reply_text='{"performances": []}') as server:
+            os.environ["GENAI_BASE_URL"] = server.url
+    `latency` is seconds or a zero-arg callable returning seconds.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, reply_text: str = "{}", latency=0.0, error_rate: float = 0.0, seed: int = 0,
+                 stream_chunk_chars: int = 200, stream_interval: float = 0.0, truncate_at: int = None):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.reply_text = reply_text
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_interval = stream_interval
+        self.truncate_at = truncate_at
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def handle_error(self, request, client_address):
+        # A client that gave up on a slow answer (timeout, losing hedge) closed the socket
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def text(self) -> str:
+        return self.reply_text[:self.truncate_at] if self.truncate_at is not None else self.reply_text
+
+    def pieces(self, text: str) -> list:
+        return [text[i:i + self.stream_chunk_chars] for i in range(0, len(text), self.stream_chunk_chars)] or [""]
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,178 @@
+"""
+MusicNBrain Image Ingest - Prepare photographed programs for the model
+Phone photos arrive as multi-megabyte JPEG/HEIC/PNG files. Each upload is
+validated by its magic bytes, downscaled to a resolution that is still
+comfortable for OCR, re-encoded as JPEG without EXIF (GPS, camera data),
+and stored once under the hash of the original bytes, so re-sending the
+same photo costs neither disk space nor processing.
+
+Pillow is optional: without it uploads are validated and deduplicated but
+stored as sent.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import re
+from typing import Optional
+
+from upload_store import UploadStore
+
+logger = logging.getLogger(__name__)
+
+IMAGE_DIR = os.getenv("IMAGE_DIR", os.path.join("cache", "images"))
+MAX_IMAGE_UPLOAD_BYTES = int(os.getenv("MAX_IMAGE_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+# Longest edge after downscaling; ~2000 px keeps handwriting legible
+OCR_MAX_EDGE = int(os.getenv("OCR_MAX_EDGE", "2000"))
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "80"))
+# Refuse images that would decode to more pixels than this (decompression bombs)
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(80_000_000)))
+
+EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/heic": ".heic",
+    "image/heif": ".heif",
+}
+MIME_TYPES = {extension: mime for mime, extension in EXTENSIONS.items()}
+
+# Prepared images share the upload quotas and expiry
+IMAGE_STORE = UploadStore(IMAGE_DIR)
+
+_REF_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class ImageRejected(ValueError):
+    """Raised when an upload is not an image we can use."""
+
+
+def sniff_image_type(data: bytes) -> Optional[str]:
+    """MIME type from the file signature, or None for anything that is not a supported image."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp":
+        brand = data[8:12]
+        if brand in (b"heic", b"heix", b"heim", b"heis"):
+            return "image/heic"
+        if brand in (b"mif1", b"msf1", b"heif"):
+            return "image/heif"
+    return None
+
+
+def _pillow() -> Optional[tuple]:
+    """(Image, ImageOps), or None without Pillow. Imported on first upload to keep startup fast."""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:  # Pillow comes with reportlab, but stay usable without it
+        return None
+    return Image, ImageOps
+
+
+def _downscale(data: bytes, Image, ImageOps) -> Optional[bytes]:
+    """JPEG at most OCR_MAX_EDGE on its longest side, upright and without metadata; None if undecodable."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            if width * height > MAX_IMAGE_PIXELS:
+                raise ImageRejected(f"Image is too large ({width}x{height} pixels).")
+            # JPEG decodes straight to a reduced scale, which is much faster than a full decode
+            image.draft("RGB", (OCR_MAX_EDGE, OCR_MAX_EDGE))
+            # Apply the EXIF orientation before the EXIF block is dropped
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, "white")
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            elif image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.thumbnail((OCR_MAX_EDGE, OCR_MAX_EDGE), Image.LANCZOS)
+
+            output = io.BytesIO()
+            # No exif= argument: the saved file carries no metadata
+            image.save(output, "JPEG", quality=OCR_JPEG_QUALITY, optimize=True)
+            return output.getvalue()
+    except ImageRejected:
+        raise
+    except Exception as e:
+        logger.info(f"Pillow could not decode the upload: {e}")
+        return None
+
+
+def _stored_path(image_ref: str) -> Optional[str]:
+    for extension in MIME_TYPES:
+        path = os.path.join(IMAGE_DIR, image_ref + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def ingest_image(data: bytes, session_id: str = "") -> dict:
+    """
+    Validate, prepare and store an uploaded image for a chat session. Returns
+    {"image_ref", "mime_type", "path", "original_bytes", "stored_bytes", "deduplicated"}.
+    Raises ImageRejected for empty, oversized, unknown or corrupt uploads, and
+    UploadRejected when the session or the store is out of quota.
+    """
+    if not data:
+        raise ImageRejected("The uploaded file is empty.")
+    if len(data) > MAX_IMAGE_UPLOAD_BYTES:
+        raise ImageRejected(f"Images can be at most {MAX_IMAGE_UPLOAD_BYTES // (1024 * 1024)} MB.")
+    mime_type = sniff_image_type(data)
+    if mime_type is None:
+        raise ImageRejected("The uploaded file is not a JPEG, PNG, GIF, WebP or HEIC image.")
+
+    image_ref = hashlib.sha256(data).hexdigest()[:32]
+    existing = IMAGE_STORE.find(image_ref)
+    if existing and IMAGE_STORE.touch(image_ref, session_id):
+        return {
+            "image_ref": image_ref,
+            "mime_type": MIME_TYPES[os.path.splitext(existing)[1]],
+            "path": existing,
+            "original_bytes": len(data),
+            "stored_bytes": os.path.getsize(existing),
+            "deduplicated": True,
+        }
+
+    pillow = _pillow()
+    prepared = _downscale(data, *pillow) if pillow is not None else None
+    if prepared is not None:
+        stored, mime_type = prepared, "image/jpeg"
+    elif pillow is not None and mime_type not in ("image/heic", "image/heif"):
+        # Pillow reads every other type we accept, so this file is broken
+        raise ImageRejected("The uploaded image could not be read.")
+    else:
+        # HEIC without a Pillow plugin, or no Pillow at all: the model reads the original
+        stored = data
+
+    path = IMAGE_STORE.put_bytes(stored, EXTENSIONS[mime_type], session_id, key=image_ref)["path"]
+    logger.info(f"Stored image {image_ref}: {len(data)} -> {len(stored)} bytes ({mime_type})")
+    return {
+        "image_ref": image_ref,
+        "mime_type": mime_type,
+        "path": path,
+        "original_bytes": len(data),
+        "stored_bytes": len(stored),
+        "deduplicated": False,
+    }
+
+
+def load_image(image_ref: str) -> tuple:
+    """(bytes, mime_type) of a stored image. Raises ImageRejected for unknown refs."""
+    if not _REF_PATTERN.fullmatch(image_ref or ""):
+        raise ImageRejected(f"Invalid image reference: {image_ref!r}")
+    path = _stored_path(image_ref)
+    if path is None:
+        raise ImageRejected(f"No uploaded image with reference {image_ref}.")
+    # The store's expiry goes by mtime for reads from other processes
+    os.utime(path)
+    with open(path, "rb") as f:
+        return f.read(), MIME_TYPES[os.path.splitext(path)[1]]
@@ -0,0 +1,120 @@
+"""
+MusicNBrain JSON Stream - Incremental reader for streamed model replies
+The parser prompt asks for {"performances": [{...}, {...}]}. ArrayItemStream
+is fed the reply text as it arrives and hands back each array item as soon
+as its closing brace is seen, so rows can be shown before the model is done
+and a reply cut off mid-way still yields every complete row. Markdown
+fences and other text around the JSON are skipped.
+"""
+
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Outside strings: a whole string, a bracket, or the quote of a string that
+# continues in the next piece of text
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]|"')
+_STRING_END = re.compile(r'["\\]')
+
+
+class ArrayItemStream:
+    """
+    Scanner for the objects in the `key` array of a JSON reply (or in a bare
+    top-level array). feed() returns the items completed by the new text;
+    `found` and `closed` tell whether the array started and ended.
+    """
+
+    def __init__(self, key: str = "performances"):
+        self.key = key
+        self.items = []
+        self.found = False
+        self.closed = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_parts = []
+        self._last_key = None
+        self._array_depth = None
+        self._item_parts = None
+
+    def feed(self, text: str) -> list:
+        completed = []
+        position = 0
+        item_start = 0 if self._item_parts is not None else None
+        while position < len(text) and not self.closed:
+            if self._in_string:
+                position = self._scan_string(text, position)
+                continue
+            match = _TOKEN.search(text, position)
+            if match is None:
+                break
+            char, position = match.group(), match.end()
+            if char[0] == '"':
+                # Only top-level strings are kept: a key (or value) of the reply object
+                if len(char) > 1:
+                    if self._depth == 1:
+                        self._last_key = char[1:-1]
+                else:
+                    self._in_string = True
+                    self._string_parts = [] if self._depth == 1 else None
+            elif char in "{[":
+                if self._array_depth is not None and self._depth == self._array_depth and char == "{":
+                    self._item_parts, item_start = [], match.start()
+                self._depth += 1
+                if char == "[" and self._array_depth is None and (
+                        self._depth == 1 or (self._depth == 2 and self._last_key == self.key)):
+                    self._array_depth = self._depth
+                    self.found = True
+            else:
+                self._depth -= 1
+                if self._array_depth is not None and self._depth == self._array_depth and self._item_parts is not None:
+                    self._item_parts.append(text[item_start:position])
+                    item = self._decode("".join(self._item_parts))
+                    self._item_parts, item_start = None, None
+                    if item is not None:
+                        completed.append(item)
+                elif self._array_depth is not None and self._depth < self._array_depth:
+                    self.closed = True
+        if self._item_parts is not None and item_start is not None:
+            self._item_parts.append(text[item_start:])
+        self.items.extend(completed)
+        return completed
+
+    def _scan_string(self, text: str, position: int) -> int:
+        """Consume string contents up to the closing quote; returns the next position."""
+        parts = self._string_parts
+        if self._escaped:
+            self._escaped = False
+            position += 1
+        while True:
+            match = _STRING_END.search(text, position)
+            if match is None:
+                if parts is not None:
+                    parts.append(text[position:])
+                return len(text)
+            if match.group() == "\\":
+                # Skip the escaped character (it may be in the next piece of text)
+                if parts is not None:
+                    parts.append(text[position:match.end() + 1])
+                if match.end() == len(text):
+                    self._escaped = True
+                    return len(text)
+                position = match.end() + 1
+                continue
+            self._in_string = False
+            if parts is not None:
+                parts.append(text[position:match.start()])
+                # A key or a value; the next "[" decides whether it named the array
+                self._last_key = "".join(parts)
+            return match.end()
+
+    @staticmethod
+    def _decode(text: str):
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Skipping an unreadable row in the model reply: {e}")
+            return None
+        return item if isinstance(item, dict) else None
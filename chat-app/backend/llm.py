@@ -0,0 +1,578 @@
+"""
+MusicNBrain LLM - Shared Gemini/GenAI client and call helpers
+One client is created lazily per process and reused by every tool call, so
+the HTTP connection pool (keep-alive, TLS sessions) survives between calls.
+Every call has a deadline; transient failures are retried with jittered
+exponential backoff under a shared retry budget, and a call slower than the
+recent p95 gets a second (hedged) request, whichever answers first wins.
+Streamed calls hand over the reply text piece by piece as it is generated.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+_client = None
+_client_lock = threading.Lock()
+
+# Event loop for async calls made from sync code (tools run in worker threads).
+# One long-lived loop, because the async client's connections belong to a loop.
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+# At most this many model calls run at once in this process; the rest wait
+# (up to LLM_SLOT_TIMEOUT_SECONDS) instead of piling onto the API
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_SLOT_TIMEOUT_SECONDS = float(os.getenv("LLM_SLOT_TIMEOUT_SECONDS", "60"))
+_llm_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+
+# Each call must finish within LLM_DEADLINE_SECONDS overall (retries included),
+# and a single request is abandoned after LLM_ATTEMPT_TIMEOUT_SECONDS
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "120"))
+LLM_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "90"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "8"))
+# Retries and hedges together add at most this fraction of extra requests,
+# plus a reserve of LLM_RETRY_BUDGET_RESERVE for quiet periods
+LLM_RETRY_BUDGET_RATIO = float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.2"))
+LLM_RETRY_BUDGET_RESERVE = float(os.getenv("LLM_RETRY_BUDGET_RESERVE", "10"))
+# Hedging starts once LLM_HEDGE_MIN_SAMPLES latencies of similar calls are known
+LLM_HEDGE = os.getenv("LLM_HEDGE", "1") != "0"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# A streamed reply that sends nothing for this long after its first piece is abandoned
+LLM_STREAM_STALL_SECONDS = float(os.getenv("LLM_STREAM_STALL_SECONDS", "30"))
+
+_RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class LLMBusy(RuntimeError):
+    """Raised when no model call slot frees up within LLM_SLOT_TIMEOUT_SECONDS."""
+
+
+class LLMTimeout(TimeoutError):
+    """Raised when a model request or call runs past its deadline."""
+
+
+def _build_client():
+    """Build the Gemini/GenAI client based on available credentials."""
+    from google import genai
+    from google.genai import types
+
+    project_id = os.getenv("PROJECT_ID")
+    api_key = os.getenv("GOOGLE_API_KEY")
+
+    # GENAI_BASE_URL points the client at a proxy or a local stub server
+    http_options = None
+    if os.getenv("GENAI_BASE_URL"):
+        http_options = types.HttpOptions(base_url=os.getenv("GENAI_BASE_URL"))
+
+    if project_id:
+        return genai.Client(vertexai=True, project=project_id, location=os.getenv("LOCATION", "us-central1"),
+                            http_options=http_options)
+    elif api_key:
+        return genai.Client(api_key=api_key, http_options=http_options)
+    else:
+        raise ValueError("Neither PROJECT_ID nor GOOGLE_API_KEY found. Cannot initialize LLM client.")
+
+
+def get_client():
+    """Get the process-wide GenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+                logger.info("GenAI client created")
+    return _client
+
+
+def get_async_client():
+    """The asyncio flavour of the shared client (same connection settings)."""
+    return get_client().aio
+
+
+def set_client(client) -> None:
+    """Replace the shared client, e.g. with a fake in benchmarks. None resets it."""
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def strip_code_fences(text: str) -> str:
+    """Remove a ```json ... ``` wrapper the model sometimes adds."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.endswith("```"):
+            text = text[:-3].strip()
+    return text
+
+
+def _record_call(model: str, prompt: str, text: str, started: float, outcome: str, span) -> None:
+    """Latency and size metrics (and the trace span, if any) for one model call."""
+    metrics.LLM_SECONDS.observe(time.perf_counter() - started, model=model, outcome=outcome)
+    metrics.LLM_PROMPT_CHARS.observe(len(prompt), model=model)
+    if outcome == "ok":
+        metrics.LLM_RESPONSE_CHARS.observe(len(text), model=model)
+    if span is not None:
+        span.end(outcome=outcome, prompt_chars=len(prompt), response_chars=len(text))
+
+
+def _contents(prompt: str, images: tuple, model: str) -> list:
+    """The request contents: inline image parts (bytes, mime type) first, then the prompt."""
+    if not images:
+        return [prompt]
+    from google.genai import types
+
+    metrics.LLM_INLINE_BYTES.observe(sum(len(data) for data, _ in images), model=model)
+    return [types.Part.from_bytes(data=data, mime_type=mime_type) for data, mime_type in images] + [prompt]
+
+
+# ============================================================
+# Retry budget and latency tracking
+# ============================================================
+class RetryBudget:
+    """
+    Token bucket shared by retries and hedges. Every call deposits `ratio`
+    tokens (up to `reserve`) and every extra request spends one, so during
+    an outage the extra load stays near `ratio` instead of multiplying
+    each call by the number of attempts.
+    """
+
+    def __init__(self, ratio: float = LLM_RETRY_BUDGET_RATIO, reserve: float = LLM_RETRY_BUDGET_RESERVE):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._tokens = reserve
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self.reserve, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class LatencyTracker:
+    """Recent successful request times per model and prompt size, for the hedge delay."""
+
+    def __init__(self, window: int = 200, quantile: float = LLM_HEDGE_QUANTILE,
+                 min_samples: int = LLM_HEDGE_MIN_SAMPLES):
+        self.window = window
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(model: str, prompt_chars: int) -> tuple:
+        # Size classes grow by factors of 4: a 500-row parse is not timed against a one-line fix
+        return model, prompt_chars.bit_length() // 2
+
+    def observe(self, model: str, prompt_chars: int, seconds: float) -> None:
+        key = self._key(model, prompt_chars)
+        with self._lock:
+            if key not in self._samples:
+                self._samples[key] = deque(maxlen=self.window)
+            self._samples[key].append(seconds)
+
+    def hedge_delay(self, model: str, prompt_chars: int) -> Optional[float]:
+        """The recent quantile latency for calls like this one, or None until enough are known."""
+        with self._lock:
+            samples = sorted(self._samples.get(self._key(model, prompt_chars), ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(self.quantile * len(samples)))]
+
+
+_retry_budget = RetryBudget()
+_latencies = LatencyTracker()
+# Streamed calls are hedged on the time to their first piece, tracked separately
+_first_chunk_latencies = LatencyTracker()
+
+
+def _retry_reason(error: BaseException) -> Optional[str]:
+    """Why a failed request is worth retrying ("timeout", "http_503", ...), or None."""
+    import httpx
+    from google.genai import errors
+
+    if isinstance(error, TimeoutError):
+        return "timeout"
+    if isinstance(error, errors.APIError):
+        return f"http_{error.code}" if error.code in _RETRYABLE_STATUS_CODES else None
+    if isinstance(error, (httpx.TransportError, ConnectionError)):
+        return "connection"
+    return None
+
+
+# ============================================================
+# Concurrency slots
+# ============================================================
+def _slot_acquired(model: str, started: float) -> None:
+    metrics.LLM_WAIT_SECONDS.observe(time.perf_counter() - started, model=model)
+    metrics.LLM_IN_FLIGHT.inc()
+
+
+def _release_slot() -> None:
+    metrics.LLM_IN_FLIGHT.dec()
+    _llm_slots.release()
+
+
+@asynccontextmanager
+async def _llm_slot(model: str):
+    """Take one of the process-wide call slots; waiting happens on an executor thread, not the loop."""
+    started = time.perf_counter()
+    if not _llm_slots.acquire(blocking=False):
+        waiting = asyncio.get_running_loop().run_in_executor(None, _llm_slots.acquire, True, LLM_SLOT_TIMEOUT_SECONDS)
+        try:
+            acquired = await asyncio.shield(waiting)
+        except asyncio.CancelledError:
+            # The thread may still get a slot after we stop waiting; hand it back
+            waiting.add_done_callback(lambda f: f.result() and _llm_slots.release())
+            raise
+        if not acquired:
+            raise LLMBusy(f"No model call slot free after {LLM_SLOT_TIMEOUT_SECONDS:.0f}s")
+    _slot_acquired(model, started)
+    try:
+        yield
+    finally:
+        _release_slot()
+
+
+# ============================================================
+# Calls
+# ============================================================
+async def _attempt(model: str, contents: list, prompt: str, timeout: float) -> str:
+    """One request to the model, abandoned after `timeout` seconds."""
+    async with _llm_slot(model):
+        span = metrics.start_span("llm.generate_content", model=model)
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                get_async_client().models.generate_content(model=model, contents=contents), timeout)
+        except asyncio.CancelledError:
+            # The other request of a hedged pair won
+            _record_call(model, prompt, "", started, "cancelled", span)
+            raise
+        except TimeoutError:
+            _record_call(model, prompt, "", started, "timeout", span)
+            raise LLMTimeout(f"Model request took longer than {timeout:.0f}s")
+        except Exception:
+            _record_call(model, prompt, "", started, "error", span)
+            raise
+    text = response.text or ""
+    _record_call(model, prompt, text, started, "ok", span)
+    _latencies.observe(model, len(prompt), time.perf_counter() - started)
+    return strip_code_fences(text)
+
+
+async def _hedged_attempt(model: str, contents: list, prompt: str, timeout: float) -> str:
+    """
+    One attempt, plus a second request if the first runs past the recent p95
+    for similar calls. The first success wins and the other is cancelled.
+    """
+    delay = _latencies.hedge_delay(model, len(prompt)) if LLM_HEDGE else None
+    if delay is None or delay >= timeout:
+        return await _attempt(model, contents, prompt, timeout)
+
+    primary = asyncio.ensure_future(_attempt(model, contents, prompt, timeout))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            if _retry_budget.try_spend():
+                tasks.append(asyncio.ensure_future(_attempt(model, contents, prompt, timeout - delay)))
+            else:
+                metrics.LLM_BUDGET_DENIED.inc(model=model, kind="hedge")
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if len(tasks) > 1:
+                        metrics.LLM_HEDGES.inc(model=model, winner="primary" if task is primary else "hedge")
+                    return task.result()
+        if len(tasks) > 1:
+            metrics.LLM_HEDGES.inc(model=model, winner="none")
+        return primary.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def generate_text_async(prompt: str, model: str = DEFAULT_MODEL, images: tuple = (),
+                              deadline: float = LLM_DEADLINE_SECONDS) -> str:
+    """
+    Run one prompt through the shared client and return the unfenced text.
+    `images` are (bytes, mime type) pairs sent inline ahead of the prompt.
+    Timeouts, 429/5xx answers and dropped connections are retried with
+    jittered exponential backoff while the deadline and retry budget allow.
+    """
+    contents = _contents(prompt, images, model)
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + deadline
+    _retry_budget.deposit()
+    attempt = 1
+    while True:
+        timeout = min(LLM_ATTEMPT_TIMEOUT_SECONDS, give_up_at - loop.time())
+        try:
+            return await _hedged_attempt(model, contents, prompt, timeout)
+        except Exception as e:
+            reason = _retry_reason(e)
+            if reason is None or attempt >= LLM_MAX_ATTEMPTS:
+                raise
+            # "Full jitter": a random wait up to the exponential cap spreads out retry storms
+            backoff = random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** (attempt - 1)))
+            if backoff >= give_up_at - loop.time():
+                raise
+            if not _retry_budget.try_spend():
+                metrics.LLM_BUDGET_DENIED.inc(model=model, kind="retry")
+                logger.warning(f"Model call failed ({reason}); retry budget exhausted, giving up")
+                raise
+            metrics.LLM_RETRIES.inc(model=model, reason=reason)
+            logger.warning(f"Model call failed ({reason}); retry {attempt} in {backoff:.2f}s")
+            await asyncio.sleep(backoff)
+            attempt += 1
+
+
+def generate_text(prompt: str, model: str = DEFAULT_MODEL, images: tuple = (),
+                  deadline: float = LLM_DEADLINE_SECONDS) -> str:
+    """Blocking generate_text_async for tools running in worker threads."""
+    return run_coroutine(generate_text_async(prompt, model, images, deadline))
+
+
+class _OpenStream:
+    """A streamed request whose first piece of text has arrived; holds its call slot until closed."""
+
+    def __init__(self, model: str, prompt: str, stack: AsyncExitStack, chunks, first: str, started: float, span):
+        self.model = model
+        self.prompt = prompt
+        self.stack = stack
+        self.chunks = chunks
+        self.received = [first] if first else []
+        self.started = started
+        self.span = span
+
+    async def close(self, outcome: str) -> None:
+        _record_call(self.model, self.prompt, "".join(self.received), self.started, outcome, self.span)
+        try:
+            if self.chunks is not None and hasattr(self.chunks, "aclose"):
+                await self.chunks.aclose()
+        finally:
+            await self.stack.aclose()
+
+
+async def _open_stream(model: str, contents: list, prompt: str, timeout: float) -> _OpenStream:
+    """Start a streamed request and wait at most `timeout` seconds for its first piece of text."""
+    stack = AsyncExitStack()
+    await stack.enter_async_context(_llm_slot(model))
+    span = metrics.start_span("llm.generate_content_stream", model=model)
+    started = time.perf_counter()
+    chunks = None
+    try:
+        async with asyncio.timeout(timeout):
+            stream = await get_async_client().models.generate_content_stream(model=model, contents=contents)
+            chunks = aiter(stream)
+            first = ""
+            while not first:
+                try:
+                    first = (await anext(chunks)).text or ""
+                except StopAsyncIteration:
+                    # An empty reply: nothing more to read
+                    chunks = None
+                    break
+    except BaseException as e:
+        opened = _OpenStream(model, prompt, stack, chunks, "", started, span)
+        if isinstance(e, TimeoutError):
+            await opened.close("timeout")
+            raise LLMTimeout(f"Model sent nothing for {timeout:.0f}s") from e
+        await opened.close("cancelled" if isinstance(e, asyncio.CancelledError) else "error")
+        raise
+    elapsed = time.perf_counter() - started
+    metrics.LLM_FIRST_CHUNK_SECONDS.observe(elapsed, model=model)
+    _first_chunk_latencies.observe(model, len(prompt), elapsed)
+    return _OpenStream(model, prompt, stack, chunks, first, started, span)
+
+
+async def _hedged_open(model: str, contents: list, prompt: str, timeout: float) -> _OpenStream:
+    """
+    _open_stream, plus a second request if no text has arrived by the recent
+    p95 time to first piece for similar calls. The first stream to produce
+    text is kept and the other is closed.
+    """
+    delay = _first_chunk_latencies.hedge_delay(model, len(prompt)) if LLM_HEDGE else None
+    if delay is None or delay >= timeout:
+        return await _open_stream(model, contents, prompt, timeout)
+
+    primary = asyncio.ensure_future(_open_stream(model, contents, prompt, timeout))
+    tasks = [primary]
+    winner = None
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            if _retry_budget.try_spend():
+                tasks.append(asyncio.ensure_future(_open_stream(model, contents, prompt, timeout - delay)))
+            else:
+                metrics.LLM_BUDGET_DENIED.inc(model=model, kind="hedge")
+        pending = set(tasks)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((task for task in done if task.exception() is None), None)
+        if len(tasks) > 1:
+            label = "none" if winner is None else "primary" if winner is primary else "hedge"
+            metrics.LLM_HEDGES.inc(model=model, winner=label)
+        return winner.result() if winner is not None else primary.result()
+    finally:
+        for task in tasks:
+            if task is winner:
+                continue
+            if not task.done():
+                task.cancel()
+            else:
+                # The loser opened too: close it so it gives back its slot
+                if task.exception() is None:
+                    await task.result().close("cancelled")
+
+
+async def stream_text_async(prompt: str, model: str = DEFAULT_MODEL, images: tuple = (),
+                            deadline: float = LLM_DEADLINE_SECONDS):
+    """
+    Yield the reply text in pieces as the model generates it. Until the
+    first piece the request is hedged and retried like generate_text_async;
+    after it, a reply that stalls for LLM_STREAM_STALL_SECONDS or fails is
+    raised to the caller, which keeps what it has received so far.
+    """
+    contents = _contents(prompt, images, model)
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + deadline
+    _retry_budget.deposit()
+    attempt = 1
+    while True:
+        timeout = min(LLM_ATTEMPT_TIMEOUT_SECONDS, give_up_at - loop.time())
+        try:
+            opened = await _hedged_open(model, contents, prompt, timeout)
+            break
+        except Exception as e:
+            reason = _retry_reason(e)
+            if reason is None or attempt >= LLM_MAX_ATTEMPTS:
+                raise
+            backoff = random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** (attempt - 1)))
+            if backoff >= give_up_at - loop.time():
+                raise
+            if not _retry_budget.try_spend():
+                metrics.LLM_BUDGET_DENIED.inc(model=model, kind="retry")
+                raise
+            metrics.LLM_RETRIES.inc(model=model, reason=reason)
+            logger.warning(f"Model stream failed ({reason}); retry {attempt} in {backoff:.2f}s")
+            await asyncio.sleep(backoff)
+            attempt += 1
+
+    outcome = "error"
+    try:
+        if opened.received:
+            yield opened.received[0]
+        while opened.chunks is not None:
+            stall = min(LLM_STREAM_STALL_SECONDS, give_up_at - loop.time())
+            try:
+                chunk = await asyncio.wait_for(anext(opened.chunks), stall)
+            except StopAsyncIteration:
+                break
+            except TimeoutError:
+                outcome = "timeout"
+                raise LLMTimeout(f"Model reply stalled for more than {stall:.1f}s")
+            text = chunk.text or ""
+            if text:
+                opened.received.append(text)
+                yield text
+        outcome = "ok"
+        _latencies.observe(model, len(prompt), time.perf_counter() - opened.started)
+    finally:
+        await opened.close(outcome)
+
+
+def stream_many(prompts: list, max_concurrency: int = 4, model: str = DEFAULT_MODEL, images: tuple = ()):
+    """
+    Stream several prompts concurrently (at most max_concurrency at a time)
+    from sync code. Yields (index, text) as pieces arrive, in arrival order;
+    a stream that fails yields (index, exception) instead and ends there.
+    """
+    pieces = queue.Queue()
+    finished = object()
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def one(index: int, prompt: str) -> None:
+            async with semaphore:
+                try:
+                    async for text in stream_text_async(prompt, model, images):
+                        pieces.put((index, text))
+                except Exception as e:
+                    pieces.put((index, e))
+
+        try:
+            await asyncio.gather(*(one(index, prompt) for index, prompt in enumerate(prompts)))
+        finally:
+            pieces.put(finished)
+
+    if threading.current_thread() is _loop_thread:
+        raise RuntimeError("stream_many() called on the LLM event loop itself; use stream_text_async instead")
+    future = asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), run_all()), _get_loop())
+    try:
+        while (item := pieces.get()) is not finished:
+            yield item
+    finally:
+        # The consumer stopped early: close the streams still running
+        future.cancel()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _loop_thread
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                _loop_thread = threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True)
+                _loop_thread.start()
+                _loop = loop
+    return _loop
+
+
+async def _in_context(context: contextvars.Context, coro):
+    # The caller's context variables (e.g. the current trace span) carry over
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+def run_coroutine(coro, timeout: float = None):
+    """Run a coroutine on the shared LLM event loop from sync code and wait for the result."""
+    loop = _get_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("run_coroutine() called on the LLM event loop itself; await the coroutine instead")
+    future = asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), coro), loop)
+    return future.result(timeout)
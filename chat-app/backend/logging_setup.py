@@ -0,0 +1,168 @@
+"""
+MusicNBrain Logging - Queue-based logging off the request hot path
+Callers only put records on a bounded queue; a listener thread does the
+formatting and the disk and console I/O. The log file rotates by size,
+levels can be set per logger, and chatty third-party loggers are rate
+limited before they reach the queue.
+
+Environment:
+    LOG_LEVEL          root level (default INFO)
+    LOG_LEVELS         per-logger levels, e.g. "google_adk=DEBUG,httpx=WARNING"
+    LOG_RATE_LIMITS    records/second per logger, e.g. "httpx=5,google_adk=20"
+    LOG_MAX_BYTES      rotate the log file at this size (default 10 MB)
+    LOG_BACKUP_COUNT   rotated files to keep (default 5)
+    LOG_QUEUE_SIZE     records buffered before new ones are dropped (default 10000)
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Loggers that flood DEBUG/INFO with per-request chatter
+DEFAULT_LOGGER_LEVELS = {
+    "httpx": "WARNING",
+    "httpcore": "WARNING",
+    "urllib3": "WARNING",
+    "asyncio": "WARNING",
+    "multipart": "WARNING",
+    "google_genai": "WARNING",
+    "mcp": "WARNING",
+    "google_adk": "INFO",
+}
+
+# Records per second let through for each noisy logger (warnings always pass)
+DEFAULT_RATE_LIMITS = {
+    "httpx": 5,
+    "httpcore": 5,
+    "google_genai": 10,
+    "google_adk": 20,
+    "mcp": 20,
+    "fastmcp": 20,
+}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def _parse_pairs(value: str) -> dict:
+    """"a=1,b=2" -> {"a": "1", "b": "2"}, ignoring malformed entries."""
+    pairs = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, setting = item.split("=", 1)
+            if name.strip() and setting.strip():
+                pairs[name.strip()] = setting.strip()
+    return pairs
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per configured logger (and its children). Records below
+    WARNING beyond the rate are dropped; the next record let through
+    notes how many were suppressed.
+    """
+
+    def __init__(self, limits: dict, clock=time.monotonic):
+        super().__init__()
+        self.limits = {name: float(rate) for name, rate in limits.items() if float(rate) > 0}
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}  # name -> [tokens, last refill, suppressed]
+
+    def _limit_for(self, logger_name: str) -> Optional[str]:
+        name = logger_name
+        while name:
+            if name in self.limits:
+                return name
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        name = self._limit_for(record.name)
+        if name is None:
+            return True
+
+        rate = self.limits[name]
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.setdefault(name, [rate, now, 0])
+            bucket[0] = min(rate, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} [{suppressed} earlier {name} messages suppressed]"
+            record.args = None
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the listener falls behind."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(log_file: str) -> logging.handlers.QueueListener:
+    """
+    Route all logging through a queue to a rotating log file and stderr.
+    Only the first call in a process takes effect, so modules that are both
+    run as a script and imported can each call it.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+
+        formatter = logging.Formatter(LOG_FORMAT)
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+            backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+            encoding="utf-8",
+        )
+        stream_handler = logging.StreamHandler()
+        for handler in (file_handler, stream_handler):
+            handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+        queue_handler = DroppingQueueHandler(log_queue)
+        queue_handler.addFilter(RateLimitFilter(
+            {**DEFAULT_RATE_LIMITS, **_parse_pairs(os.getenv("LOG_RATE_LIMITS", ""))}
+        ))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+        for name, level in {**DEFAULT_LOGGER_LEVELS, **_parse_pairs(os.getenv("LOG_LEVELS", ""))}.items():
+            logging.getLogger(name).setLevel(level.upper())
+
+        _listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler,
+                                                   respect_handler_level=True)
+        _listener.start()
+        # Flush what is still queued when the process exits
+        atexit.register(_listener.stop)
+        return _listener
@@ -5,32 +5,33 @@ Based on the holiday_workshop 03-Connect-ADK-MCP-UI architecture.
 """
 
 import os
+import json
 import time
+import asyncio
+import importlib
 import logging
-import shutil
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+import threading
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from dotenv import load_dotenv
 
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google.adk.memory import InMemoryMemoryService
-from google.genai import types
-
-from agent import concert_agent
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("backend.log"),
-        logging.StreamHandler()
-    ]
-)
+import metrics
+from admission import Admission, AdmissionController, Overloaded
+from logging_setup import configure_logging
+from batch_render import BatchRenderer
+from image_ingest import IMAGE_STORE, MAX_IMAGE_UPLOAD_BYTES, ImageRejected, ingest_image, sniff_image_type
+from render_cache import artifact_url, find_artifact_ids, render_key
+from upload_store import UploadRejected, UploadStore
+
+# Configure logging (queued; handlers run on a background thread)
+configure_logging("backend.log")
 logger = logging.getLogger(__name__)
 
 load_dotenv()
@@ -38,22 +39,35 @@ load_dotenv()
 PROJECT_ID = os.getenv("PROJECT_ID")
 LOCATION = os.getenv("LOCATION", "us-central1")
 
-if PROJECT_ID:
-    try:
-        import vertexai
-        if "GOOGLE_API_KEY" in os.environ:
-            logger.info("Unsetting GOOGLE_API_KEY to avoid conflict with Vertex AI.")
-            del os.environ["GOOGLE_API_KEY"]
-        vertexai.init(project=PROJECT_ID, location=LOCATION)
-    except ImportError:
-        logger.warning("vertexai not installed. Using API key mode instead.")
+# vertexai itself is initialised by agent.py when the runner is first built
+if PROJECT_ID and "GOOGLE_API_KEY" in os.environ:
+    logger.info("Unsetting GOOGLE_API_KEY to avoid conflict with Vertex AI.")
+    del os.environ["GOOGLE_API_KEY"]
+
+# Warm the heavy imports in the background once the server is up
+PREWARM = os.getenv("PREWARM", "1") != "0"
 
 # ============================================================
 # FastAPI App
 # ============================================================
-app = FastAPI(title="MusicNBrain Concert Assistant API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # MCP server snapshots from an earlier run would be summed into ours
+    metrics.clear_exported_snapshots()
+    eviction_task = asyncio.create_task(evict_idle_sessions())
+    upload_eviction_task = asyncio.create_task(evict_expired_uploads())
+    prewarm_task = asyncio.create_task(prewarm()) if PREWARM else None
+    yield
+    eviction_task.cancel()
+    upload_eviction_task.cancel()
+    if prewarm_task is not None:
+        prewarm_task.cancel()
+    batch_renderer.shutdown()
 
-os.makedirs("static/uploads", exist_ok=True)
+
+app = FastAPI(title="MusicNBrain Concert Assistant API", lifespan=lifespan)
+
+os.makedirs("static", exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 app.add_middleware(
@@ -65,75 +79,264 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """Time every request and open its trace span (when TRACE_FILE is set)."""
+    started = time.perf_counter()
+    status = "500"
+    with metrics.span("http.request", method=request.method, path=request.url.path) as span:
+        try:
+            response = await call_next(request)
+            status = str(response.status_code)
+            if span is not None:
+                response.headers["X-Trace-Id"] = span.trace_id
+            return response
+        finally:
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                                 method=request.method, route=route, status=status)
+            if span is not None:
+                span.attrs["status"] = status
+
 # ============================================================
 # ADK Runner setup
+# google.adk, google.genai and the agent take seconds to import, so the
+# runner is built on first use (or by the background pre-warm) and the
+# server answers /api/health right away.
+# Sessions are stored in SQLite so conversations survive restarts; only
+# recently active ones stay in memory, with their history truncated
 # ============================================================
-session_service = InMemorySessionService()
-memory_service = InMemoryMemoryService()
-
-runner = Runner(
-    app_name="musicnbrain",
-    agent=concert_agent,
-    session_service=session_service,
-    memory_service=memory_service,
-)
+session_service = None
+runner = None
+_runtime_lock = threading.Lock()
+
+DEFAULT_USER_ID = "demo_user"
+
+
+def _load_runtime() -> None:
+    """Import ADK and the agent and build the session service and runner (first call only)."""
+    global session_service, runner
+    with _runtime_lock:
+        if session_service is None:
+            from session_store import BoundedSessionService
+
+            session_service = BoundedSessionService(
+                os.getenv("SESSION_DB_PATH", os.path.join("cache", "sessions.sqlite3")),
+                max_events=int(os.getenv("SESSION_MAX_EVENTS", "200")),
+                max_resident=int(os.getenv("SESSION_MAX_RESIDENT", "1000")),
+                idle_ttl_seconds=float(os.getenv("SESSION_IDLE_TTL_SECONDS", "1800")),
+            )
+        if runner is None:
+            started = time.perf_counter()
+            from google.adk.memory import InMemoryMemoryService
+            from google.adk.runners import Runner
+
+            from agent import concert_agent
+
+            runner = Runner(
+                app_name="musicnbrain",
+                agent=concert_agent,
+                session_service=session_service,
+                # Nothing calls add_session_to_memory, so this stays empty
+                memory_service=InMemoryMemoryService(),
+            )
+            logger.info(f"ADK runner ready in {time.perf_counter() - started:.2f}s")
+
+
+async def ensure_runtime() -> None:
+    """Build the runner off the event loop if nothing has yet."""
+    if session_service is None or runner is None:
+        await asyncio.to_thread(_load_runtime)
+
+
+def _prewarm_imports() -> None:
+    _load_runtime()
+    # The first PDF render would otherwise pay for reportlab
+    import pdf_renderer  # noqa: F401
+    import reportlab.platypus  # noqa: F401
+    import llm
+    try:
+        llm.get_client()
+    except ValueError as e:
+        logger.warning(f"Pre-warm skipped the LLM client: {e}")
+
+
+async def prewarm() -> None:
+    """Load the runner, reportlab and the LLM client, then connect the agent's MCP tools."""
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(_prewarm_imports)
+        from google.adk.tools.mcp_tool import McpToolset
+
+        for toolset in runner.agent.tools:
+            if isinstance(toolset, McpToolset):
+                await toolset.get_tools()
+        logger.info(f"Pre-warm finished in {time.perf_counter() - started:.2f}s")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"Pre-warm failed, loading on first use instead: {e}")
+
+
+async def evict_idle_sessions(interval: float = 60):
+    """Periodically drop idle sessions from memory; they stay in SQLite."""
+    while True:
+        await asyncio.sleep(interval)
+        if session_service is None:
+            continue
+        evicted = session_service.evict_idle()
+        if evicted:
+            logger.info(f"Evicted {evicted} idle sessions, {session_service.resident_count()} resident")
+
+
+def _collect_session_stats() -> None:
+    if session_service is None:
+        return
+    metrics.CACHE_REQUESTS.set_total(session_service.hits, cache="session", result="hit")
+    metrics.CACHE_REQUESTS.set_total(session_service.misses, cache="session", result="miss")
+
+
+metrics.REGISTRY.add_collector(_collect_session_stats)
+
+
+async def get_or_create_session(session_id: str, user_id: str):
+    """Load the caller's ADK session, creating it on first use."""
+    started = time.perf_counter()
+    session = None
+    try:
+        session = await session_service.get_session(
+            app_name="musicnbrain",
+            session_id=session_id,
+            user_id=user_id
+        )
+    except Exception as e:
+        logger.warning(f"Failed to retrieve session {session_id}: {e}")
+
+    if not session:
+        try:
+            session = await session_service.create_session(
+                app_name="musicnbrain",
+                session_id=session_id,
+                user_id=user_id
+            )
+            logger.info(f"New session created: {session.id}")
+        except Exception as e:
+            logger.error(f"Failed to create session: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        metrics.SESSION_LOOKUP_SECONDS.observe(time.perf_counter() - started, result="created")
+    else:
+        metrics.SESSION_LOOKUP_SECONDS.observe(time.perf_counter() - started, result="hit")
+    return session
+
+
+# ============================================================
+# Uploads - content-addressed, with per-session and total quotas;
+# files unused for UPLOAD_TTL_SECONDS are deleted
+# ============================================================
+upload_store = UploadStore()
+
+
+async def evict_expired_uploads(interval: float = float(os.getenv("UPLOAD_EVICT_INTERVAL_SECONDS", "300"))):
+    """Periodically delete expired uploads and prepared images."""
+    while True:
+        await asyncio.sleep(interval)
+        for store in (upload_store, IMAGE_STORE):
+            removed = await asyncio.to_thread(store.evict_expired)
+            if removed:
+                logger.info(f"Deleted {removed} expired files from {store.root}")
+
+
+def generated_file_urls(event) -> list:
+    """Download URLs of program PDFs announced in this event's tool responses."""
+    urls = []
+    for result in event.get_function_responses():
+        if result.name == "generate_program_pdf":
+            text = json.dumps(result.response, ensure_ascii=False, default=str)
+            urls.extend(artifact_url(artifact_id) for artifact_id in find_artifact_ids(text))
+    return urls
+
+
+async def _peek(file: UploadFile, size: int = 16) -> bytes:
+    head = await file.read(size)
+    await file.seek(0)
+    return head
+
+
+async def prepare_turn(message: str, file: Optional[UploadFile], session_id: Optional[str], user_id: Optional[str]):
+    """Save any upload, resolve the session and build the user message for one chat turn."""
+    from google.genai import types
+
+    await ensure_runtime()
+    user_input = message
+    session_id = session_id or uuid.uuid4().hex
+
+    # Photos of a program are downscaled, stripped of EXIF and stored once per
+    # content hash; the parse tool sends the prepared bytes to the model inline
+    if file and sniff_image_type(await _peek(file)):
+        try:
+            image = await asyncio.to_thread(ingest_image, await file.read(MAX_IMAGE_UPLOAD_BYTES + 1), session_id)
+        except ImageRejected as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except UploadRejected as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        logger.info(f"Image upload {file.filename} -> {image['image_ref']} "
+                    f"({image['original_bytes']} -> {image['stored_bytes']} bytes, deduplicated={image['deduplicated']})")
+        user_input += (f"\n[System: User uploaded a photo of a program, image_ref={image['image_ref']}. "
+                       f"To read it, call parse_program_text with this image_ref.]")
+    # Other uploads are streamed to the store as sent
+    elif file:
+        try:
+            stored = await upload_store.save_upload(file, session_id)
+        except UploadRejected as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        abs_file_location = os.path.abspath(stored["path"])
+        logger.info(f"File {file.filename} saved to {abs_file_location} ({stored['size']} bytes, "
+                    f"deduplicated={stored['deduplicated']})")
+        user_input += f"\n[System: User uploaded a file. It is saved at: {abs_file_location}]"
+
+    user_id = user_id or DEFAULT_USER_ID
+    session = await get_or_create_session(session_id, user_id)
+
+    # Create message content
+    content = types.Content(role="user", parts=[{"text": user_input}])
+    return user_id, session, content
+
+
+# ============================================================
+# Admission control - bounded concurrent agent runs, fair per-user
+# queues, and a fast 429/503 with Retry-After when saturated
+# ============================================================
+admission = AdmissionController()
 
-CURRENT_SESSION_ID = None
+
+async def admit_turn(request: Request, session_id: Optional[str], user_id: Optional[str]) -> Admission:
+    """Take a running slot for this caller's turn, or answer 429/503 with Retry-After."""
+    # Without a user id every browser is demo_user, so queue by conversation or address
+    key = user_id or session_id or (request.client.host if request.client else "anonymous")
+    try:
+        return await admission.acquire(key)
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail,
+                            headers={"Retry-After": str(e.retry_after)})
 
 
 @app.post("/api/chat")
 async def chat_endpoint(
+    request: Request,
     message: str = Form(...),
-    file: Optional[UploadFile] = File(None)
+    file: Optional[UploadFile] = File(None),
+    session_id: Optional[str] = Form(None),
+    user_id: Optional[str] = Form(None)
 ):
     """
     Chat endpoint - accepts text message and optional file upload.
+    Pass back the returned session_id to continue the same conversation.
+    Answers 429/503 with Retry-After when the assistant is saturated.
     """
-    global CURRENT_SESSION_ID
-
+    slot = await admit_turn(request, session_id, user_id)
     try:
-        user_input = message
-        
-        # Handle file upload (e.g., photo of a handwritten program)
-        if file:
-            file_location = f"static/uploads/{file.filename}"
-            abs_file_location = os.path.abspath(file_location)
-            with open(file_location, "wb+") as f:
-                shutil.copyfileobj(file.file, f)
-            logger.info(f"File saved to {abs_file_location}")
-            user_input += f"\n[System: User uploaded a file. It is saved at: {abs_file_location}]"
-
-        user_id = "demo_user"
-        session = None
-
-        # Try existing session
-        if CURRENT_SESSION_ID:
-            try:
-                session = await session_service.get_session(
-                    app_name="musicnbrain",
-                    session_id=CURRENT_SESSION_ID,
-                    user_id=user_id
-                )
-            except Exception as e:
-                logger.warning(f"Failed to retrieve session: {e}")
-                CURRENT_SESSION_ID = None
-
-        # Create new session if needed
-        if not session:
-            try:
-                session = await session_service.create_session(
-                    app_name="musicnbrain",
-                    session_id="demo_session",
-                    user_id=user_id
-                )
-                CURRENT_SESSION_ID = session.id
-                logger.info(f"New session created: {session.id}")
-            except Exception as e:
-                logger.error(f"Failed to create session: {e}")
-                raise HTTPException(status_code=500, detail=str(e))
-
-        # Create message content
-        content = types.Content(role="user", parts=[{"text": user_input}])
+        user_id, session, content = await prepare_turn(message, file, session_id, user_id)
 
         # Run the agent
         final_response_text = ""
@@ -141,31 +344,233 @@ async def chat_endpoint(
 
         async for event in runner.run_async(
             user_id=user_id,
-            session_id=CURRENT_SESSION_ID,
+            session_id=session.id,
             new_message=content
         ):
+            # The PDF tool reports its artifact id; take the latest one from this turn
+            for url in generated_file_urls(event):
+                generated_file_url = url
+
             if event.is_final_response():
                 if event.content and event.content.parts:
                     final_response_text = event.content.parts[0].text
 
-                    # Check if a PDF was recently generated
-                    pdf_path = os.path.join("static", "concert_program.pdf")
-                    if os.path.exists(pdf_path):
-                        mtime = os.path.getmtime(pdf_path)
-                        if time.time() - mtime < 30:  # Generated in last 30 seconds
-                            generated_file_url = f"/static/concert_program.pdf?t={int(time.time())}"
-
         if not final_response_text:
             final_response_text = "Sorry, I didn't get a response. Please try again."
 
         return {
             "response": final_response_text,
-            "generated_file": generated_file_url
+            "generated_file": generated_file_url,
+            "session_id": session.id
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        slot.release()
+
+
+def _ndjson(event: dict) -> bytes:
+    return (json.dumps(event, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+@app.post("/api/chat/stream")
+async def chat_stream_endpoint(
+    request: Request,
+    message: str = Form(...),
+    file: Optional[UploadFile] = File(None),
+    session_id: Optional[str] = Form(None),
+    user_id: Optional[str] = Form(None)
+):
+    """
+    Streaming chat endpoint - same inputs as /api/chat, but answers with
+    newline-delimited JSON events as the agent works:
+
+      {"type": "session", "session_id": ...}
+      {"type": "tool_call", "name": ..., "args": {...}}
+      {"type": "tool_result", "name": ..., "response": ...}
+      {"type": "text", "text": ...}          (partial model text)
+      {"type": "file", "url": ...}           (a program PDF is ready)
+      {"type": "done", "response": ..., "generated_file": ..., "session_id": ...}
+      {"type": "error", "detail": ...}
+
+    Admission works as for /api/chat; the slot is held until the stream ends.
+    """
+    from google.adk.agents.run_config import RunConfig, StreamingMode
+
+    slot = await admit_turn(request, session_id, user_id)
+    try:
+        user_id, session, content = await prepare_turn(message, file, session_id, user_id)
+    except BaseException:
+        slot.release()
+        raise
+
+    async def event_stream():
+        yield _ndjson({"type": "session", "session_id": session.id})
+
+        final_response_text = ""
+        generated_file_url = None
+        try:
+            async for event in runner.run_async(
+                user_id=user_id,
+                session_id=session.id,
+                new_message=content,
+                run_config=RunConfig(streaming_mode=StreamingMode.SSE)
+            ):
+                if event.partial:
+                    # Streamed model text; the aggregated event follows later
+                    if event.content and event.content.parts:
+                        text = "".join(part.text or "" for part in event.content.parts)
+                        if text:
+                            yield _ndjson({"type": "text", "text": text})
+                    continue
+
+                for call in event.get_function_calls():
+                    args = {k: v for k, v in (call.args or {}).items() if k != "session_id"}
+                    yield _ndjson({"type": "tool_call", "name": call.name, "args": args})
+
+                for result in event.get_function_responses():
+                    yield _ndjson({"type": "tool_result", "name": result.name, "response": result.response})
+
+                for url in generated_file_urls(event):
+                    generated_file_url = url
+                    yield _ndjson({"type": "file", "url": url})
+
+                if event.is_final_response() and event.content and event.content.parts:
+                    final_response_text = event.content.parts[0].text or final_response_text
+
+            if not final_response_text:
+                final_response_text = "Sorry, I didn't get a response. Please try again."
+
+            yield _ndjson({
+                "type": "done",
+                "response": final_response_text,
+                "generated_file": generated_file_url,
+                "session_id": session.id
+            })
+        except Exception as e:
+            logger.error(f"Error in chat stream: {e}", exc_info=True)
+            yield _ndjson({"type": "error", "detail": str(e)})
+        finally:
+            slot.release()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also covers a client that disconnects before the stream starts
+        background=BackgroundTask(slot.release)
+    )
+
+
+# ============================================================
+# Batch program generation
+# ============================================================
+MAX_BATCH_PROGRAMS = int(os.getenv("MAX_BATCH_PROGRAMS", "200"))
+
+batch_renderer = BatchRenderer(max_workers=int(os.getenv("BATCH_RENDER_WORKERS", "0")) or None)
+
+
+class BatchProgram(BaseModel):
+    concert_title: str = ""
+    concert_date: str = ""
+    concert_time: str = ""
+    concert_venue: str = ""
+    style: Optional[str] = None
+    performances: List[dict]
+
+
+class BatchRequest(BaseModel):
+    programs: List[BatchProgram]
+    style: str = "elegant"
+
+
+@app.post("/api/programs/batch")
+async def batch_programs_endpoint(request: BatchRequest):
+    """
+    Render many concert programs at once (e.g. a studio's whole recital season).
+    Each program may set its own style; otherwise the request's style is used.
+    Answers with newline-delimited JSON as each PDF finishes:
+
+      {"type": "program", "index": ..., "concert_title": ..., "url": ..., "cached": ..., "seconds": ...}
+      {"type": "error", "index": ..., "detail": ...}
+      {"type": "summary", "count": ..., "failed": ..., "elapsed_seconds": ..., "pdfs_per_second": ...}
+    """
+    # Theme presets/cache and the render cache; the first import (fastmcp and
+    # all) is slow, so it happens off the event loop
+    mcp_server = await asyncio.to_thread(importlib.import_module, "mcp_server")
+
+    if not request.programs:
+        raise HTTPException(status_code=400, detail="No programs given.")
+    if len(request.programs) > MAX_BATCH_PROGRAMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_PROGRAMS} programs per batch.")
+
+    # Resolve each distinct style once (presets and cache first, LLM only if needed)
+    styles = sorted({item.style or request.style for item in request.programs})
+    resolved = await asyncio.gather(
+        *(asyncio.to_thread(mcp_server._generate_theme_from_description, style) for style in styles)
+    )
+    themes = dict(zip(styles, resolved))
+
+    async def event_stream():
+        start = time.perf_counter()
+        jobs, keys, titles, layouts = [], {}, {}, {}
+        done = failed = 0
+
+        for index, item in enumerate(request.programs):
+            program = item.model_dump(exclude={"style"})
+            for order, p in enumerate(program["performances"], start=1):
+                p.setdefault("order", order)
+            theme = themes[item.style or request.style]
+            key = render_key(program, theme)
+            titles[index] = program["concert_title"]
+
+            if mcp_server.RENDER_CACHE.get(key):
+                done += 1
+                yield _ndjson({"type": "program", "index": index, "concert_title": titles[index],
+                               "url": artifact_url(key), "cached": True, "seconds": 0.0})
+                continue
+            keys[index] = key
+            layouts[index] = theme.get("layout", "list")
+            jobs.append({"index": index, "program": program, "theme": theme,
+                         "output_path": mcp_server.RENDER_CACHE.path_for(key)})
+
+        async for result in batch_renderer.render_all(jobs):
+            index = result["index"]
+            if "error" in result:
+                failed += 1
+                yield _ndjson({"type": "error", "index": index, "detail": result["error"]})
+                continue
+            done += 1
+            mcp_server.RENDER_CACHE.adopt(keys[index])
+            if not result["cached"]:
+                metrics.PDF_RENDER_SECONDS.observe(result["seconds"], layout=layouts[index])
+            yield _ndjson({"type": "program", "index": index, "concert_title": titles[index],
+                           "url": artifact_url(keys[index]), "cached": result["cached"],
+                           "seconds": result["seconds"]})
+
+        elapsed = time.perf_counter() - start
+        logger.info(f"Batch of {len(request.programs)} programs rendered in {elapsed:.2f}s")
+        yield _ndjson({
+            "type": "summary",
+            "count": done,
+            "failed": failed,
+            "elapsed_seconds": round(elapsed, 3),
+            "pdfs_per_second": round(done / elapsed, 2) if elapsed > 0 else None,
+        })
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
+@app.get("/api/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics of this process merged with those exported by the MCP server."""
+    snapshots = [metrics.REGISTRY.snapshot()] + metrics.load_exported_snapshots()
+    return Response(metrics.render_prometheus(metrics.merge_snapshots(snapshots)),
+                    media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.get("/api/health")
@@ -4,75 +4,112 @@ Tools for parsing program text, generating PDFs, and fixing errors.
 """
 
 from fastmcp import FastMCP
+import functools
 import json
 import logging
 import os
+import re
+import time
 from datetime import datetime
+from typing import Optional
 from dotenv import load_dotenv
 
+import metrics
+from image_ingest import ImageRejected, load_image
+from json_stream import ArrayItemStream
+from llm import LLMBusy, LLMTimeout, generate_text, strip_code_fences, stream_many
+from logging_setup import configure_logging
+from pdf_renderer import render_program_pdf
+from program_store import ProgramStore
+from render_cache import RenderCache, artifact_marker, artifact_url, render_key
+from result_cache import PersistentLRUCache, SingleFlight, text_key
+from roster_parser import CONFIDENCE_THRESHOLD, parse_roster
+from scheduler import DEFAULT_DAY_END, ScheduleError, format_clock, parse_clock, parse_sibling_groups, schedule
+from program_index import select_relevant_rows
+from program_edits import PatchError, allows_removals, apply_patch, describe_patch, local_fix_patch, validate_patch
+
 load_dotenv()
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("mcp_server.log"),
-        logging.StreamHandler()
-    ]
-)
+# No-op when imported by an already configured process (e.g. the API)
+configure_logging("mcp_server.log")
 logger = logging.getLogger(__name__)
 
 mcp = FastMCP("musicnbrain")
 
+
 # ============================================================
-# In-memory store for the current program data
-# This persists across tool calls within the same session
+# Metrics - every tool is timed, and its span joins the caller's trace
 # ============================================================
-CURRENT_PROGRAM = {
-    "concert_title": "",
-    "concert_date": "",
-    "concert_time": "",
-    "concert_venue": "",
-    "concert_type": "OFFLINE",
-    "performances": []
-}
+def instrumented(fn):
+    """Time the tool and count error results; the span joins the agent's trace."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = "error"
+        parent = metrics.parse_trace_parent(kwargs.get("trace_parent", ""))
+        with metrics.span(f"tool.{fn.__name__}", parent=parent) as span:
+            try:
+                result = fn(*args, **kwargs)
+                outcome = "error" if str(result).startswith("Error") else "ok"
+                return result
+            finally:
+                metrics.TOOL_SECONDS.observe(time.perf_counter() - started, tool=fn.__name__, outcome=outcome)
+                if span is not None:
+                    span.attrs["outcome"] = outcome
+    return wrapper
+
+
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", os.path.join("cache", "musicnbrain.sqlite3"))
 
+# ============================================================
+# Store for program data, keyed by chat session
+# Hot programs stay in memory; every change is saved to SQLite so a
+# conversation resumed after a restart still has its program
+# ============================================================
+PROGRAM_STORE = ProgramStore(
+    max_sessions=int(os.getenv("PROGRAM_STORE_MAX_SESSIONS", "10000")),
+    idle_ttl_seconds=float(os.getenv("PROGRAM_STORE_IDLE_TTL_SECONDS", str(6 * 3600))),
+    backing=PersistentLRUCache(
+        CACHE_DB_PATH, "programs",
+        max_entries=int(os.getenv("PROGRAM_STORE_MAX_SAVED", "50000")),
+        ttl_seconds=float(os.getenv("PROGRAM_STORE_SAVED_TTL_SECONDS", str(90 * 24 * 3600))),
+    ),
+)
 
-def _get_llm_client():
-    """Get the Gemini/GenAI client based on available credentials."""
-    from google import genai
-    
-    project_id = os.getenv("PROJECT_ID")
-    api_key = os.getenv("GOOGLE_API_KEY")
-    
-    if project_id:
-        return genai.Client(vertexai=True, project=project_id, location=os.getenv("LOCATION", "us-central1"))
-    elif api_key:
-        return genai.Client(api_key=api_key)
-    else:
-        raise ValueError("Neither PROJECT_ID nor GOOGLE_API_KEY found. Cannot initialize LLM client.")
+# ============================================================
+# Persistent cache of parsed rosters, keyed by normalized text hash
+# Bump PARSE_PROMPT_VERSION whenever the parse prompt, the rows sent to it or the cache key change
+# ============================================================
+PARSE_PROMPT_VERSION = "parse-v4"
+PARSE_CACHE = PersistentLRUCache(
+    CACHE_DB_PATH, "parse_results",
+    max_entries=int(os.getenv("PARSE_CACHE_MAX_ENTRIES", "5000")),
+    ttl_seconds=float(os.getenv("PARSE_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+)
 
 
-@mcp.tool
-def parse_program_text(raw_text: str, concert_title: str = "", concert_date: str = "", concert_time: str = "", venue: str = "") -> str:
-    """
-    Parse raw program text (from email, CSV, or free-text) into structured concert program data.
-    The AI will extract student names, piece names, instruments, duration, and performance order.
-    
-    Args:
-        raw_text: The raw text containing the program list (pasted from email, CSV, etc.)
-        concert_title: Optional title for the concert
-        concert_date: Optional date for the concert (e.g. "March 15, 2026")
-        concert_time: Optional start time (e.g. "2:00 PM")
-        venue: Optional venue name/address
-    """
-    global CURRENT_PROGRAM
-    logger.info(f"Parsing program text: {raw_text[:100]}...")
-    
-    try:
-        client = _get_llm_client()
-        
-        prompt = f"""You are a music concert program parser. Extract structured data from the teacher's input.
+# Rosters with more rows than this are parsed by the LLM in concurrent chunks,
+# which keeps each response under the output limit and the wall time near
+# that of a single chunk
+PARSE_CHUNK_ROWS = int(os.getenv("PARSE_CHUNK_ROWS", "40"))
+PARSE_MAX_CONCURRENCY = int(os.getenv("PARSE_MAX_CONCURRENCY", "8"))
+# While a parse streams in, rows read so far are written to the program at most this often
+PARSE_PUBLISH_INTERVAL_SECONDS = float(os.getenv("PARSE_PUBLISH_INTERVAL_SECONDS", "0.5"))
+
+
+def _parse_prompt(raw_text: str, tagged_lines: bool = False, from_image: bool = False) -> str:
+    line_rule = ""
+    if tagged_lines:
+        line_rule = ('\n- Each input line starts with a [Ln] tag. Set "source_line" to that number n for every performance it produces'
+                     '\n- Lines that are not performances (greetings, headings, notes) produce no rows')
+
+    source = f"Input text to parse:\n{raw_text}"
+    if from_image:
+        source = "The program is in the attached photo (printed or handwritten). Read every row, top to bottom."
+        if raw_text.strip():
+            source += f"\n\nNotes from the teacher:\n{raw_text}"
+
+    return f"""You are a music concert program parser. Extract structured data from the teacher's input.
 Return ONLY valid JSON with no markdown formatting, no backticks, no explanation.
 
 The JSON must have this exact structure:
@@ -83,7 +120,8 @@ The JSON must have this exact structure:
             "student_name": "Student Name",
             "piece_name": "Piece Name (Composer)",
             "instrument": "Piano",
-            "estimated_duration_minutes": 4
+            "estimated_duration_minutes": 4,
+            "confidence": 0.9
         }}
     ]
 }}
@@ -94,41 +132,237 @@ Rules:
 - If composer is mentioned, include it in parentheses after the piece name
 - Keep the original performance order
 - Handle messy formats: emails, CSVs, numbered lists, free text
+- confidence is your 0-1 certainty that the row was read correctly{line_rule}
+
+{source}"""
+
+
+def _stream_parse(prompts: list, images: tuple = (), on_rows=None) -> tuple:
+    """
+    Stream the replies to parse prompts concurrently and read performances
+    out of each as soon as they close; on_rows(scanners) is called when new
+    rows arrive, at most every PARSE_PUBLISH_INTERVAL_SECONDS. Returns (rows per prompt, complete). A reply that was
+    cut off or failed part-way keeps its finished rows and makes the result
+    incomplete; only a parse that produced no rows at all raises.
+    """
+    scanners = [ArrayItemStream() for _ in prompts]
+    replies = [[] for _ in prompts]
+    errors = {}
+    next_publish = 0.0
+    for index, piece in stream_many(prompts, max_concurrency=PARSE_MAX_CONCURRENCY, images=images):
+        if isinstance(piece, Exception):
+            errors[index] = piece
+            continue
+        replies[index].append(piece)
+        if scanners[index].feed(piece) and on_rows is not None and time.monotonic() >= next_publish:
+            next_publish = time.monotonic() + PARSE_PUBLISH_INTERVAL_SECONDS
+            on_rows(scanners)
+
+    if errors and not any(scanner.items for scanner in scanners):
+        raise next(iter(errors.values()))
+    complete = True
+    for index, scanner in enumerate(scanners):
+        if index in errors:
+            logger.warning(f"Parse reply {index + 1}/{len(prompts)} failed after {len(scanner.items)} rows: {errors[index]}")
+            complete = False
+        elif not scanner.found:
+            # Not the expected shape; read the whole reply the old way (raises on invalid JSON)
+            parsed = json.loads(strip_code_fences("".join(replies[index])))
+            scanner.items.extend(parsed.get("performances", []) if isinstance(parsed, dict) else parsed)
+        elif not scanner.closed:
+            logger.warning(f"Parse reply {index + 1}/{len(prompts)} was cut off after {len(scanner.items)} rows")
+            complete = False
+    return [scanner.items for scanner in scanners], complete
+
+
+def _in_order_rows(scanners: list) -> list:
+    """Rows of the finished replies plus the one still streaming, stopping at the first unfinished."""
+    rows = []
+    for scanner in scanners:
+        rows.extend(scanner.items)
+        if not scanner.closed:
+            break
+    return rows
+
+
+def _parse_image_with_llm(image_ref: str, notes: str = "", publish=None) -> tuple:
+    """Read the performances off an uploaded photo, sent inline with the prompt. Returns (rows, complete)."""
+    data, mime_type = load_image(image_ref)
+    logger.info(f"Parsing image {image_ref} ({len(data)} bytes, {mime_type}) with the LLM")
+    on_rows = (lambda scanners: publish(scanners[0].items)) if publish else None
+    (performances,), complete = _stream_parse([_parse_prompt(notes, from_image=True)],
+                                              images=((data, mime_type),), on_rows=on_rows)
+    for i, p in enumerate(performances, start=1):
+        p["order"] = i
+        p.pop("source_line", None)
+    return performances, complete
+
+
+def _parse_chunks_with_llm(chunks: list, tagged_lines: bool = False, on_rows=None) -> tuple:
+    """Parse row-aligned chunks concurrently. Returns (rows per chunk in order, complete)."""
+    if len(chunks) > 1:
+        logger.info(f"Parsing {len(chunks)} chunks with up to {PARSE_MAX_CONCURRENCY} concurrent LLM calls")
+    return _stream_parse([_parse_prompt(chunk, tagged_lines) for chunk in chunks], on_rows=on_rows)
+
+
+def _row_blocks(raw_text: str) -> tuple:
+    """
+    Split free text into units that never cut a performance in half, and the
+    separator to rejoin them: short blank-line separated paragraphs (one
+    multi-line entry each) when the text is laid out that way, else lines.
+    """
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", raw_text) if p.strip()]
+    if len(paragraphs) > 1 and max(len(p.splitlines()) for p in paragraphs) <= 6:
+        return paragraphs, "\n\n"
+    return [line.strip() for line in raw_text.splitlines() if line.strip()], "\n"
 
-Input text to parse:
-{raw_text}"""
 
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[prompt]
+def _chunked(items: list, size: int) -> list:
+    """Consecutive chunks of at most size items, balanced so there is no tiny tail chunk."""
+    count = -(-len(items) // size)
+    size = -(-len(items) // count) if count else size
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _parse_performances(raw_text: str, publish=None) -> tuple:
+    """
+    Parse with the local roster parser first and only send what it could not
+    handle to the LLM: the whole text when it has no recognizable structure,
+    otherwise just the low-confidence and unparsed rows. Large inputs go to
+    the LLM in chunks that are parsed concurrently and merged in order.
+    Rows read so far are passed to publish(rows) while the LLM replies stream
+    in. Returns (performances, complete).
+    """
+    local = parse_roster(raw_text)
+    complete = True
+    if local["format"] is None:
+        logger.info("No recognizable roster structure, parsing with the LLM")
+        blocks, separator = _row_blocks(raw_text)
+        chunks = [raw_text]
+        if len(blocks) > PARSE_CHUNK_ROWS:
+            chunks = [separator.join(chunk) for chunk in _chunked(blocks, PARSE_CHUNK_ROWS)]
+        on_rows = (lambda scanners: publish(_in_order_rows(scanners))) if publish else None
+        chunk_rows, complete = _parse_chunks_with_llm(chunks, on_rows=on_rows)
+        performances = [p for rows in chunk_rows for p in rows]
+    else:
+        accepted = [p for p in local["performances"] if p["confidence"] >= CONFIDENCE_THRESHOLD]
+        lines = raw_text.splitlines()
+        pending = sorted(
+            [(p["source_line"], lines[p["source_line"] - 1].strip())
+             for p in local["performances"] if p["confidence"] < CONFIDENCE_THRESHOLD]
+            + local["unparsed"]
         )
-        
-        result_text = response.text.strip()
-        # Clean up potential markdown formatting
-        if result_text.startswith("```"):
-            result_text = result_text.split("\n", 1)[1]
-            if result_text.endswith("```"):
-                result_text = result_text[:-3].strip()
-        
-        parsed = json.loads(result_text)
-        
-        # Update the in-memory program store
-        CURRENT_PROGRAM["performances"] = parsed.get("performances", [])
+        llm_rows = []
+        if pending:
+            pending_chunks = _chunked(pending, PARSE_CHUNK_ROWS)
+            tagged_chunks = ["\n".join(f"[L{line_no}] {text}" for line_no, text in chunk) for chunk in pending_chunks]
+
+            def with_source_lines(chunk_rows: list) -> list:
+                rows = []
+                for chunk, rows_of_chunk in zip(pending_chunks, chunk_rows):
+                    for i, p in enumerate(rows_of_chunk):
+                        if not isinstance(p.get("source_line"), int):
+                            p["source_line"] = chunk[min(i, len(chunk) - 1)][0]
+                    rows.extend(rows_of_chunk)
+                return rows
+
+            def on_rows(scanners: list) -> None:
+                rows = accepted + with_source_lines([scanner.items for scanner in scanners])
+                publish(sorted(rows, key=lambda p: p["source_line"]))
+
+            if publish:
+                # The locally parsed rows are shown right away; LLM rows fill in as they arrive
+                publish(accepted)
+            chunk_rows, complete = _parse_chunks_with_llm(tagged_chunks, tagged_lines=True,
+                                                          on_rows=on_rows if publish else None)
+            llm_rows = with_source_lines(chunk_rows)
+        logger.info(f"Local {local['format']} parser handled {len(accepted)} rows, LLM handled {len(llm_rows)}")
+        performances = sorted(accepted + llm_rows, key=lambda p: p["source_line"])
+
+    for i, p in enumerate(performances, start=1):
+        p["order"] = i
+        p.pop("source_line", None)
+    return performances, complete
+
+
+def _progress_publisher(program: dict, session_id: str):
+    """
+    publish(rows) for a streaming parse: keeps the rows read so far under
+    "parse_progress". The session's program is only replaced once the parse
+    has succeeded, so a failed parse leaves the previous one intact.
+    """
+    def publish(rows: list) -> None:
+        program["parse_progress"] = [
+            {**{k: v for k, v in p.items() if k != "source_line"}, "order": i} for i, p in enumerate(rows, start=1)
+        ]
+        PROGRAM_STORE.save(session_id)
+        logger.info(f"Parse in progress: {len(rows)} rows so far")
+
+    return publish
+
+
+@mcp.tool
+@instrumented
+def parse_program_text(raw_text: str = "", concert_title: str = "", concert_date: str = "", concert_time: str = "", venue: str = "", image_ref: str = "", session_id: str = "", trace_parent: str = "") -> str:
+    """
+    Parse raw program text (from email, CSV, or free-text) or a photo of a program into structured concert program data.
+    The AI will extract student names, piece names, instruments, duration, and performance order.
+    
+    Args:
+        raw_text: The raw text containing the program list (pasted from email, CSV, etc.); with image_ref, any notes about the photo
+        concert_title: Optional title for the concert
+        concert_date: Optional date for the concert (e.g. "March 15, 2026")
+        concert_time: Optional start time (e.g. "2:00 PM")
+        venue: Optional venue name/address
+        image_ref: Reference of an uploaded photo of the program, as given in the upload notice
+        session_id: Chat session the program belongs to (filled in automatically, leave empty)
+        trace_parent: Tracing context (filled in automatically, leave empty)
+    """
+    if not raw_text.strip() and not image_ref:
+        return "Error: Nothing to parse. Paste the program text or upload a photo of it."
+    program = PROGRAM_STORE.get(session_id)
+    logger.info(f"Parsing program {'image ' + image_ref if image_ref else 'text'}: {raw_text[:100]}...")
+    
+    try:
+        # Identical pastes and re-sent photos (image refs are content hashes) skip the model
+        cache_key = text_key(f"image:{image_ref}\n{raw_text}" if image_ref else raw_text, PARSE_PROMPT_VERSION)
+        performances = PARSE_CACHE.get(cache_key)
+        complete = True
+        if performances is not None:
+            logger.info(f"Parse cache hit {cache_key[:12]} ({PARSE_CACHE.hits} hits / {PARSE_CACHE.misses} misses)")
+        else:
+            publish = _progress_publisher(program, session_id)
+            if image_ref:
+                performances, complete = _parse_image_with_llm(image_ref, raw_text, publish)
+            else:
+                performances, complete = _parse_performances(raw_text, publish)
+            # A cut-off reply is kept for this session but not reused for the next paste
+            if complete:
+                PARSE_CACHE.put(cache_key, performances)
+        
+        # Update the session's program; an earlier timetable no longer applies
+        program["performances"] = performances
+        program.pop("schedule", None)
+        program.pop("parse_progress", None)
         if concert_title:
-            CURRENT_PROGRAM["concert_title"] = concert_title
+            program["concert_title"] = concert_title
         if concert_date:
-            CURRENT_PROGRAM["concert_date"] = concert_date
+            program["concert_date"] = concert_date
         if concert_time:
-            CURRENT_PROGRAM["concert_time"] = concert_time
+            program["concert_time"] = concert_time
         if venue:
-            CURRENT_PROGRAM["concert_venue"] = venue
+            program["concert_venue"] = venue
+        PROGRAM_STORE.save(session_id)
         
         # Build a readable summary
-        num_performers = len(CURRENT_PROGRAM["performances"])
-        total_minutes = sum(p.get("estimated_duration_minutes", 0) for p in CURRENT_PROGRAM["performances"])
+        num_performers = len(program["performances"])
+        total_minutes = sum(p.get("estimated_duration_minutes", 0) for p in program["performances"])
         
         summary_lines = [f"Successfully parsed {num_performers} performances (total ~{total_minutes} minutes):"]
-        for p in CURRENT_PROGRAM["performances"]:
+        if not complete:
+            summary_lines[0] = (f"Parsed {num_performers} performances (total ~{total_minutes} minutes), but the AI "
+                                f"reply was cut off, so some rows may be missing. Paste the missing rows to add them:")
+        for p in program["performances"]:
             summary_lines.append(
                 f"  {p['order']}. {p['student_name']} — {p['piece_name']} "
                 f"({p.get('instrument', 'N/A')}, ~{p.get('estimated_duration_minutes', '?')} min)"
@@ -136,70 +370,141 @@ Input text to parse:
         
         return "\n".join(summary_lines)
         
+    except ImageRejected as e:
+        return f"Error: {e}"
+    except (LLMTimeout, LLMBusy) as e:
+        logger.error(f"Model unavailable while parsing: {e}")
+        return "Error: The AI service is slow or busy right now. Please try again in a minute."
     except json.JSONDecodeError as e:
         logger.error(f"Failed to parse LLM response as JSON: {e}")
         return f"Error: Could not parse the program text. The AI response was not valid JSON. Please try again with clearer formatting."
     except Exception as e:
         logger.error(f"Error parsing program text: {e}")
         return f"Error parsing program text: {str(e)}"
+    finally:
+        # A failed parse drops its partial rows; the previous program stays as it was
+        if program.pop("parse_progress", None) is not None:
+            PROGRAM_STORE.save(session_id)
+
+
+# Programs longer than this only list the changed rows after a fix
+FIX_SUMMARY_MAX_ROWS = 30
+# Programs longer than this only send the relevant rows to the LLM for a fix
+FIX_CONTEXT_MAX_ROWS = 12
+
+
+def _fix_patch_with_llm(program: dict, fix_instruction: str) -> list:
+    """Ask the LLM for a small JSON Patch that applies the correction."""
+    metadata = {k: v for k, v in program.items() if k != "performances"}
+    performances = program["performances"]
+
+    # Large programs: only show the rows the instruction is about, so the
+    # prompt stays roughly the same size however many performers there are
+    shown = range(len(performances))
+    scope_note = ""
+    if len(performances) > FIX_CONTEXT_MAX_ROWS:
+        relevant = select_relevant_rows(performances, fix_instruction, limit=FIX_CONTEXT_MAX_ROWS)
+        if relevant:
+            shown = relevant
+            scope_note = (f"\nOnly the {len(relevant)} rows relevant to the instruction are shown; "
+                          f"the program has {len(performances)} rows in total and indices refer to the full program.")
+            logger.info(f"Sending {len(relevant)} of {len(performances)} rows to the LLM: {relevant}")
+
+    rows = "\n".join(
+        f"{i}: " + json.dumps({k: v for k, v in performances[i].items() if k != "confidence"}, ensure_ascii=False)
+        for i in shown
+    )
+
+    prompt = f"""You are a data correction assistant. The user wants to fix some data in a concert program.
+
+Concert metadata:
+{json.dumps(metadata, ensure_ascii=False)}
+
+Performances (one per line, prefixed by their 0-based row index):{scope_note}
+{rows}
+
+User's correction instruction:
+{fix_instruction}
+
+Return ONLY a JSON Patch (RFC 6902) array describing the minimal change, no markdown, no backticks, no explanation.
+Allowed operations:
+- {{"op": "replace", "path": "/performances/<index>/<field>", "value": ...}} where field is student_name, piece_name, instrument or estimated_duration_minutes
+- {{"op": "replace", "path": "/<metadata field>", "value": "..."}} for concert_title, concert_date, concert_time, concert_venue, concert_type
+- {{"op": "add", "path": "/performances/<index or ->", "value": {{"student_name": ..., "piece_name": ..., "instrument": ..., "estimated_duration_minutes": ...}}}}
+- {{"op": "remove", "path": "/performances/<index>"}} only if the user asked to remove a performance
+- {{"op": "move", "from": "/performances/<index>", "path": "/performances/<index>"}}
+Operations apply in sequence. Do not touch anything the user did not ask to change."""
+
+    result_text = generate_text(prompt)
+
+    patch = json.loads(result_text)
+    if isinstance(patch, dict):
+        patch = [patch]
+    return patch
 
 
 @mcp.tool
-def fix_program_data(fix_instruction: str) -> str:
+@instrumented
+def fix_program_data(fix_instruction: str, session_id: str = "", trace_parent: str = "") -> str:
     """
     Fix errors in the current program data based on the teacher's natural language instruction.
     For example: "Tommy Chen should be Tommy Chang" or "The third piece is actually Moonlight Sonata"
     
     Args:
         fix_instruction: Natural language description of what to fix (e.g. "Tommy Chen should be Tommy Chang")
+        session_id: Chat session the program belongs to (filled in automatically, leave empty)
+        trace_parent: Tracing context (filled in automatically, leave empty)
     """
-    global CURRENT_PROGRAM
+    program = PROGRAM_STORE.get(session_id)
     logger.info(f"Fixing program data: {fix_instruction}")
     
-    if not CURRENT_PROGRAM["performances"]:
+    if not program["performances"]:
         return "Error: No program data to fix. Please parse a program first."
     
     try:
-        client = _get_llm_client()
-        
-        current_data = json.dumps(CURRENT_PROGRAM, indent=2)
-        
-        prompt = f"""You are a data correction assistant. The user wants to fix some data in a concert program.
-
-Current program data:
-{current_data}
-
-User's correction instruction:
-{fix_instruction}
-
-Apply the correction and return the COMPLETE updated program data as valid JSON.
-Return ONLY the JSON, no markdown, no backticks, no explanation.
-Keep the exact same JSON structure, only change what the user asked to fix."""
-
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[prompt]
-        )
-        
-        result_text = response.text.strip()
-        if result_text.startswith("```"):
-            result_text = result_text.split("\n", 1)[1]
-            if result_text.endswith("```"):
-                result_text = result_text[:-3].strip()
-        
-        updated = json.loads(result_text)
-        CURRENT_PROGRAM.update(updated)
+        # Common phrasings are patched locally; only the rest costs a model call
+        patch = local_fix_patch(program, fix_instruction)
+        if patch is not None:
+            logger.info(f"Applying local fix: {patch}")
+        else:
+            patch = _fix_patch_with_llm(program, fix_instruction)
+
+        validate_patch(program, patch, allow_removals=allows_removals(fix_instruction))
+        changes = describe_patch(program, patch)
+        updated = apply_patch(program, patch)
+        program.update(updated)
+        # Durations, instruments or names may have changed: re-solve a scheduled
+        # program, keeping everyone in the room they were published in
+        rescheduled = None
+        if program.get("schedule"):
+            rescheduled = _apply_schedule(program, program["schedule"]["settings"], keep_rooms=True)
+        PROGRAM_STORE.save(session_id)
         
         # Build summary of what changed
-        summary_lines = ["Program data updated successfully. Current program:"]
-        for p in CURRENT_PROGRAM.get("performances", []):
-            summary_lines.append(
-                f"  {p['order']}. {p['student_name']} — {p['piece_name']} "
-                f"({p.get('instrument', 'N/A')}, ~{p.get('estimated_duration_minutes', '?')} min)"
-            )
+        summary_lines = [f"Program data updated successfully ({len(changes)} change(s)):"]
+        summary_lines.extend(f"  - {change}" for change in changes)
+        if rescheduled:
+            summary_lines.append(f"Timetable re-solved: {rescheduled['start']}–{rescheduled['end']}, "
+                                 f"{rescheduled['changeovers']} stage setup(s).")
+        if len(program["performances"]) <= FIX_SUMMARY_MAX_ROWS:
+            summary_lines.append("Current program:")
+            for p in program.get("performances", []):
+                slot = f"{p['slot']} {p['room']} · " if p.get("slot") else ""
+                summary_lines.append(
+                    f"  {p['order']}. {slot}{p['student_name']} — {p['piece_name']} "
+                    f"({p.get('instrument', 'N/A')}, ~{p.get('estimated_duration_minutes', '?')} min)"
+                )
         
         return "\n".join(summary_lines)
         
+    except ScheduleError as e:
+        return f"Error: The correction was applied but the timetable could not be re-solved ({e})."
+    except PatchError as e:
+        logger.error(f"Rejected fix patch: {e}")
+        return f"Error: Could not apply that correction safely ({e}). Please rephrase it more specifically."
+    except (LLMTimeout, LLMBusy) as e:
+        logger.error(f"Model unavailable while fixing: {e}")
+        return "Error: The AI service is slow or busy right now. Please try again in a minute."
     except Exception as e:
         logger.error(f"Error fixing program data: {e}")
         return f"Error fixing program data: {str(e)}"
@@ -221,26 +526,112 @@ DEFAULT_THEME = {
     "title_size": 28,
 }
 
-FONT_MAP = {
-    "serif": {"title": "Times-Bold", "body": "Times-Roman", "italic": "Times-Italic"},
-    "sans-serif": {"title": "Helvetica-Bold", "body": "Helvetica", "italic": "Helvetica-Oblique"},
+# Built-in themes for the common styles; never need a model call
+PRESET_THEMES = {
+    "elegant": {
+        "name": "Elegant Gold", "bg_color": "#1a1a2e", "accent_color": "#c9a84c",
+        "text_color": "#2d2d2d", "subtitle_color": "#666666",
+        "header_decoration": "*  *  *", "footer_decoration": "*  *  *",
+        "layout": "list", "font_style": "serif", "title_size": 28,
+    },
+    "classic": {
+        "name": "Classic Burgundy", "bg_color": "#5c1a1b", "accent_color": "#8b6f47",
+        "text_color": "#2b1d14", "subtitle_color": "#6b5a4e",
+        "header_decoration": "~  \u00a7  ~", "footer_decoration": "~  ~  ~",
+        "layout": "list", "font_style": "serif", "title_size": 28,
+    },
+    "modern": {
+        "name": "Modern Slate", "bg_color": "#2d3748", "accent_color": "#4fd1c5",
+        "text_color": "#1a202c", "subtitle_color": "#718096",
+        "header_decoration": "\u2014  \u2014  \u2014", "footer_decoration": "\u2014",
+        "layout": "table", "font_style": "sans-serif", "title_size": 26,
+    },
+    "minimal": {
+        "name": "Minimal Mono", "bg_color": "#333333", "accent_color": "#999999",
+        "text_color": "#222222", "subtitle_color": "#777777",
+        "header_decoration": "\u00b7", "footer_decoration": "",
+        "layout": "minimal", "font_style": "sans-serif", "title_size": 24,
+    },
+    "christmas": {
+        "name": "Christmas Cheer", "bg_color": "#14532d", "accent_color": "#b91c1c",
+        "text_color": "#1f2937", "subtitle_color": "#166534",
+        "header_decoration": "*  \u2022  *  \u2022  *", "footer_decoration": "*  *  *",
+        "layout": "list", "font_style": "serif", "title_size": 30,
+    },
+    "holiday": {
+        "name": "Holiday Gold", "bg_color": "#7f1d1d", "accent_color": "#d4a017",
+        "text_color": "#2d2d2d", "subtitle_color": "#6b4f1d",
+        "header_decoration": "*  \u2022  *", "footer_decoration": "*  *  *",
+        "layout": "list", "font_style": "serif", "title_size": 28,
+    },
+    "winter": {
+        "name": "Winter Frost", "bg_color": "#1e3a5f", "accent_color": "#7fb3d5",
+        "text_color": "#1b2631", "subtitle_color": "#5d6d7e",
+        "header_decoration": "*  .  *  .  *", "footer_decoration": "*  *  *",
+        "layout": "list", "font_style": "serif", "title_size": 28,
+    },
+    "halloween": {
+        "name": "Halloween Night", "bg_color": "#1c1917", "accent_color": "#ea580c",
+        "text_color": "#1c1917", "subtitle_color": "#7c2d12",
+        "header_decoration": "~  \u2020  ~", "footer_decoration": "~  ~  ~",
+        "layout": "table", "font_style": "serif", "title_size": 28,
+    },
+    "thanksgiving": {
+        "name": "Autumn Harvest", "bg_color": "#78350f", "accent_color": "#b45309",
+        "text_color": "#292524", "subtitle_color": "#78716c",
+        "header_decoration": "\u2022  \u2022  \u2022", "footer_decoration": "\u2022  \u2022  \u2022",
+        "layout": "list", "font_style": "serif", "title_size": 28,
+    },
+    "spring": {
+        "name": "Cherry Blossom", "bg_color": "#831843", "accent_color": "#f472b6",
+        "text_color": "#3f3f46", "subtitle_color": "#9d174d",
+        "header_decoration": "\u00b7  *  \u00b7", "footer_decoration": "\u00b7  \u00b7  \u00b7",
+        "layout": "list", "font_style": "serif", "title_size": 28,
+    },
 }
+PRESET_THEMES["elegant gold"] = PRESET_THEMES["elegant"]
+PRESET_THEMES["christmas red and green"] = PRESET_THEMES["christmas"]
+
+# Generated themes persist across restarts; identical concurrent requests share one model call
+THEME_CACHE = PersistentLRUCache(
+    CACHE_DB_PATH, "themes",
+    max_entries=int(os.getenv("THEME_CACHE_MAX_ENTRIES", "500")),
+)
+_THEME_FLIGHTS = SingleFlight()
+
+_HEX_COLOR = re.compile(r"^#[0-9a-fA-F]{6}$")
 
-# Cache generated themes to avoid repeated API calls
-_THEME_CACHE = {}
+
+def _theme_cache_key(style_description: str) -> str:
+    return " ".join(style_description.lower().split())
 
 
 def _generate_theme_from_description(style_description: str) -> dict:
-    # Check cache first
-    cache_key = style_description.lower().strip()
-    if cache_key in _THEME_CACHE:
+    """Resolve a style description to a theme: presets, then cache, then the LLM."""
+    cache_key = _theme_cache_key(style_description)
+    if cache_key in PRESET_THEMES:
+        return PRESET_THEMES[cache_key]
+
+    theme = THEME_CACHE.get(cache_key)
+    if theme is not None:
         logger.info(f"Using cached theme for: {cache_key}")
-        return _THEME_CACHE[cache_key]
-    """Use LLM to generate a PDF color/style theme from natural language description."""
+        return theme
+
     try:
-        client = _get_llm_client()
-        
-        prompt = f"""You are a graphic designer. Based on the user's style description, generate a color theme for a concert program PDF.
+        return _THEME_FLIGHTS.do(cache_key, lambda: _generate_theme_with_llm(cache_key, style_description))
+    except Exception as e:
+        logger.error(f"Error generating theme: {e}. Using default.")
+        return DEFAULT_THEME
+
+
+def _generate_theme_with_llm(cache_key: str, style_description: str) -> dict:
+    """Use LLM to generate a PDF color/style theme from natural language description."""
+    # Another caller may have filled the cache while we queued for the flight
+    theme = THEME_CACHE.get(cache_key)
+    if theme is not None:
+        return theme
+
+    prompt = f"""You are a graphic designer. Based on the user's style description, generate a color theme for a concert program PDF.
 
 User's style request: "{style_description}"
 
@@ -266,42 +657,59 @@ Rules:
 - header_decoration should use thematic unicode symbols (e.g. Christmas: snowflakes, stars; Summer: waves, sun; Music: notes)
 - Choose serif for formal/classical, sans-serif for modern/casual"""
 
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[prompt]
-        )
-        
-        result_text = response.text.strip()
-        if result_text.startswith("```"):
-            result_text = result_text.split("\n", 1)[1]
-            if result_text.endswith("```"):
-                result_text = result_text[:-3].strip()
-        
-        theme = json.loads(result_text)
-        
-        # Validate required fields
-        required = ["name", "bg_color", "accent_color", "text_color", "subtitle_color"]
-        for field in required:
-            if field not in theme:
-                theme[field] = DEFAULT_THEME[field]
-        
-        # Set defaults for optional fields
-        theme.setdefault("header_decoration", "*  *  *")
-        theme.setdefault("footer_decoration", "*  *  *")
-        theme.setdefault("layout", "list")
-        theme.setdefault("font_style", "serif")
-        theme.setdefault("title_size", 28)
-        
-        logger.info(f"Generated theme: {theme['name']} for description: {style_description}")
-        return theme
-        
-    except Exception as e:
-        logger.error(f"Error generating theme: {e}. Using default.")
-        return DEFAULT_THEME
+    result_text = generate_text(prompt)
+    
+    theme = json.loads(result_text)
+    
+    # Validate required fields
+    required = ["name", "bg_color", "accent_color", "text_color", "subtitle_color"]
+    for field in required:
+        if field not in theme:
+            theme[field] = DEFAULT_THEME[field]
+    for field in ["bg_color", "accent_color", "text_color", "subtitle_color"]:
+        if not isinstance(theme[field], str) or not _HEX_COLOR.match(theme[field]):
+            theme[field] = DEFAULT_THEME[field]
+    
+    # Set defaults for optional fields
+    theme.setdefault("header_decoration", "*  *  *")
+    theme.setdefault("footer_decoration", "*  *  *")
+    theme.setdefault("layout", "list")
+    theme.setdefault("font_style", "serif")
+    theme.setdefault("title_size", 28)
+    
+    THEME_CACHE.put(cache_key, theme)
+    logger.info(f"Generated theme: {theme['name']} for description: {style_description}")
+    return theme
+
+
+# ============================================================
+# Rendered PDFs, keyed by program + theme hash and served from /static/programs
+# ============================================================
+RENDER_CACHE = RenderCache(
+    os.getenv("RENDER_CACHE_DIR", os.path.join("static", "programs")),
+    max_bytes=int(os.getenv("RENDER_CACHE_MAX_BYTES", str(200 * 1024 * 1024))),
+)
+
+
+
+def _collect_cache_stats() -> None:
+    for name, cache in (("parse", PARSE_CACHE), ("theme", THEME_CACHE), ("render", RENDER_CACHE)):
+        metrics.CACHE_REQUESTS.set_total(cache.hits, cache=name, result="hit")
+        metrics.CACHE_REQUESTS.set_total(cache.misses, cache=name, result="miss")
+
+
+metrics.REGISTRY.add_collector(_collect_cache_stats)
+
+
+def _timed_render(program: dict, theme: dict, output_path: str) -> None:
+    with metrics.span("pdf.render", rows=len(program["performances"])):
+        with metrics.PDF_RENDER_SECONDS.time(layout=theme.get("layout", "list")):
+            render_program_pdf(program, theme, output_path)
 
 
 @mcp.tool
-def generate_program_pdf(concert_title: str = "", concert_date: str = "", concert_time: str = "", venue: str = "", style: str = "elegant") -> str:
+@instrumented
+def generate_program_pdf(concert_title: str = "", concert_date: str = "", concert_time: str = "", venue: str = "", style: str = "elegant", session_id: str = "", trace_parent: str = "") -> str:
     """
     Generate a printable concert program PDF from the current program data.
     The style can be ANY natural language description and the AI will generate matching colors and design.
@@ -312,238 +720,47 @@ def generate_program_pdf(concert_title: str = "", concert_date: str = "", concer
         concert_time: Override time (uses stored time if empty)
         venue: Override venue (uses stored venue if empty)
         style: Any style description in natural language. Examples: "Christmas red and green", "summer beach vibes", "elegant gold", "modern minimalist", "cherry blossom spring", "dark gothic". The AI will generate matching colors and decorations.
+        session_id: Chat session the program belongs to (filled in automatically, leave empty)
+        trace_parent: Tracing context (filled in automatically, leave empty)
     """
-    global CURRENT_PROGRAM
+    program = PROGRAM_STORE.get(session_id)
     logger.info(f"Generating program PDF with style '{style}'...")
     
-    if not CURRENT_PROGRAM["performances"]:
+    if not program["performances"]:
         return "Error: No program data available. Please parse a program first using parse_program_text."
     
     # Use overrides or stored values
-    title = concert_title or CURRENT_PROGRAM.get("concert_title", "Concert Program")
-    date = concert_date or CURRENT_PROGRAM.get("concert_date", "")
-    time_str = concert_time or CURRENT_PROGRAM.get("concert_time", "")
-    venue_str = venue or CURRENT_PROGRAM.get("concert_venue", "")
+    title = concert_title or program.get("concert_title", "Concert Program")
+    date = concert_date or program.get("concert_date", "")
+    time_str = concert_time or program.get("concert_time", "")
+    venue_str = venue or program.get("concert_venue", "")
     
     # Generate theme from natural language description using AI
     theme = _generate_theme_from_description(style)
     
+    render_input = {
+        "concert_title": title,
+        "concert_date": date,
+        "concert_time": time_str,
+        "concert_venue": venue_str,
+        "performances": program["performances"],
+    }
+    num_performers = len(program["performances"])
+    
     try:
-        from reportlab.lib.pagesizes import letter
-        from reportlab.lib.units import inch
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.enums import TA_CENTER, TA_LEFT
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, HRFlowable
-        from reportlab.lib import colors
-        
-        output_path = os.path.join("static", "concert_program.pdf")
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        
-        doc = SimpleDocTemplate(
-            output_path,
-            pagesize=letter,
-            rightMargin=72,
-            leftMargin=72,
-            topMargin=60,
-            bottomMargin=60
-        )
-        
-        styles = getSampleStyleSheet()
-        
-        # Resolve fonts from theme
-        font_style = theme.get("font_style", "serif")
-        fonts = FONT_MAP.get(font_style, FONT_MAP["serif"])
-        
-        # Theme-based styles
-        title_style = ParagraphStyle(
-            'ConcertTitle',
-            parent=styles['Title'],
-            fontSize=theme.get("title_size", 28),
-            spaceAfter=8,
-            alignment=TA_CENTER,
-            fontName=fonts["title"],
-            textColor=colors.HexColor(theme["text_color"])
-        )
-        
-        subtitle_style = ParagraphStyle(
-            'ConcertSubtitle',
-            parent=styles['Normal'],
-            fontSize=12,
-            spaceAfter=4,
-            alignment=TA_CENTER,
-            fontName=fonts["italic"],
-            textColor=colors.HexColor(theme["subtitle_color"])
-        )
-        
-        divider_style = ParagraphStyle(
-            'Divider',
-            parent=styles['Normal'],
-            fontSize=14,
-            spaceBefore=16,
-            spaceAfter=16,
-            alignment=TA_CENTER,
-            fontName=fonts["title"],
-            textColor=colors.HexColor(theme["accent_color"]),
-        )
-        
-        # Build the PDF content
-        story = []
-        
-        # Top border line
-        story.append(Spacer(1, 0.3 * inch))
-        story.append(HRFlowable(
-            width="80%", thickness=1.5,
-            color=colors.HexColor(theme["accent_color"]),
-            spaceAfter=20, spaceBefore=0
-        ))
-        
-        # Title
-        story.append(Spacer(1, 0.2 * inch))
-        story.append(Paragraph(title, title_style))
-        story.append(Spacer(1, 0.1 * inch))
-        
-        # Date, Time, Venue
-        info_parts = []
-        if date:
-            info_parts.append(date)
-        if time_str:
-            info_parts.append(time_str)
-        if info_parts:
-            story.append(Paragraph("  |  ".join(info_parts), subtitle_style))
-        if venue_str:
-            story.append(Paragraph(venue_str, subtitle_style))
-        
-        story.append(Spacer(1, 0.15 * inch))
-        
-        # Divider with theme decoration
-        decoration = theme.get("header_decoration", "*  *  *")
-        story.append(Paragraph(decoration, divider_style))
-        story.append(Spacer(1, 0.15 * inch))
-        
-        # Performance list — card style instead of table
-        num_performers = len(CURRENT_PROGRAM["performances"])
-        total_minutes = sum(p.get("estimated_duration_minutes", 0) for p in CURRENT_PROGRAM["performances"])
-        
-        layout = theme.get("layout", "list")
-        if layout == "list":
-            # Elegant/Classic: List style with dotted separators
-            for i, p in enumerate(CURRENT_PROGRAM["performances"]):
-                order = p.get("order", i + 1)
-                name = p.get("student_name", "")
-                piece = p.get("piece_name", "")
-                instrument = p.get("instrument", "")
-                duration = p.get("estimated_duration_minutes", "?")
-                
-                # Piece name (bold, larger)
-                piece_style = ParagraphStyle(
-                    f'Piece_{i}',
-                    parent=styles['Normal'],
-                    fontSize=12,
-                    fontName=fonts["title"],
-                    textColor=colors.HexColor(theme["text_color"]),
-                    alignment=TA_CENTER,
-                    spaceAfter=2
-                )
-                story.append(Paragraph(piece, piece_style))
-                
-                # Performer + instrument + duration
-                detail_style = ParagraphStyle(
-                    f'Detail_{i}',
-                    parent=styles['Normal'],
-                    fontSize=10,
-                    fontName=fonts["italic"],
-                    textColor=colors.HexColor(theme["subtitle_color"]),
-                    alignment=TA_CENTER,
-                    spaceAfter=8
-                )
-                detail_text = name
-                if instrument:
-                    detail_text += f", {instrument}"
-                detail_text += f"  ({duration} min)"
-                story.append(Paragraph(detail_text, detail_style))
-                
-                # Separator between pieces
-                if i < num_performers - 1:
-                    story.append(HRFlowable(
-                        width="30%", thickness=0.5,
-                        color=colors.HexColor('#cccccc'),
-                        spaceAfter=10, spaceBefore=4
-                    ))
+        # Identical program + theme: reuse the earlier render instead of rebuilding it.
+        # The content hash doubles as the artifact id, so concurrent renders
+        # for different sessions never share a path.
+        key = render_key(render_input, theme)
+        output_path = RENDER_CACHE.get(key)
+        if output_path:
+            logger.info(f"Render cache hit {key[:12]}")
         else:
-            # Modern/Minimal: Clean table style
-            table_data = [["#", "Performer", "Piece", "Instrument", "Duration"]]
-            for p in CURRENT_PROGRAM["performances"]:
-                table_data.append([
-                    str(p.get("order", "")),
-                    p.get("student_name", ""),
-                    p.get("piece_name", ""),
-                    p.get("instrument", ""),
-                    f"{p.get('estimated_duration_minutes', '?')} min"
-                ])
-            
-            table = Table(table_data, colWidths=[0.4*inch, 1.5*inch, 2.2*inch, 1.0*inch, 0.7*inch])
-            
-            table_styles = [
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor(theme["bg_color"])),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), fonts["title"]),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('FONTNAME', (0, 1), (-1, -1), fonts["body"]),
-                ('FONTSIZE', (0, 1), (-1, -1), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('TOPPADDING', (0, 1), (-1, -1), 8),
-                ('BOTTOMPADDING', (0, 1), (-1, -1), 8),
-                ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f8f9fa')]),
-                ('ALIGN', (1, 1), (2, -1), 'LEFT'),
-            ]
-            
-            if layout == "table":
-                table_styles.append(('LINEBELOW', (0, 0), (-1, 0), 2, colors.HexColor(theme["accent_color"])))
-                table_styles.append(('LINEBELOW', (0, 1), (-1, -2), 0.5, colors.HexColor('#eeeeee')))
-            else:  # minimal
-                table_styles.append(('LINEBELOW', (0, 0), (-1, -1), 0.5, colors.HexColor('#dddddd')))
-            
-            table.setStyle(TableStyle(table_styles))
-            story.append(table)
-        
-        # Footer
-        story.append(Spacer(1, 0.4 * inch))
-        
-        # Footer decoration
-        footer_dec = theme.get("footer_decoration", "")
-        if footer_dec:
-            footer_dec_style = ParagraphStyle(
-                'FooterDec', parent=styles['Normal'],
-                fontSize=12, alignment=TA_CENTER,
-                textColor=colors.HexColor(theme["accent_color"]),
-            )
-            story.append(Paragraph(footer_dec, footer_dec_style))
-            story.append(Spacer(1, 0.1 * inch))
-        
-        story.append(HRFlowable(
-            width="80%", thickness=1.5,
-            color=colors.HexColor(theme["accent_color"]),
-            spaceAfter=12, spaceBefore=0
-        ))
-        
-        footer_style = ParagraphStyle(
-            'Footer',
-            parent=styles['Normal'],
-            fontSize=9,
-            alignment=TA_CENTER,
-            textColor=colors.HexColor('#999999'),
-            fontName=fonts["italic"]
-        )
-        story.append(Paragraph(f"{num_performers} performances  \u00b7  Approximately {total_minutes} minutes", footer_style))
-        story.append(Spacer(1, 0.1 * inch))
-        story.append(Paragraph("Generated by MusicNBrain", footer_style))
-        
-        # Build PDF
-        doc.build(story)
+            output_path = RENDER_CACHE.render(key, lambda path: _timed_render(render_input, theme, path))
         
         logger.info(f"PDF generated at: {output_path}")
-        return f"Done! Concert program PDF generated in '{theme['name']}' style with {num_performers} performances. Saved at concert_program.pdf. Available styles: classic, elegant, modern, minimal."
+        return (f"Done! Concert program PDF generated in '{theme['name']}' style with {num_performers} performances. "
+                f"Download: {artifact_url(key)} {artifact_marker(key)}. Available styles: classic, elegant, modern, minimal.")
         
     except ImportError:
         logger.error("reportlab not installed")
@@ -554,28 +771,39 @@ def generate_program_pdf(concert_title: str = "", concert_date: str = "", concer
 
 
 @mcp.tool
-def get_current_program() -> str:
+@instrumented
+def get_current_program(session_id: str = "", trace_parent: str = "") -> str:
     """
     Get the current program data as a readable summary.
     Use this to check what data is currently loaded.
+
+    Args:
+        session_id: Chat session the program belongs to (filled in automatically, leave empty)
+        trace_parent: Tracing context (filled in automatically, leave empty)
     """
-    if not CURRENT_PROGRAM["performances"]:
+    program = PROGRAM_STORE.get(session_id)
+    if not program["performances"]:
         return "No program data loaded yet. Please parse a program first."
     
     lines = []
-    if CURRENT_PROGRAM.get("concert_title"):
-        lines.append(f"Concert: {CURRENT_PROGRAM['concert_title']}")
-    if CURRENT_PROGRAM.get("concert_date"):
-        lines.append(f"Date: {CURRENT_PROGRAM['concert_date']}")
-    if CURRENT_PROGRAM.get("concert_time"):
-        lines.append(f"Time: {CURRENT_PROGRAM['concert_time']}")
-    if CURRENT_PROGRAM.get("concert_venue"):
-        lines.append(f"Venue: {CURRENT_PROGRAM['concert_venue']}")
+    if program.get("concert_title"):
+        lines.append(f"Concert: {program['concert_title']}")
+    if program.get("concert_date"):
+        lines.append(f"Date: {program['concert_date']}")
+    if program.get("concert_time"):
+        lines.append(f"Time: {program['concert_time']}")
+    if program.get("concert_venue"):
+        lines.append(f"Venue: {program['concert_venue']}")
     
-    lines.append(f"\nProgram ({len(CURRENT_PROGRAM['performances'])} performances):")
-    for p in CURRENT_PROGRAM["performances"]:
+    if program.get("schedule"):
+        lines.append(f"Timetable: {program['schedule']['start']}–{program['schedule']['end']} "
+                     f"in {len(program['schedule']['rooms'])} room(s)")
+    
+    lines.append(f"\nProgram ({len(program['performances'])} performances):")
+    for p in program["performances"]:
+        slot = f"{p['slot']} {p['room']} · " if p.get("slot") else ""
         lines.append(
-            f"  {p['order']}. {p['student_name']} — {p['piece_name']} "
+            f"  {p['order']}. {slot}{p['student_name']} — {p['piece_name']} "
             f"({p.get('instrument', 'N/A')}, ~{p.get('estimated_duration_minutes', '?')} min)"
         )
     
@@ -583,7 +811,8 @@ def get_current_program() -> str:
 
 
 @mcp.tool
-def update_concert_info(concert_title: str = "", concert_date: str = "", concert_time: str = "", venue: str = "", concert_type: str = "") -> str:
+@instrumented
+def update_concert_info(concert_title: str = "", concert_date: str = "", concert_time: str = "", venue: str = "", concert_type: str = "", session_id: str = "", trace_parent: str = "") -> str:
     """
     Update concert metadata (title, date, time, venue, type).
     
@@ -593,22 +822,156 @@ def update_concert_info(concert_title: str = "", concert_date: str = "", concert
         concert_time: The start time (e.g. "2:00 PM")
         venue: The venue name and/or address
         concert_type: ONLINE or OFFLINE
+        session_id: Chat session the program belongs to (filled in automatically, leave empty)
+        trace_parent: Tracing context (filled in automatically, leave empty)
     """
-    global CURRENT_PROGRAM
+    program = PROGRAM_STORE.get(session_id)
     
     if concert_title:
-        CURRENT_PROGRAM["concert_title"] = concert_title
+        program["concert_title"] = concert_title
     if concert_date:
-        CURRENT_PROGRAM["concert_date"] = concert_date
+        program["concert_date"] = concert_date
     if concert_time:
-        CURRENT_PROGRAM["concert_time"] = concert_time
+        program["concert_time"] = concert_time
     if venue:
-        CURRENT_PROGRAM["concert_venue"] = venue
+        program["concert_venue"] = venue
     if concert_type:
-        CURRENT_PROGRAM["concert_type"] = concert_type.upper()
+        program["concert_type"] = concert_type.upper()
+    PROGRAM_STORE.save(session_id)
     
-    return f"Concert info updated: {CURRENT_PROGRAM.get('concert_title', 'Untitled')} on {CURRENT_PROGRAM.get('concert_date', 'TBD')} at {CURRENT_PROGRAM.get('concert_venue', 'TBD')}"
+    return f"Concert info updated: {program.get('concert_title', 'Untitled')} on {program.get('concert_date', 'TBD')} at {program.get('concert_venue', 'TBD')}"
+
+
+# ============================================================
+# Scheduling - slot times, rooms and intermissions (see scheduler.py)
+# ============================================================
+# Settings a timetable is solved with; omitted arguments keep the previous run's values
+SCHEDULE_DEFAULTS = {
+    "start_time": "",
+    "rooms": "1",
+    "session_minutes": 90,
+    "intermission_minutes": 15,
+    "changeover_minutes": 1,
+    "siblings": "",
+    "day_end": DEFAULT_DAY_END,
+}
+# Timetables longer than this only summarise rooms and sessions
+SCHEDULE_SUMMARY_MAX_ROWS = 30
+# Sessions listed per room in the summary
+SCHEDULE_SUMMARY_MAX_SESSIONS = 6
+
+
+def _apply_schedule(program: dict, settings: dict, keep_rooms: bool = False) -> dict:
+    """
+    Solve the timetable for the program in place; the settings are stored for
+    re-solves. With keep_rooms, performances stay in the rooms they were in.
+    """
+    # Settings stored before a setting existed get its default
+    settings = dict(SCHEDULE_DEFAULTS, **settings)
+    result = schedule(
+        program["performances"],
+        start=settings["start_time"] or program.get("concert_time") or "9:00 AM",
+        rooms=settings["rooms"],
+        session_minutes=settings["session_minutes"],
+        intermission_minutes=settings["intermission_minutes"],
+        changeover_minutes=settings["changeover_minutes"],
+        siblings=parse_sibling_groups(settings["siblings"]),
+        keep_rooms=keep_rooms,
+        day_end=settings["day_end"],
+    )
+    program["performances"] = result["performances"]
+    program["schedule"] = {
+        "settings": settings,
+        "start": result["start"],
+        "end": result["end"],
+        "days": result["days"],
+        "rooms": result["rooms"],
+        "changeovers": result["changeovers"],
+        "waits": result["waits"],
+    }
+    logger.info(f"Scheduled {len(result['performances'])} performances in {len(result['rooms'])} room(s), "
+                f"{result['start']}–{result['end']}, {result['changeovers']} setups")
+    return result
+
+
+@mcp.tool
+@instrumented
+def schedule_program(start_time: str = "", rooms: str = "", session_minutes: Optional[int] = None, intermission_minutes: Optional[int] = None, changeover_minutes: Optional[int] = None, siblings: str = "", day_end: str = "", session_id: str = "", trace_parent: str = "") -> str:
+    """
+    Give every performance a start time (and a room, for festivals with several stages), with intermissions
+    between sessions. Harp, drum kit and mallet pieces are grouped to save stage setups, rooms and sessions are
+    balanced by length, and no performer or sibling group is scheduled in two rooms at once. Whatever does not
+    fit before the end of the day continues at the start time the next day.
+    Arguments left empty keep the values from the last time the program was scheduled.
+    
+    Args:
+        start_time: When the first performance starts (e.g. "2:00 PM"); defaults to the concert time
+        rooms: Number of rooms (e.g. "3") or their names (e.g. "Hall A, Hall B"); default 1
+        session_minutes: Longest stretch of performances before an intermission; default 90
+        intermission_minutes: Length of each intermission; default 15
+        changeover_minutes: Gap between two performances for bows and walking on; default 1
+        siblings: Students who must not overlap, one group per ";" (e.g. "Amy Chen & Tom Chen; Jack Lee, Sarah Lee")
+        day_end: Time of day no performance runs past (e.g. "6:00 PM"); default 10:00 PM
+        session_id: Chat session the program belongs to (filled in automatically, leave empty)
+        trace_parent: Tracing context (filled in automatically, leave empty)
+    """
+    program = PROGRAM_STORE.get(session_id)
+    if not program["performances"]:
+        return "Error: No program data to schedule. Please parse a program first."
+    
+    settings = dict(SCHEDULE_DEFAULTS, **program.get("schedule", {}).get("settings", {}))
+    for name, value in (("start_time", start_time), ("rooms", rooms), ("session_minutes", session_minutes),
+                        ("intermission_minutes", intermission_minutes),
+                        ("changeover_minutes", changeover_minutes), ("siblings", siblings), ("day_end", day_end)):
+        if value not in (None, ""):
+            settings[name] = value
+    
+    try:
+        result = _apply_schedule(program, settings)
+    except ScheduleError as e:
+        return f"Error: {e}"
+    PROGRAM_STORE.save(session_id)
+    
+    lines = [f"Scheduled {len(result['performances'])} performances in {len(result['rooms'])} room(s), "
+             f"{result['start']}–{result['end']}, with {result['changeovers']} stage setup(s)."]
+    if result["days"] > 1:
+        lines.append(f"The timetable runs over {result['days']} days, each from {result['start']} to at most "
+                     f"{format_clock(parse_clock(settings['day_end']))}.")
+    if result["waits"]:
+        lines.append(f"Rooms wait {result['waits']} min in total for performers who are on another stage.")
+    for room in result["rooms"]:
+        sessions = [f"{s['start']}–{s['end']}" for s in room["sessions"]]
+        if len(sessions) > SCHEDULE_SUMMARY_MAX_SESSIONS:
+            sessions = sessions[:SCHEDULE_SUMMARY_MAX_SESSIONS - 1] + [f"... ({len(sessions)} sessions in all)", sessions[-1]]
+        lines.append(f"  {room['room']}: {room['performances']} performances, sessions {', '.join(sessions)}")
+    if len(result["performances"]) <= SCHEDULE_SUMMARY_MAX_ROWS:
+        lines.append("Timetable:")
+        for p in result["performances"]:
+            room = f" {p['room']}" if len(result["rooms"]) > 1 else ""
+            lines.append(f"  {p['slot']}{room} — {p['student_name']} ({p.get('instrument', 'N/A')})")
+    else:
+        lines.append("Use get_current_program to see every slot.")
+    
+    return "\n".join(lines)
+
+
+# Exposed to the agent's in-process transport
+TOOLS = [parse_program_text, fix_program_data, generate_program_pdf, get_current_program, update_concert_info,
+         schedule_program]
 
 
 if __name__ == "__main__":
-    mcp.run()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MusicNBrain MCP server (stdio unless --http)")
+    parser.add_argument("--http", action="store_true", help="Serve streamable HTTP instead of stdio")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    # Running outside the API process: let it see our metrics
+    metrics.start_exporter("mcp_server")
+    if args.http:
+        mcp.run(transport="http", host=args.host, port=args.port, show_banner=False)
+    else:
+        mcp.run()
@@ -0,0 +1,395 @@
+"""
+MusicNBrain Metrics - Latency histograms, counters and optional trace spans
+A small in-process registry rendered in the Prometheus text format. The MCP
+server runs in its own process, so it exports snapshots to METRICS_DIR and
+the API process merges them into /api/metrics.
+
+Tracing is off unless TRACE_FILE is set; spans are then appended to that
+file as JSON lines and linked across processes by a "trace:span" parent.
+"""
+
+import copy
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join("cache", "metrics"))
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+# How stale the MCP server's numbers in /api/metrics may be
+EXPORT_INTERVAL_SECONDS = float(os.getenv("METRICS_EXPORT_INTERVAL_SECONDS", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+# ============================================================
+# Metric types
+# ============================================================
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, **labels) -> None:
+        """For collectors that mirror a count kept elsewhere (e.g. cache hits)."""
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+# ============================================================
+# Registry, snapshots and Prometheus text rendering
+# ============================================================
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """Run collector before every snapshot, to refresh metrics mirrored from elsewhere."""
+        self._collectors.append(collector)
+
+    def snapshot(self) -> dict:
+        """JSON-serializable copy of every metric."""
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+
+        families = {}
+        for metric in self._metrics.values():
+            with metric._lock:
+                samples = [[list(key), copy.deepcopy(value)] for key, value in metric._values.items()]
+            family = {"type": metric.type_name, "help": metric.help, "labelnames": list(metric.labelnames),
+                      "samples": samples}
+            if isinstance(metric, Histogram):
+                family["buckets"] = list(metric.buckets)
+            families[metric.name] = family
+        return families
+
+
+REGISTRY = Registry()
+
+
+def merge_snapshots(snapshots: list) -> dict:
+    """Sum counters, gauges and histograms with the same name and labels across snapshots."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            target = merged.setdefault(name, dict(family, samples={}))
+            if family.get("buckets") != target.get("buckets"):
+                logger.warning(f"Skipping {name} snapshot with mismatched buckets")
+                continue
+            for key, value in family["samples"]:
+                key = tuple(key)
+                current = target["samples"].get(key)
+                if current is None:
+                    target["samples"][key] = copy.deepcopy(value)
+                elif family["type"] == "histogram":
+                    current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+                    current["sum"] += value["sum"]
+                    current["count"] += value["count"]
+                else:
+                    target["samples"][key] = current + value
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: list, values: list, extra: Optional[tuple] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render_prometheus(merged: dict) -> str:
+    """Prometheus text exposition format (version 0.0.4) for merged snapshots."""
+    lines = []
+    for name in sorted(merged):
+        family = merged[name]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        names = family["labelnames"]
+        for key, value in sorted(family["samples"].items()):
+            if family["type"] == "histogram":
+                # observe() keeps bucket counts cumulative already
+                for bound, count in zip(family["buckets"], value["buckets"]):
+                    lines.append(f"{name}_bucket{_labels(names, key, ('le', _number(bound)))} {count}")
+                lines.append(f"{name}_bucket{_labels(names, key, ('le', '+Inf'))} {value['count']}")
+                lines.append(f"{name}_sum{_labels(names, key)} {_number(value['sum'])}")
+                lines.append(f"{name}_count{_labels(names, key)} {value['count']}")
+            else:
+                lines.append(f"{name}{_labels(names, key)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def export_snapshot(process_name: str) -> None:
+    """Write this process's metrics to METRICS_DIR for the API process to pick up."""
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{process_name}-{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(REGISTRY.snapshot(), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not export metrics snapshot: {e}")
+
+
+def start_exporter(process_name: str, interval: float = EXPORT_INTERVAL_SECONDS) -> threading.Thread:
+    """Export this process's snapshot every interval seconds on a daemon thread."""
+    def run():
+        while True:
+            export_snapshot(process_name)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="metrics-exporter", daemon=True)
+    thread.start()
+    return thread
+
+
+def load_exported_snapshots() -> list:
+    """Snapshots exported by other processes (this one is read from REGISTRY directly)."""
+    snapshots = []
+    own_suffix = f"-{os.getpid()}.json"
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        if path.endswith(own_suffix):
+            continue
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # being replaced right now; the next scrape gets it
+    return snapshots
+
+
+def clear_exported_snapshots() -> None:
+    """Drop snapshots left by processes from an earlier run."""
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# ============================================================
+# Standard metrics (shared names across processes)
+# ============================================================
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "musicnbrain_http_request_duration_seconds", "FastAPI request latency until response headers.",
+    ("method", "route", "status"))
+SESSION_LOOKUP_SECONDS = REGISTRY.histogram(
+    "musicnbrain_session_lookup_duration_seconds", "ADK session load or create.", ("result",))
+AGENT_TOOL_SECONDS = REGISTRY.histogram(
+    "musicnbrain_agent_tool_duration_seconds", "Tool call latency seen by the agent, including the MCP hop.",
+    ("tool",))
+TOOL_SECONDS = REGISTRY.histogram(
+    "musicnbrain_tool_duration_seconds", "Tool latency inside the MCP server.", ("tool", "outcome"))
+LLM_SECONDS = REGISTRY.histogram(
+    "musicnbrain_llm_request_duration_seconds", "GenAI generate_content latency.", ("model", "outcome"))
+LLM_PROMPT_CHARS = REGISTRY.histogram(
+    "musicnbrain_llm_prompt_chars", "Prompt size in characters.", ("model",), buckets=SIZE_BUCKETS)
+LLM_INLINE_BYTES = REGISTRY.histogram(
+    "musicnbrain_llm_inline_bytes", "Inline image bytes sent with a prompt.", ("model",), buckets=SIZE_BUCKETS)
+LLM_RESPONSE_CHARS = REGISTRY.histogram(
+    "musicnbrain_llm_response_chars", "Response size in characters.", ("model",), buckets=SIZE_BUCKETS)
+PDF_RENDER_SECONDS = REGISTRY.histogram(
+    "musicnbrain_pdf_render_duration_seconds", "reportlab render time per PDF.", ("layout",))
+CACHE_REQUESTS = REGISTRY.counter(
+    "musicnbrain_cache_requests_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result"))
+ADMISSION_RUNNING = REGISTRY.gauge(
+    "musicnbrain_admission_running_turns", "Chat turns currently running the agent.")
+ADMISSION_QUEUE_DEPTH = REGISTRY.gauge(
+    "musicnbrain_admission_queue_depth", "Chat turns waiting for a slot.")
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "musicnbrain_admission_wait_seconds", "Time a chat turn waited for a slot.", ("outcome",))
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    "musicnbrain_admission_rejections_total", "Chat turns turned away, by reason.", ("reason",))
+LLM_IN_FLIGHT = REGISTRY.gauge(
+    "musicnbrain_llm_in_flight", "GenAI calls currently running in this process.")
+LLM_WAIT_SECONDS = REGISTRY.histogram(
+    "musicnbrain_llm_slot_wait_seconds", "Time a GenAI call waited for a concurrency slot.", ("model",))
+LLM_FIRST_CHUNK_SECONDS = REGISTRY.histogram(
+    "musicnbrain_llm_first_chunk_seconds", "Time to the first streamed piece of a GenAI reply.", ("model",))
+LLM_RETRIES = REGISTRY.counter(
+    "musicnbrain_llm_retries_total", "GenAI requests retried, by reason.", ("model", "reason"))
+LLM_HEDGES = REGISTRY.counter(
+    "musicnbrain_llm_hedges_total", "Hedged GenAI calls, by which request answered first.", ("model", "winner"))
+LLM_BUDGET_DENIED = REGISTRY.counter(
+    "musicnbrain_llm_retry_budget_denied_total", "Retries and hedges skipped for lack of budget.", ("model", "kind"))
+
+
+# ============================================================
+# Trace spans
+# ============================================================
+_current_span: ContextVar[Optional[tuple]] = ContextVar("musicnbrain_span", default=None)
+_trace_lock = threading.Lock()
+
+
+def tracing_enabled() -> bool:
+    return bool(TRACE_FILE)
+
+
+def parse_trace_parent(value: str) -> Optional[tuple]:
+    """"trace:span" -> (trace_id, span_id), or None."""
+    if not value or ":" not in value:
+        return None
+    trace_id, span_id = value.split(":", 1)
+    return (trace_id, span_id) if trace_id and span_id else None
+
+
+def format_trace_parent(context: Optional[tuple]) -> str:
+    return f"{context[0]}:{context[1]}" if context else ""
+
+
+def current_span() -> Optional[tuple]:
+    return _current_span.get()
+
+
+class Span:
+    """One timed operation; end() appends it to TRACE_FILE."""
+
+    def __init__(self, name: str, parent: Optional[tuple] = None, **attrs):
+        parent = parent or _current_span.get()
+        self.name = name
+        self.trace_id = parent[0] if parent else uuid.uuid4().hex
+        self.parent_id = parent[1] if parent else None
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attrs = attrs
+        self.start = time.time()
+        self._start_perf = time.perf_counter()
+
+    @property
+    def context(self) -> tuple:
+        return (self.trace_id, self.span_id)
+
+    def end(self, **attrs) -> None:
+        self.attrs.update(attrs)
+        record = {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "name": self.name, "pid": os.getpid(), "start": round(self.start, 6),
+            "duration_ms": round((time.perf_counter() - self._start_perf) * 1000, 3),
+            "attrs": self.attrs,
+        }
+        line = json.dumps(record, default=str) + "\n"
+        try:
+            with _trace_lock, open(TRACE_FILE, "a") as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning(f"Could not write trace span: {e}")
+
+
+def start_span(name: str, parent: Optional[tuple] = None, **attrs) -> Optional[Span]:
+    """A started Span, or None when tracing is off."""
+    return Span(name, parent, **attrs) if TRACE_FILE else None
+
+
+@contextmanager
+def span(name: str, parent: Optional[tuple] = None, **attrs):
+    """Trace the enclosed block and make it the parent of spans started inside."""
+    current = start_span(name, parent, **attrs)
+    if current is None:
+        yield None
+        return
+    token = _current_span.set(current.context)
+    try:
+        yield current
+    finally:
+        _current_span.reset(token)
+        current.end()
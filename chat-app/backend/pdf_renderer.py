@@ -0,0 +1,297 @@
+"""
+MusicNBrain PDF Renderer - Concert program layout with reportlab
+Pure rendering: takes resolved program data and a theme, writes a PDF.
+"""
+
+import json
+from functools import lru_cache
+
+FONT_MAP = {
+    "serif": {"title": "Times-Bold", "body": "Times-Roman", "italic": "Times-Italic"},
+    "sans-serif": {"title": "Helvetica-Bold", "body": "Helvetica", "italic": "Helvetica-Oblique"},
+}
+
+# Distinct themes kept compiled; presets plus a few recent custom themes
+COMPILED_THEME_CACHE_SIZE = 64
+
+
+class CompiledTheme:
+    """
+    Everything about a theme that does not depend on the program: resolved
+    fonts, parsed colors and paragraph styles. Built once per theme and
+    shared by every render and every row, so rendering does no per-row
+    style allocation. Treat as read-only.
+    """
+
+    def __init__(self, theme: dict):
+        from reportlab.lib import colors
+        from reportlab.lib.enums import TA_CENTER
+        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+        self.theme = theme
+        self.layout = theme.get("layout", "list")
+        self.header_decoration = theme.get("header_decoration", "*  *  *")
+        self.footer_decoration = theme.get("footer_decoration", "")
+        self.fonts = FONT_MAP.get(theme.get("font_style", "serif"), FONT_MAP["serif"])
+
+        self.text_color = colors.HexColor(theme["text_color"])
+        self.subtitle_color = colors.HexColor(theme["subtitle_color"])
+        self.accent_color = colors.HexColor(theme["accent_color"])
+        self.bg_color = colors.HexColor(theme["bg_color"])
+        self.separator_color = colors.HexColor('#cccccc')
+        self.footer_color = colors.HexColor('#999999')
+        self.stripe_color = colors.HexColor('#f8f9fa')
+        self.table_rule_color = colors.HexColor('#eeeeee')
+        self.minimal_rule_color = colors.HexColor('#dddddd')
+
+        styles = getSampleStyleSheet()
+        fonts = self.fonts
+
+        self.title_style = ParagraphStyle(
+            'ConcertTitle',
+            parent=styles['Title'],
+            fontSize=theme.get("title_size", 28),
+            spaceAfter=8,
+            alignment=TA_CENTER,
+            fontName=fonts["title"],
+            textColor=self.text_color
+        )
+
+        self.subtitle_style = ParagraphStyle(
+            'ConcertSubtitle',
+            parent=styles['Normal'],
+            fontSize=12,
+            spaceAfter=4,
+            alignment=TA_CENTER,
+            fontName=fonts["italic"],
+            textColor=self.subtitle_color
+        )
+
+        self.divider_style = ParagraphStyle(
+            'Divider',
+            parent=styles['Normal'],
+            fontSize=14,
+            spaceBefore=16,
+            spaceAfter=16,
+            alignment=TA_CENTER,
+            fontName=fonts["title"],
+            textColor=self.accent_color,
+        )
+
+        # Piece name (bold, larger)
+        self.piece_style = ParagraphStyle(
+            'Piece',
+            parent=styles['Normal'],
+            fontSize=12,
+            fontName=fonts["title"],
+            textColor=self.text_color,
+            alignment=TA_CENTER,
+            spaceAfter=2
+        )
+
+        # Performer + instrument + duration
+        self.detail_style = ParagraphStyle(
+            'Detail',
+            parent=styles['Normal'],
+            fontSize=10,
+            fontName=fonts["italic"],
+            textColor=self.subtitle_color,
+            alignment=TA_CENTER,
+            spaceAfter=8
+        )
+
+        self.footer_decoration_style = ParagraphStyle(
+            'FooterDec', parent=styles['Normal'],
+            fontSize=12, alignment=TA_CENTER,
+            textColor=self.accent_color,
+        )
+
+        self.footer_style = ParagraphStyle(
+            'Footer',
+            parent=styles['Normal'],
+            fontSize=9,
+            alignment=TA_CENTER,
+            textColor=self.footer_color,
+            fontName=fonts["italic"]
+        )
+
+        self.table_styles = self._table_styles()
+
+    def _table_styles(self) -> list:
+        """Static commands for the table layouts (rows are addressed relatively)."""
+        from reportlab.lib import colors
+
+        fonts = self.fonts
+        table_styles = [
+            ('BACKGROUND', (0, 0), (-1, 0), self.bg_color),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), fonts["title"]),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('FONTNAME', (0, 1), (-1, -1), fonts["body"]),
+            ('FONTSIZE', (0, 1), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('TOPPADDING', (0, 1), (-1, -1), 8),
+            ('BOTTOMPADDING', (0, 1), (-1, -1), 8),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, self.stripe_color]),
+            ('ALIGN', (1, 1), (2, -1), 'LEFT'),
+        ]
+
+        if self.layout == "table":
+            table_styles.append(('LINEBELOW', (0, 0), (-1, 0), 2, self.accent_color))
+            table_styles.append(('LINEBELOW', (0, 1), (-1, -2), 0.5, self.table_rule_color))
+        else:  # minimal
+            table_styles.append(('LINEBELOW', (0, 0), (-1, -1), 0.5, self.minimal_rule_color))
+        return table_styles
+
+
+@lru_cache(maxsize=COMPILED_THEME_CACHE_SIZE)
+def _compile_theme_json(theme_json: str) -> CompiledTheme:
+    return CompiledTheme(json.loads(theme_json))
+
+
+def compile_theme(theme: dict) -> CompiledTheme:
+    """The CompiledTheme for a theme dict, reused across renders with equal themes."""
+    return _compile_theme_json(json.dumps(theme, sort_keys=True))
+
+
+def render_program_pdf(program: dict, theme: dict, output_path: str) -> None:
+    """
+    Render a concert program PDF.
+
+    Args:
+        program: concert_title, concert_date, concert_time, concert_venue and performances,
+            with any overrides already applied
+        theme: a resolved theme (colors, decorations, layout, font_style, title_size)
+        output_path: where to write the PDF
+    """
+    title = program.get("concert_title", "")
+    date = program.get("concert_date", "")
+    time_str = program.get("concert_time", "")
+    venue_str = program.get("concert_venue", "")
+    performances = program.get("performances", [])
+
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, HRFlowable
+
+    compiled = compile_theme(theme)
+
+    doc = SimpleDocTemplate(
+        output_path,
+        pagesize=letter,
+        rightMargin=72,
+        leftMargin=72,
+        topMargin=60,
+        bottomMargin=60
+    )
+
+    # Build the PDF content
+    story = []
+
+    # Top border line
+    story.append(Spacer(1, 0.3 * inch))
+    story.append(HRFlowable(
+        width="80%", thickness=1.5,
+        color=compiled.accent_color,
+        spaceAfter=20, spaceBefore=0
+    ))
+
+    # Title
+    story.append(Spacer(1, 0.2 * inch))
+    story.append(Paragraph(title, compiled.title_style))
+    story.append(Spacer(1, 0.1 * inch))
+
+    # Date, Time, Venue
+    info_parts = []
+    if date:
+        info_parts.append(date)
+    if time_str:
+        info_parts.append(time_str)
+    if info_parts:
+        story.append(Paragraph("  |  ".join(info_parts), compiled.subtitle_style))
+    if venue_str:
+        story.append(Paragraph(venue_str, compiled.subtitle_style))
+
+    story.append(Spacer(1, 0.15 * inch))
+
+    # Divider with theme decoration
+    story.append(Paragraph(compiled.header_decoration, compiled.divider_style))
+    story.append(Spacer(1, 0.15 * inch))
+
+    # Performance list — card style instead of table
+    num_performers = len(performances)
+    total_minutes = sum(p.get("estimated_duration_minutes", 0) for p in performances)
+    # Scheduled programs carry slot times (and rooms, for festivals)
+    scheduled = all(p.get("slot") for p in performances)
+    multi_room = scheduled and len({p.get("room") for p in performances}) > 1
+
+    if compiled.layout == "list":
+        # Elegant/Classic: List style with dotted separators
+        for i, p in enumerate(performances):
+            name = p.get("student_name", "")
+            piece = p.get("piece_name", "")
+            instrument = p.get("instrument", "")
+            duration = p.get("estimated_duration_minutes", "?")
+
+            story.append(Paragraph(piece, compiled.piece_style))
+
+            detail_text = name
+            if instrument:
+                detail_text += f", {instrument}"
+            detail_text += f"  ({duration} min)"
+            if scheduled:
+                detail_text = f"{p['slot']}{' · ' + p['room'] if multi_room else ''}  —  {detail_text}"
+            story.append(Paragraph(detail_text, compiled.detail_style))
+
+            # Separator between pieces
+            if i < num_performers - 1:
+                story.append(HRFlowable(
+                    width="30%", thickness=0.5,
+                    color=compiled.separator_color,
+                    spaceAfter=10, spaceBefore=4
+                ))
+    else:
+        # Modern/Minimal: Clean table style
+        table_data = [["Time" if scheduled else "#", "Performer", "Piece", "Instrument", "Duration"]]
+        col_widths = [0.6*inch if scheduled else 0.4*inch, 1.5*inch, 2.0*inch if scheduled else 2.2*inch, 1.0*inch, 0.7*inch]
+        if multi_room:
+            table_data[0].insert(1, "Room")
+            col_widths[1:3] = [0.8*inch, 1.3*inch, 1.5*inch]
+        for p in performances:
+            row = [
+                p["slot"] if scheduled else str(p.get("order", "")),
+                p.get("student_name", ""),
+                p.get("piece_name", ""),
+                p.get("instrument", ""),
+                f"{p.get('estimated_duration_minutes', '?')} min"
+            ]
+            if multi_room:
+                row.insert(1, p.get("room", ""))
+            table_data.append(row)
+
+        table = Table(table_data, colWidths=col_widths)
+        table.setStyle(TableStyle(compiled.table_styles + ([('ALIGN', (1, 1), (3, -1), 'LEFT')] if multi_room else [])))
+        story.append(table)
+
+    # Footer
+    story.append(Spacer(1, 0.4 * inch))
+
+    # Footer decoration
+    if compiled.footer_decoration:
+        story.append(Paragraph(compiled.footer_decoration, compiled.footer_decoration_style))
+        story.append(Spacer(1, 0.1 * inch))
+
+    story.append(HRFlowable(
+        width="80%", thickness=1.5,
+        color=compiled.accent_color,
+        spaceAfter=12, spaceBefore=0
+    ))
+
+    footer_style = compiled.footer_style
+    story.append(Paragraph(f"{num_performers} performances  \u00b7  Approximately {total_minutes} minutes", footer_style))
+    story.append(Spacer(1, 0.1 * inch))
+    story.append(Paragraph("Generated by MusicNBrain", footer_style))
+
+    # Build PDF
+    doc.build(story)
@@ -0,0 +1,361 @@
+"""
+MusicNBrain Program Edits - Patch-based corrections to program data
+Corrections are expressed as a small JSON Patch (RFC 6902 subset) instead of
+re-emitting the whole program. Common phrasings ("X should be Y", "swap 3 and
+5", "move X to the end", "change duration of X to 5 min") are turned into
+patches locally; everything else asks the LLM for a patch, which is validated
+before it is applied.
+"""
+
+import copy
+import re
+from typing import Optional
+
+PERFORMANCE_FIELDS = {
+    "student_name": str,
+    "piece_name": str,
+    "instrument": str,
+    "estimated_duration_minutes": (int, float),
+    "order": int,
+    "confidence": (int, float),
+}
+PROGRAM_FIELDS = {
+    "concert_title": str,
+    "concert_date": str,
+    "concert_time": str,
+    "concert_venue": str,
+    "concert_type": str,
+}
+ALLOWED_OPS = {"replace", "add", "remove", "move"}
+MAX_DURATION_MINUTES = 180
+
+_REMOVAL_WORDS = re.compile(r"\b(remove|delete|drop|cancel|withdr[ae]w|scratch|take out|not performing)\b", re.IGNORECASE)
+
+
+class PatchError(ValueError):
+    """Raised when a patch is malformed or does not fit the current program."""
+
+
+# ============================================================
+# Validation and application
+# ============================================================
+def _parse_path(path: str, num_rows: int, for_insert: bool = False):
+    """Split a JSON pointer into (index, field). Index is None for program fields."""
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise PatchError(f"Invalid path: {path!r}")
+    parts = path[1:].split("/")
+
+    if parts[0] in PROGRAM_FIELDS and len(parts) == 1:
+        return None, parts[0]
+    if parts[0] != "performances" or len(parts) not in (2, 3):
+        raise PatchError(f"Unsupported path: {path}")
+
+    limit = num_rows + 1 if for_insert else num_rows
+    if parts[1] == "-" and for_insert and len(parts) == 2:
+        index = num_rows
+    elif parts[1].isdigit() and int(parts[1]) < limit:
+        index = int(parts[1])
+    else:
+        raise PatchError(f"Row index out of range in path: {path}")
+
+    field = parts[2] if len(parts) == 3 else None
+    if field is not None and field not in PERFORMANCE_FIELDS:
+        raise PatchError(f"Unknown performance field: {field}")
+    return index, field
+
+
+def _check_value(field: Optional[str], value):
+    if field is None:
+        if not isinstance(value, dict):
+            raise PatchError("A performance must be an object")
+        for key, item in value.items():
+            _check_value(key, item)
+        if not value.get("student_name") or not value.get("piece_name"):
+            raise PatchError("A new performance needs student_name and piece_name")
+        return
+    expected = PERFORMANCE_FIELDS.get(field) or PROGRAM_FIELDS.get(field)
+    if expected is None:
+        raise PatchError(f"Unknown field: {field}")
+    if isinstance(value, bool) or not isinstance(value, expected):
+        raise PatchError(f"Invalid value for {field}: {value!r}")
+    if field == "estimated_duration_minutes" and not 0 < value <= MAX_DURATION_MINUTES:
+        raise PatchError(f"Duration out of range: {value}")
+    if isinstance(value, str) and not value.strip() and field in ("student_name", "piece_name"):
+        raise PatchError(f"{field} cannot be empty")
+
+
+def validate_patch(program: dict, patch: list, allow_removals: bool = False) -> None:
+    """
+    Check every op against the program it will be applied to, simulating row
+    count changes so later indices are checked against the right length.
+    """
+    if not isinstance(patch, list) or not patch:
+        raise PatchError("Patch must be a non-empty list of operations")
+
+    num_rows = len(program.get("performances", []))
+    for op in patch:
+        if not isinstance(op, dict) or op.get("op") not in ALLOWED_OPS:
+            raise PatchError(f"Unsupported operation: {op!r}")
+        kind = op["op"]
+
+        if kind == "replace":
+            index, field = _parse_path(op.get("path"), num_rows)
+            if index is not None and field is None:
+                _check_value(None, op.get("value"))
+            else:
+                _check_value(field, op.get("value"))
+        elif kind == "add":
+            index, field = _parse_path(op.get("path"), num_rows, for_insert=True)
+            if index is None or field is not None:
+                raise PatchError("add only inserts whole performances")
+            _check_value(None, op.get("value"))
+            num_rows += 1
+        elif kind == "remove":
+            if not allow_removals:
+                raise PatchError("Patch removes a performance but the instruction did not ask for that")
+            index, field = _parse_path(op.get("path"), num_rows)
+            if index is None or field is not None:
+                raise PatchError("remove only deletes whole performances")
+            num_rows -= 1
+        elif kind == "move":
+            source, source_field = _parse_path(op.get("from"), num_rows)
+            target, target_field = _parse_path(op.get("path"), num_rows)
+            if source is None or target is None or source_field or target_field:
+                raise PatchError("move only reorders whole performances")
+
+
+def _apply_op(program: dict, op: dict) -> None:
+    """Apply one validated op in place; rows it changes are replaced, never mutated."""
+    rows = program["performances"]
+    kind = op["op"]
+    if kind == "move":
+        source, _ = _parse_path(op["from"], len(rows))
+        target, _ = _parse_path(op["path"], len(rows))
+        rows.insert(target, rows.pop(source))
+        return
+
+    index, field = _parse_path(op["path"], len(rows), for_insert=(kind == "add"))
+    if kind == "add":
+        rows.insert(index, dict(op["value"]))
+    elif kind == "remove":
+        rows.pop(index)
+    elif index is None:
+        program[field] = op["value"]
+    elif field is None:
+        rows[index] = dict(op["value"])
+    else:
+        rows[index] = {**rows[index], field: op["value"]}
+
+
+def apply_patch(program: dict, patch: list) -> dict:
+    """Apply a validated patch to a copy of the program and renumber `order`."""
+    updated = copy.deepcopy(program)
+    rows = updated.setdefault("performances", [])
+    for op in patch:
+        _apply_op(updated, op)
+
+    for i, row in enumerate(rows, start=1):
+        row["order"] = i
+    return updated
+
+
+def _swap_at(patch: list, i: int, num_rows: int) -> Optional[tuple]:
+    """(low, high, ops used) when the moves starting at patch[i] swap two performances."""
+    first = patch[i]
+    if first.get("op") != "move":
+        return None
+    high, _ = _parse_path(first["from"], num_rows)
+    low, _ = _parse_path(first["path"], num_rows)
+    if high <= low:
+        return None
+    if high == low + 1:
+        return low, high, 1
+    second = patch[i + 1] if i + 1 < len(patch) else {}
+    if second.get("op") == "move" and second.get("from") == f"/performances/{low + 1}" \
+            and second.get("path") == f"/performances/{high}":
+        return low, high, 2
+    return None
+
+
+def describe_patch(program: dict, patch: list) -> list:
+    """Human-readable one-liners for each op, resolved against the program as patched so far."""
+    # A shallow copy is enough: _apply_op replaces rows rather than editing them
+    program = {**program, "performances": list(program.get("performances", []))}
+    lines = []
+    i = 0
+    while i < len(patch):
+        rows = program.get("performances", [])
+        op = patch[i]
+        path = op.get("path", "")
+        used = 1
+        swap = _swap_at(patch, i, len(rows))
+        if swap:
+            low, high, used = swap
+            lines.append(f"Swapped {rows[low].get('student_name', '?')} and {rows[high].get('student_name', '?')}")
+        elif op["op"] == "move":
+            source, _ = _parse_path(op["from"], len(rows))
+            target, _ = _parse_path(path, len(rows))
+            lines.append(f"Moved {rows[source].get('student_name', '?')} to position {target + 1}")
+        elif op["op"] == "add":
+            lines.append(f"Added {op['value'].get('student_name')} — {op['value'].get('piece_name')}")
+        elif op["op"] == "remove":
+            index, _ = _parse_path(path, len(rows))
+            lines.append(f"Removed {rows[index].get('student_name', '?') if index < len(rows) else 'a performance'}")
+        else:
+            index, field = _parse_path(path, len(rows))
+            if index is None:
+                lines.append(f"Set {field} to {op['value']}")
+            elif field is None:
+                lines.append(f"Replaced performance {index + 1}")
+            else:
+                old = rows[index].get(field, "") if index < len(rows) else ""
+                lines.append(f"Changed {field} of #{index + 1} from '{old}' to '{op['value']}'")
+        for step in patch[i:i + used]:
+            _apply_op(program, step)
+        i += used
+    return lines
+
+
+# ============================================================
+# Local fast path for common edit phrasings
+# ============================================================
+_SPLIT_FIELDS = ("student_name", "piece_name", "instrument")
+
+_RENAME_PATTERNS = [
+    re.compile(r"^(?:change|rename|correct|fix)\s+['\"]?(?P<old>.+?)['\"]?\s+(?:to|into|->|→)\s+['\"]?(?P<new>.+?)['\"]?$", re.IGNORECASE),
+    re.compile(r"^['\"]?(?P<old>.+?)['\"]?\s+(?:should be|should read|is actually|is really|->|→)\s+['\"]?(?P<new>.+?)['\"]?$", re.IGNORECASE),
+]
+_SWAP_PATTERN = re.compile(r"^swap\s+(?P<a>.+?)\s+(?:and|with)\s+(?P<b>.+?)$", re.IGNORECASE)
+_MOVE_PATTERN = re.compile(
+    r"^(?:move|put)\s+(?P<who>.+?)\s+to\s+(?:the\s+)?(?:(?P<end>end|last|bottom)|(?P<start>start|beginning|first|top|front)"
+    r"|(?:position|spot|slot|number|#)\s*(?P<pos>\d+))(?:\s+of the (?:program|list))?$",
+    re.IGNORECASE,
+)
+_DURATION_PATTERNS = [
+    re.compile(r"^(?:change|set|make|update)\s+(?:the\s+)?(?:duration|length|time)\s+(?:of|for)\s+(?P<who>.+?)\s+(?:to|=)\s+~?(?P<minutes>\d+(?:\.\d+)?)\s*(?:min(?:ute)?s?)?$", re.IGNORECASE),
+    re.compile(r"^(?P<who>.+?)(?:'s)?\s+(?:duration|length|piece)\s+(?:is|should be|takes)\s+~?(?P<minutes>\d+(?:\.\d+)?)\s*(?:min(?:ute)?s?)$", re.IGNORECASE),
+]
+_REMOVE_PATTERN = re.compile(r"^(?:remove|delete|drop|take out)\s+(?P<who>.+?)(?:\s+from the (?:program|list))?$", re.IGNORECASE)
+# "X should be last", "X is actually playing viola": an instruction, not a new value
+_NOT_A_VALUE = re.compile(
+    r"#\s*\d|\b(?:first|last|end|start|beginning|before|after|next|earlier|later|top|bottom|front|position|spot|slot"
+    r"|number|move[sd]?|moving|play(?:s|ing)?|sing(?:s|ing)?|perform(?:s|ing)?|goes|going|is|are|was|were|should"
+    r"|instead|not|also|too|removed?|deleted?)\b",
+    re.IGNORECASE,
+)
+_NAME_PARTICLES = {"de", "la", "le", "da", "di", "del", "der", "van", "von", "du", "dos", "bin", "y"}
+
+
+def _clean_instruction(text: str) -> str:
+    text = text.strip().rstrip(".!")
+    text = re.sub(r"^(?:please|pls|oh|oops|sorry)[,\s]+", "", text, flags=re.IGNORECASE)
+    # Keep the actual correction from "There's a spelling error. Tommy Chen should be Tommy Chang"
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+", text) if s.strip()]
+    return sentences[-1].strip().rstrip(".!") if sentences else text
+
+
+def find_row(rows: list, ref: str) -> Optional[int]:
+    """Resolve "3", "#3", "number 3" or a unique name/piece substring to a row index."""
+    ref = ref.strip().strip("'\"")
+    number = re.fullmatch(r"(?:#|no\.?\s*|number\s+|performance\s+)?(\d+)", ref, re.IGNORECASE)
+    if number:
+        index = int(number.group(1)) - 1
+        return index if 0 <= index < len(rows) else None
+
+    needle = ref.lower()
+    for field in ("student_name", "piece_name"):
+        exact = [i for i, row in enumerate(rows) if str(row.get(field, "")).lower() == needle]
+        if len(exact) == 1:
+            return exact[0]
+    matches = {i for i, row in enumerate(rows) for field in ("student_name", "piece_name")
+               if needle in str(row.get(field, "")).lower()}
+    return matches.pop() if len(matches) == 1 else None
+
+
+def _looks_like_value(field: str, value: str) -> bool:
+    """Whether `value` can stand in `field` as is: a short capitalised name, instrument or title."""
+    words = value.split()
+    if not words or _NOT_A_VALUE.search(value):
+        return False
+    if field == "student_name":
+        return len(words) <= 4 and all(
+            re.fullmatch(r"[^\W\d_][\w'.-]*", word) and (word[0].isupper() or word.lower() in _NAME_PARTICLES)
+            for word in words)
+    if field == "instrument":
+        return len(words) <= 3 and all(re.fullmatch(r"[^\W\d_][\w-]*", word) for word in words)
+    return len(words) <= 12 and not value[0].islower()
+
+
+def _rename_patch(rows: list, old: str, new: str) -> Optional[list]:
+    """Replace a unique occurrence of `old` inside one text field of one row."""
+    needle = old.lower()
+    hits = [(i, field) for i, row in enumerate(rows) for field in _SPLIT_FIELDS
+            if needle in str(row.get(field, "")).lower()]
+    if len(hits) != 1:
+        return None
+    index, field = hits[0]
+    if not _looks_like_value(field, new):
+        return None
+    value = str(rows[index][field])
+    start = value.lower().index(needle)
+    replaced = value[:start] + new + value[start + len(old):]
+    return [{"op": "replace", "path": f"/performances/{index}/{field}", "value": replaced}]
+
+
+def local_fix_patch(program: dict, instruction: str) -> Optional[list]:
+    """Turn a common correction phrasing into a patch, or None if the LLM is needed."""
+    rows = program.get("performances", [])
+    text = _clean_instruction(instruction)
+
+    match = _SWAP_PATTERN.match(text)
+    if match:
+        a, b = find_row(rows, match.group("a")), find_row(rows, match.group("b"))
+        if a is None or b is None or a == b:
+            return None
+        low, high = sorted((a, b))
+        patch = [{"op": "move", "from": f"/performances/{high}", "path": f"/performances/{low}"}]
+        if high > low + 1:
+            # The row that was at `low` now sits one further down
+            patch.append({"op": "move", "from": f"/performances/{low + 1}", "path": f"/performances/{high}"})
+        return patch
+
+    match = _MOVE_PATTERN.match(text)
+    if match:
+        index = find_row(rows, match.group("who"))
+        if index is None:
+            return None
+        if match.group("end"):
+            target = len(rows) - 1
+        elif match.group("start"):
+            target = 0
+        else:
+            target = int(match.group("pos")) - 1
+            if not 0 <= target < len(rows):
+                return None
+        return [{"op": "move", "from": f"/performances/{index}", "path": f"/performances/{target}"}]
+
+    for pattern in _DURATION_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            index = find_row(rows, match.group("who"))
+            if index is None:
+                return None
+            minutes = float(match.group("minutes"))
+            minutes = int(minutes) if minutes == int(minutes) else minutes
+            return [{"op": "replace", "path": f"/performances/{index}/estimated_duration_minutes", "value": minutes}]
+
+    match = _REMOVE_PATTERN.match(text)
+    if match:
+        index = find_row(rows, match.group("who"))
+        return None if index is None else [{"op": "remove", "path": f"/performances/{index}"}]
+
+    for pattern in _RENAME_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            return _rename_patch(rows, match.group("old").strip(), match.group("new").strip())
+    return None
+
+
+def allows_removals(instruction: str) -> bool:
+    """Only let a patch delete rows when the teacher asked for it."""
+    return bool(_REMOVAL_WORDS.search(instruction))
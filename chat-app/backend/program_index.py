@@ -0,0 +1,118 @@
+"""
+MusicNBrain Program Index - Fuzzy lookup of performances for corrections
+A trigram index over student names, pieces, composers and instruments, used
+to send the LLM only the rows a correction is about instead of the whole
+program.
+"""
+
+import re
+from collections import defaultdict
+
+INDEXED_FIELDS = ("student_name", "piece_name", "composer", "instrument")
+
+ORDINALS = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5, "sixth": 6,
+    "seventh": 7, "eighth": 8, "ninth": 9, "tenth": 10, "eleventh": 11, "twelfth": 12,
+}
+
+_ROW_NUMBER_RE = re.compile(
+    r"(?:#|\bno\.?\s*|\bnumber\s+|\brow\s+|\bperformance\s+|\bpiece\s+|\bslot\s+|\bposition\s+)(\d{1,4})\b"
+    r"|\b(\d{1,4})(?:st|nd|rd|th)\b",
+    re.IGNORECASE,
+)
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", str(text).lower()).split())
+
+
+def trigrams(text: str) -> set:
+    """Character trigrams of each word, padded so short names still index."""
+    grams = set()
+    for word in _normalize(text).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _composer(piece_name: str) -> str:
+    match = re.search(r"\(([^()]+)\)\s*$", piece_name or "")
+    return match.group(1) if match else ""
+
+
+class ProgramIndex:
+    """Inverted trigram index: trigram -> {(row, field)}."""
+
+    def __init__(self, performances: list):
+        self.performances = performances
+        self._postings = defaultdict(set)
+        self._sizes = {}
+
+        values = [
+            {field: _normalize(_composer(p.get("piece_name", "")) if field == "composer" else p.get(field, ""))
+             for field in INDEXED_FIELDS}
+            for p in performances
+        ]
+        # Values shared by many rows ("Piano") cannot single out a row; leave them out
+        frequency = defaultdict(int)
+        for row_values in values:
+            for field, value in row_values.items():
+                frequency[(field, value)] += 1
+        max_shared = max(3, len(performances) // 10)
+
+        for row, row_values in enumerate(values):
+            for field, value in row_values.items():
+                grams = trigrams(value)
+                if not grams or frequency[(field, value)] > max_shared:
+                    continue
+                self._sizes[(row, field)] = len(grams)
+                for gram in grams:
+                    self._postings[gram].add((row, field))
+
+    def search(self, query: str, min_score: float = 0.6) -> list:
+        """
+        Rows whose field values appear (fuzzily) in the query, best first, as
+        (row, score). The score is the share of a field's trigrams found in
+        the query, so "Tommy Chen should be Tommy Chang" scores 1.0 for the
+        row named Tommy Chen even in a program of hundreds.
+        """
+        hits = defaultdict(int)
+        for gram in trigrams(query):
+            for key in self._postings.get(gram, ()):
+                hits[key] += 1
+
+        best = {}
+        for (row, field), count in hits.items():
+            score = count / self._sizes[(row, field)]
+            if score >= min_score and score > best.get(row, 0.0):
+                best[row] = score
+        return sorted(best.items(), key=lambda item: (-item[1], item[0]))
+
+
+def referenced_rows(instruction: str, num_rows: int) -> list:
+    """Row indices referenced by number or ordinal ("#3", "the third piece", "the last one")."""
+    rows = []
+    for match in _ROW_NUMBER_RE.finditer(instruction):
+        rows.append(int(match.group(1) or match.group(2)) - 1)
+    lowered = instruction.lower()
+    for word, number in ORDINALS.items():
+        if re.search(rf"\b{word}\b", lowered):
+            rows.append(number - 1)
+    if re.search(r"\blast\b", lowered):
+        rows.append(num_rows - 1)
+    return [row for row in dict.fromkeys(rows) if 0 <= row < num_rows]
+
+
+def select_relevant_rows(performances: list, instruction: str, limit: int = 12) -> list:
+    """
+    Sorted row indices worth showing the model for this instruction: rows
+    referenced by position plus the best fuzzy matches. Empty when nothing
+    in the instruction points at a specific row.
+    """
+    selected = referenced_rows(instruction, len(performances))
+    for row, _ in ProgramIndex(performances).search(instruction):
+        if len(selected) >= limit:
+            break
+        if row not in selected:
+            selected.append(row)
+    return sorted(selected[:limit])
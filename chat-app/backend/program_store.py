@@ -0,0 +1,130 @@
+"""
+MusicNBrain Program Store - Session-keyed concert program data
+Each chat session owns its own program, so concurrent teachers never overwrite
+each other's performances. Memory is bounded (LRU cap) and idle sessions expire;
+with a backing store, saved programs come back after eviction or a restart.
+"""
+
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+# Session used when a tool is called without one (e.g. from the MCP inspector)
+DEFAULT_SESSION_ID = "default"
+
+
+def new_program() -> dict:
+    """Return an empty program with the standard metadata fields."""
+    return {
+        "concert_title": "",
+        "concert_date": "",
+        "concert_time": "",
+        "concert_venue": "",
+        "concert_type": "OFFLINE",
+        "performances": []
+    }
+
+
+class _Shard:
+    """One lock + LRU map. Sessions are spread over many shards to avoid contention."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        # session_id -> (last_access, program); ordered oldest access first
+        self.entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+
+
+class ProgramStore:
+    """
+    Bounded, thread-safe map of session_id -> program dict.
+
+    - Entries are kept in access order per shard; the least recently used
+      session is dropped when a shard is full.
+    - Sessions idle for longer than `idle_ttl_seconds` are evicted lazily on
+      access to their shard, or eagerly via `evict_idle()`.
+    - `backing` (optional, anything with get/put/delete such as a
+      PersistentLRUCache) keeps programs written with `save()`; a session
+      missing from memory is loaded from it before starting empty.
+    """
+
+    def __init__(self, max_sessions: int = 10000, idle_ttl_seconds: float = 6 * 3600,
+                 num_shards: int = 64, clock=time.monotonic, backing=None):
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.backing = backing
+        self._clock = clock
+        per_shard = max(1, -(-max_sessions // num_shards))
+        self._shards = [_Shard(per_shard) for _ in range(num_shards)]
+
+    def _shard_for(self, session_id: str) -> _Shard:
+        return self._shards[zlib.crc32(session_id.encode("utf-8")) % len(self._shards)]
+
+    def _expire(self, shard: _Shard, now: float) -> int:
+        """Drop expired entries from the front of a shard. Caller holds the lock."""
+        removed = 0
+        while shard.entries:
+            session_id, (last_access, _) = next(iter(shard.entries.items()))
+            if now - last_access <= self.idle_ttl_seconds:
+                break
+            del shard.entries[session_id]
+            removed += 1
+        return removed
+
+    def get(self, session_id: str = "") -> dict:
+        """Get the program for a session, creating an empty one if needed."""
+        session_id = session_id or DEFAULT_SESSION_ID
+        shard = self._shard_for(session_id)
+        now = self._clock()
+        with shard.lock:
+            self._expire(shard, now)
+            entry = shard.entries.pop(session_id, None)
+            if entry:
+                program = entry[1]
+            else:
+                program = (self.backing.get(session_id) if self.backing is not None else None) or new_program()
+            shard.entries[session_id] = (now, program)
+            while len(shard.entries) > shard.capacity:
+                shard.entries.popitem(last=False)
+            return program
+
+    def save(self, session_id: str = "") -> None:
+        """Write a session's current program to the backing store (no-op without one)."""
+        if self.backing is None:
+            return
+        program = self.peek(session_id)
+        if program is not None:
+            self.backing.put(session_id or DEFAULT_SESSION_ID, program)
+
+    def peek(self, session_id: str = "") -> Optional[dict]:
+        """Get the program for a session without creating or touching it."""
+        session_id = session_id or DEFAULT_SESSION_ID
+        shard = self._shard_for(session_id)
+        with shard.lock:
+            entry = shard.entries.get(session_id)
+            if entry and self._clock() - entry[0] <= self.idle_ttl_seconds:
+                return entry[1]
+            return None
+
+    def discard(self, session_id: str = "") -> None:
+        """Forget a session's program, including any saved copy."""
+        session_id = session_id or DEFAULT_SESSION_ID
+        shard = self._shard_for(session_id)
+        with shard.lock:
+            shard.entries.pop(session_id, None)
+        if self.backing is not None:
+            self.backing.delete(session_id)
+
+    def evict_idle(self) -> int:
+        """Evict every idle session now. Returns the number evicted."""
+        now = self._clock()
+        removed = 0
+        for shard in self._shards:
+            with shard.lock:
+                removed += self._expire(shard, now)
+        return removed
+
+    def __len__(self) -> int:
+        return sum(len(shard.entries) for shard in self._shards)
@@ -0,0 +1,195 @@
+"""
+MusicNBrain Render Cache - Content-addressed store of rendered program PDFs
+A render is keyed by a hash of the normalized program data, metadata and
+theme, so asking for the same PDF twice reuses the first render. The
+directory is bounded by total size; least recently used files go first.
+The API and the MCP server share the directory: file times are the LRU
+order, and eviction rescans the directory under a file lock so the budget
+covers both processes' renders.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: eviction is only coordinated within the process
+    fcntl = None
+
+# Bump when the PDF layout changes so old renders are not reused
+RENDERER_VERSION = "1"
+
+# Performance fields that never appear in the PDF
+_UNRENDERED_FIELDS = {"confidence", "source_line"}
+
+# Renders double as downloadable artifacts: the key is the artifact id and
+# the cache directory is served under this URL prefix
+ARTIFACT_URL_PREFIX = "/static/programs/"
+_ARTIFACT_MARKER_RE = re.compile(r"\[artifact:([0-9a-f]{64})\]")
+
+# The other process's renders are counted by rescanning the directory at most
+# this often (or when our own count goes over budget); eviction then goes down
+# to EVICT_TO of the budget so the next renders do not each trigger one
+RESCAN_INTERVAL_SECONDS = 5.0
+EVICT_TO = 0.9
+
+
+def artifact_marker(artifact_id: str) -> str:
+    """Tag placed in tool results so the backend can find the produced PDF."""
+    return f"[artifact:{artifact_id}]"
+
+
+def find_artifact_ids(text: str) -> list:
+    """All artifact ids tagged in a tool result, in order."""
+    return _ARTIFACT_MARKER_RE.findall(text or "")
+
+
+def artifact_url(artifact_id: str) -> str:
+    return f"{ARTIFACT_URL_PREFIX}{artifact_id}.pdf"
+
+
+def render_key(program: dict, theme: dict) -> str:
+    """Hash of everything that affects the rendered PDF."""
+    normalized = {
+        "renderer": RENDERER_VERSION,
+        "program": {k: v for k, v in program.items() if k != "performances"},
+        "performances": [
+            {k: v for k, v in p.items() if k not in _UNRENDERED_FIELDS}
+            for p in program.get("performances", [])
+        ],
+        "theme": theme,
+    }
+    payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def _directory_lock(directory: str):
+    """Exclusive lock shared by every process using the cache directory."""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, ".lock"), "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class RenderCache:
+    """
+    Directory of `<key>.pdf` files with a total size cap.
+    The in-memory index is rebuilt from the directory, oldest first, on
+    start and whenever a new render may push the directory over budget.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 200 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._rescan()
+
+    def _rescan(self) -> None:
+        """Rebuild the index from the directory, least recently used first (call with the lock held)."""
+        found = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".pdf"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue  # evicted by the other process meanwhile
+                    found.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        self._entries = OrderedDict((key, size) for _, key, size in sorted(found))
+        self._total_bytes = sum(self._entries.values())
+        self._rescanned_at = time.monotonic()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key: str) -> Optional[str]:
+        """Path of the cached render, or None. Marks the entry as recently used."""
+        with self._lock:
+            if not os.path.exists(self.path_for(key)):
+                self._forget(key)
+                self.misses += 1
+                return None
+            if key not in self._entries:
+                # Rendered by the other process sharing the directory
+                self._entries[key] = os.path.getsize(self.path_for(key))
+                self._total_bytes += self._entries[key]
+            self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            os.utime(self.path_for(key))
+        except OSError:
+            pass
+        return self.path_for(key)
+
+    def render(self, key: str, render_fn: Callable[[str], None]) -> str:
+        """Render into a temp file, publish it atomically under the key and evict if over budget."""
+        path = self.path_for(key)
+        tmp_path = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp")
+        try:
+            render_fn(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return self.adopt(key)
+
+    def adopt(self, key: str) -> str:
+        """Index a render written to path_for(key) by someone else (e.g. a worker process)."""
+        path = self.path_for(key)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            if (self._total_bytes <= self.max_bytes
+                    and time.monotonic() - self._rescanned_at < RESCAN_INTERVAL_SECONDS):
+                return path
+            # The other process's renders are not in our index: recount from the
+            # directory before deciding, and let only one process evict at a time
+            with _directory_lock(self.directory):
+                self._rescan()
+                self._entries.move_to_end(key)
+                if self._total_bytes > self.max_bytes:
+                    self._evict(int(self.max_bytes * EVICT_TO))
+        return path
+
+    def _forget(self, key: str) -> None:
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _evict(self, target: int) -> None:
+        # Always keep the newest entry, even if it alone exceeds the budget
+        while self._total_bytes > target and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self._entries), "bytes": self._total_bytes}
@@ -0,0 +1,249 @@
+"""
+MusicNBrain Roster Parser - Local fast path for well-formed program text
+Handles CSV/TSV rosters with a header row and numbered/bulleted lists like
+"1. Tommy Chen - Fur Elise, 4min". Produces the same `performances` schema
+as the LLM parser, with a per-row confidence; rows it is unsure about are
+left for the LLM.
+"""
+
+import csv
+import io
+import re
+from typing import Optional
+
+# Rows at or above this confidence are used as-is; the rest go to the LLM
+CONFIDENCE_THRESHOLD = 0.75
+
+DEFAULT_INSTRUMENT = "Piano"
+DEFAULT_DURATION_MINUTES = 4
+
+INSTRUMENTS = [
+    "piano", "violin", "viola", "cello", "double bass", "bass", "guitar", "ukulele",
+    "harp", "flute", "piccolo", "clarinet", "oboe", "bassoon", "saxophone", "sax",
+    "trumpet", "trombone", "french horn", "horn", "tuba", "drums", "drum kit",
+    "percussion", "marimba", "xylophone", "organ", "keyboard", "voice", "vocal",
+    "vocals", "soprano", "alto", "tenor", "baritone", "recorder", "accordion",
+]
+
+HEADER_ALIASES = {
+    "student_name": ["student", "student name", "name", "performer", "performers", "student_name"],
+    "piece_name": ["piece", "piece name", "piece_name", "title", "song", "work", "repertoire"],
+    "composer": ["composer", "by"],
+    "instrument": ["instrument", "instruments"],
+    "estimated_duration_minutes": ["duration", "time", "length", "minutes", "mins", "min",
+                                   "duration (min)", "estimated_duration_minutes"],
+}
+
+_INSTRUMENT_RE = re.compile(
+    r"\b(" + "|".join(sorted((re.escape(i) for i in INSTRUMENTS), key=len, reverse=True)) + r")\b",
+    re.IGNORECASE,
+)
+_LIST_ITEM_RE = re.compile(r"^\s*(?:\(?\d{1,4}[.)\]:]|[-*•])\s+(?P<rest>.+?)\s*$")
+_DURATION_RE = re.compile(
+    r"[,;(]?\s*~?\s*(?:(?P<mm>\d{1,2}):(?P<ss>[0-5]\d)|(?P<num>\d+(?:\.\d+)?)(?:-\d+)?\s*"
+    r"(?:min(?:ute)?s?\.?|m)(?![a-z]))\s*\)?\s*$",
+    re.IGNORECASE,
+)
+_NAME_PIECE_SEPARATORS = re.compile(r"\s+[-–—]\s+|\s*:\s+")
+# Text before a duration that ends like this may have lent it a piece number ("Nocturne No. 2 4 min")
+_NUMBERED_TAIL_RE = re.compile(r"(?:\b(?:no|op)\.?|\d)$", re.IGNORECASE)
+_BY_COMPOSER_RE = re.compile(r"^(?P<piece>.+?)\s+by\s+(?P<composer>[A-Z][\w.' -]+)$")
+
+
+def parse_duration(text: str) -> Optional[float]:
+    """Parse "4min", "~6 min", "3:30" or a bare number of minutes."""
+    text = str(text).strip()
+    if not text:
+        return None
+    match = _DURATION_RE.search(text)
+    if match:
+        if match.group("mm"):
+            return round(int(match.group("mm")) + int(match.group("ss")) / 60, 1)
+        return _as_minutes(float(match.group("num")))
+    if re.fullmatch(r"~?\s*\d+(?:\.\d+)?", text):
+        return _as_minutes(float(text.lstrip("~ ")))
+    return None
+
+
+def _as_minutes(value: float):
+    return int(value) if value == int(value) else value
+
+
+def _instrument_from(text: str) -> Optional[str]:
+    match = _INSTRUMENT_RE.search(text)
+    return match.group(1).title() if match else None
+
+
+def _performance(student_name: str, piece_name: str, instrument: Optional[str],
+                 duration, confidence: float, source_line: int) -> dict:
+    return {
+        "order": 0,
+        "student_name": student_name,
+        "piece_name": piece_name,
+        "instrument": instrument or DEFAULT_INSTRUMENT,
+        "estimated_duration_minutes": duration if duration is not None else DEFAULT_DURATION_MINUTES,
+        "confidence": round(confidence, 2),
+        "source_line": source_line,
+    }
+
+
+# ============================================================
+# Delimited rosters (CSV / TSV / semicolon)
+# ============================================================
+def _header_map(header: list) -> dict:
+    columns = {}
+    for index, cell in enumerate(header):
+        key = cell.strip().lower().strip("#").strip()
+        for field, aliases in HEADER_ALIASES.items():
+            if key in aliases and field not in columns:
+                columns[field] = index
+    return columns
+
+
+def _find_header(lines: list):
+    """Find the header row (allowing a short preamble). Returns (index, delimiter, columns)."""
+    for index, (_, line) in enumerate(lines[:5]):
+        delimiter = max("\t,;", key=line.count)
+        if line.count(delimiter) == 0:
+            continue
+        columns = _header_map(next(csv.reader([line], delimiter=delimiter)))
+        if "student_name" in columns and "piece_name" in columns:
+            return index, delimiter, columns
+    return None
+
+
+def _parse_delimited(lines: list) -> Optional[dict]:
+    found = _find_header(lines)
+    if not found:
+        return None
+    header_index, delimiter, columns = found
+
+    performances, unparsed = [], []
+    for line_no, line in lines[header_index + 1:]:
+        cells = next(csv.reader(io.StringIO(line), delimiter=delimiter), [])
+        if not any(c.strip() for c in cells):
+            continue
+        cell = lambda field: cells[columns[field]].strip() if field in columns and columns[field] < len(cells) else ""
+
+        name, piece = cell("student_name"), cell("piece_name")
+        if not name or not piece:
+            unparsed.append((line_no, line))
+            continue
+
+        composer = cell("composer")
+        if composer and composer.lower() not in piece.lower():
+            piece = f"{piece} ({composer})"
+        duration = parse_duration(cell("estimated_duration_minutes"))
+        instrument = cell("instrument") or None
+
+        confidence = 0.95
+        if duration is None:
+            confidence -= 0.35
+        if instrument is None:
+            confidence -= 0.05
+        performances.append(_performance(name, piece, instrument, duration, confidence, line_no))
+
+    return {"format": "delimited", "performances": performances, "unparsed": unparsed}
+
+
+# ============================================================
+# Numbered / bulleted lists
+# ============================================================
+def _parse_list_item(rest: str, line_no: int) -> Optional[dict]:
+    duration = None
+    numbered_tail = False
+    match = _DURATION_RE.search(rest)
+    if match:
+        duration = parse_duration(match.group(0))
+        numbered_tail = bool(_NUMBERED_TAIL_RE.search(rest[:match.start()].rstrip()))
+        rest = rest[:match.start()].rstrip(" ,;~-")
+
+    parts = _NAME_PIECE_SEPARATORS.split(rest, maxsplit=1)
+    if len(parts) != 2:
+        return None
+    name, piece = parts[0].strip(), parts[1].strip().strip(",;")
+    if not name or not piece:
+        return None
+
+    confidence = 0.95
+    instrument = None
+
+    # Trailing "(Violin)" or ", violin" names the instrument rather than the piece
+    trailing = re.search(r"(?:\(([^()]+)\)|,\s*([^,]+))$", piece)
+    if trailing:
+        candidate = (trailing.group(1) or trailing.group(2)).strip()
+        if _INSTRUMENT_RE.fullmatch(candidate):
+            instrument = candidate.title()
+            piece = piece[:trailing.start()].rstrip(" ,")
+
+    by_composer = _BY_COMPOSER_RE.match(piece)
+    if by_composer:
+        piece = f"{by_composer.group('piece')} ({by_composer.group('composer').strip()})"
+
+    if instrument is None:
+        instrument = _instrument_from(piece)
+        if instrument and "," in piece:
+            # "Piano duet, Hungarian Dance No.5": unclear which part is the piece
+            confidence -= 0.3
+    if "," in piece or " - " in piece:
+        confidence -= 0.2
+    if duration is None:
+        confidence -= 0.35
+    if numbered_tail:
+        confidence -= 0.3
+    if instrument is None:
+        confidence -= 0.05
+    return _performance(name, piece, instrument, duration, confidence, line_no)
+
+
+def _looks_like_row(line: str) -> bool:
+    """Whether an unnumbered line may be a performance: a name/piece separator or a duration, not a heading."""
+    if line.rstrip().endswith(":"):
+        return False
+    return bool(_NAME_PIECE_SEPARATORS.search(line) or _DURATION_RE.search(line))
+
+
+def _parse_list(lines: list) -> Optional[dict]:
+    performances, unparsed = [], []
+    items = 0
+    for line_no, line in lines:
+        match = _LIST_ITEM_RE.match(line)
+        if not match:
+            # An unnumbered row is left for the LLM rather than dropped; greetings,
+            # headings and sign-offs are not worth a model call
+            if _looks_like_row(line):
+                unparsed.append((line_no, line))
+            continue
+        items += 1
+        performance = _parse_list_item(match.group("rest"), line_no)
+        if performance:
+            performances.append(performance)
+        else:
+            unparsed.append((line_no, line))
+
+    if items == 0:
+        return None
+    return {"format": "list", "performances": performances, "unparsed": unparsed}
+
+
+def parse_roster(raw_text: str) -> dict:
+    """
+    Parse a roster without the LLM.
+
+    Returns {"format", "performances", "unparsed"}:
+      - format: "delimited", "list" or None when the text has no recognizable structure
+      - performances: rows in input order, each with "confidence" and "source_line"
+      - unparsed: (line_no, text) entries that looked like rows but could not be parsed;
+        for lists, also unnumbered lines with a name/piece separator or a duration
+    Lines before a delimited roster's header are ignored, as are a list's other
+    lines (greetings, headings ending in ":", sign-offs).
+    """
+    lines = [(i, line.strip()) for i, line in enumerate(raw_text.splitlines(), start=1) if line.strip()]
+    if not lines:
+        return {"format": None, "performances": [], "unparsed": []}
+
+    for parser in (_parse_delimited, _parse_list):
+        result = parser(lines)
+        if result and result["performances"]:
+            return result
+    return {"format": None, "performances": [], "unparsed": []}
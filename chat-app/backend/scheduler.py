@@ -0,0 +1,335 @@
+"""
+MusicNBrain Scheduler - Slot times for recitals and multi-room festivals
+Turns a program's performances and estimated durations into a timetable:
+each performance gets a room, a session and start/end times, with
+intermissions between sessions. Performances needing a stage setup (harp,
+drum kit, mallets) are kept together so the stage is rebuilt as rarely as
+possible, rooms are balanced by total minutes, sessions within a room by
+length, and no performer or sibling group is on two stages at once.
+
+Everything is greedy and linear-ish (LPT room assignment, then one sweep
+over time across all rooms), so re-solving a few thousand performances
+takes well under a second.
+"""
+
+import heapq
+import math
+import re
+from typing import Optional
+
+from roster_parser import DEFAULT_DURATION_MINUTES
+
+# Extra minutes to set the stage up for an instrument group (after an
+# intermission the setup happens during the break)
+SETUP_MINUTES = {"harp": 5, "drums": 5, "mallets": 4}
+
+_SETUP_GROUPS = [
+    ("harp", re.compile(r"\bharp\b", re.IGNORECASE)),
+    ("drums", re.compile(r"\b(drum|drums|drum kit|drum set|percussion|timpani)\b", re.IGNORECASE)),
+    ("mallets", re.compile(r"\b(marimba|xylophone|vibraphone|glockenspiel)\b", re.IGNORECASE)),
+]
+
+# No performance runs past this time of day; the rest continue the next day
+# at the start time
+DEFAULT_DAY_END = "10:00 PM"
+
+# How far down a room's queue to look for a performance whose performers are free
+LOOKAHEAD = 25
+
+_NAME_SEPARATORS = re.compile(r"\s*(?:&|\+|/|,|;|\band\b)\s*", re.IGNORECASE)
+_CLOCK = re.compile(r"^\s*(\d{1,2})(?:[:.](\d{2}))?\s*([ap])?\.?\s*m?\.?\s*$", re.IGNORECASE)
+
+
+class ScheduleError(ValueError):
+    """Raised for settings that cannot produce a schedule (bad start time, no rooms, ...)."""
+
+
+# ============================================================
+# Inputs
+# ============================================================
+def parse_clock(text: str, what: str = "start time") -> int:
+    """Minutes after midnight for "2:00 PM", "14:00", "2pm" or "9"."""
+    match = _CLOCK.match(text or "")
+    if not match:
+        raise ScheduleError(f"Could not read the {what} {text!r}. Use a time like 2:00 PM or 14:00.")
+    hours, minutes, meridiem = int(match.group(1)), int(match.group(2) or 0), (match.group(3) or "").lower()
+    if meridiem == "p" and hours < 12:
+        hours += 12
+    elif meridiem == "a" and hours == 12:
+        hours = 0
+    if hours > 23 or minutes > 59:
+        raise ScheduleError(f"Could not read the {what} {text!r}. Use a time like 2:00 PM or 14:00.")
+    return hours * 60 + minutes
+
+
+def format_clock(minutes: float) -> str:
+    """ "14:05" for minutes after midnight of the first day; later days get a "+1d" suffix."""
+    minutes = int(round(minutes))
+    days, minutes = divmod(minutes, 24 * 60)
+    clock = f"{minutes // 60:02d}:{minutes % 60:02d}"
+    return f"{clock} (+{days}d)" if days else clock
+
+
+def performer_names(student_name: str) -> list:
+    """The people in a performance: "Jack and Sarah Lee" -> ["jack", "sarah lee"]."""
+    return [name.lower() for name in _NAME_SEPARATORS.split(student_name or "") if name.strip()]
+
+
+def parse_sibling_groups(text: str) -> list:
+    """'Amy Chen & Tom Chen; Jack Lee, Sarah Lee' -> [["amy chen", "tom chen"], ["jack lee", "sarah lee"]]."""
+    groups = []
+    for line in re.split(r"[;\n]", text or ""):
+        names = performer_names(line)
+        if len(names) > 1:
+            groups.append(names)
+    return groups
+
+
+def parse_rooms(rooms) -> list:
+    """Room names from a count ("3", 3) or a comma-separated list of names."""
+    if isinstance(rooms, int) or (isinstance(rooms, str) and rooms.strip().isdigit()):
+        count = int(rooms)
+        if count < 1:
+            raise ScheduleError("There must be at least one room.")
+        return ["Main stage"] if count == 1 else [f"Room {i}" for i in range(1, count + 1)]
+    names = [name.strip() for name in re.split(r"[,;\n]", rooms or "") if name.strip()]
+    if not names:
+        raise ScheduleError("There must be at least one room.")
+    return names
+
+
+def setup_group(instrument: str) -> Optional[str]:
+    """The stage setup an instrument needs ("harp", "drums", "mallets"), or None."""
+    for group, pattern in _SETUP_GROUPS:
+        if pattern.search(instrument or ""):
+            return group
+    return None
+
+
+def _duration(performance: dict) -> float:
+    try:
+        minutes = float(performance.get("estimated_duration_minutes") or DEFAULT_DURATION_MINUTES)
+    except (TypeError, ValueError):
+        minutes = DEFAULT_DURATION_MINUTES
+    return max(minutes, 0.5)
+
+
+# ============================================================
+# Room assignment
+# ============================================================
+def _blocks(items: list, rooms: int, group_setups: bool) -> list:
+    """
+    Units that are assigned to a room as a whole, each a list of items in
+    program order: one block per setup group (split if a room could not take
+    it whole), and single performances otherwise.
+    """
+    if not group_setups:
+        return [[item] for item in items]
+    grouped, blocks = {}, []
+    for item in items:
+        if item["group"]:
+            grouped.setdefault(item["group"], []).append(item)
+        else:
+            blocks.append([item])
+    share = sum(item["minutes"] for item in items) / rooms
+    for group_items in grouped.values():
+        minutes = sum(item["minutes"] for item in group_items)
+        pieces = max(1, math.ceil(minutes / share)) if rooms > 1 else 1
+        size = math.ceil(len(group_items) / pieces)
+        blocks.extend(group_items[i:i + size] for i in range(0, len(group_items), size))
+    return blocks
+
+
+def _assign_rooms(items: list, rooms: int, changeover: float, group_setups: bool) -> list:
+    """
+    Longest block first onto the least loaded room; returns each room's items
+    in program order. Items with a "room" stay in it, in their previous
+    timetable order, ahead of the newly placed ones.
+    """
+    cost = lambda block: sum(item["minutes"] + changeover for item in block)
+    kept = [sorted((item for item in items if item["room"] == room), key=lambda item: item["previous"])
+            for room in range(rooms)]
+    blocks = _blocks([item for item in items if item["room"] is None], rooms, group_setups)
+    blocks.sort(key=lambda block: -cost(block))
+    loads = [(cost(kept[room]), room) for room in range(rooms)]
+    heapq.heapify(loads)
+    assigned = [[] for _ in range(rooms)]
+    for block in blocks:
+        load, room = heapq.heappop(loads)
+        assigned[room].append(block)
+        heapq.heappush(loads, (load + cost(block), room))
+    # Blocks keep the program order of their first performance; a setup group stays together
+    return [kept[room] + [item for block in sorted(assigned[room], key=lambda b: b[0]["index"]) for item in block]
+            for room in range(rooms)]
+
+
+# ============================================================
+# Timetable
+# ============================================================
+def schedule(performances: list, start: str = "9:00 AM", rooms="1", session_minutes: float = 90,
+             intermission_minutes: float = 15, changeover_minutes: float = 1, siblings=(),
+             group_setups: bool = True, keep_rooms: bool = False, day_end: str = DEFAULT_DAY_END) -> dict:
+    """
+    Compute a timetable. `performances` are program rows (student_name,
+    instrument, estimated_duration_minutes, ...); `siblings` are groups of
+    names (see parse_sibling_groups) that must not overlap. With
+    `keep_rooms`, rows already in one of the rooms stay there in their
+    current order (for re-solves after a small edit). A session that would
+    run past `day_end` is closed and the timetable continues at the start
+    time the next day. Returns {"performances": rows in timetable order
+    (copies, with room, session, slot, slot_end, order and program_position
+    set), "rooms": per-room summary, "end": clock, "days": days used,
+    "changeovers": setup changes, "waits": minutes a room stood idle
+    waiting for a performer}.
+    """
+    start_minutes = parse_clock(start)
+    day_end_minutes = parse_clock(day_end, "end of the day")
+    room_names = parse_rooms(rooms)
+    if session_minutes <= 0 or intermission_minutes < 0 or changeover_minutes < 0:
+        raise ScheduleError("Session length must be positive and breaks cannot be negative.")
+    if day_end_minutes <= start_minutes:
+        raise ScheduleError(f"The day must end after the start time ({format_clock(start_minutes)}).")
+    day_length = day_end_minutes - start_minutes
+    for performance in performances:
+        if _duration(performance) + SETUP_MINUTES.get(setup_group(performance.get("instrument", "")), 0) > day_length:
+            raise ScheduleError(f"{performance.get('student_name', 'A performance')} ({_duration(performance):g} min) "
+                                f"does not fit between {format_clock(start_minutes)} and "
+                                f"{format_clock(day_end_minutes)}.")
+
+    family_of = {}
+    for i, group in enumerate(siblings):
+        for name in group:
+            family_of.setdefault(name, []).append(f"family:{i}")
+
+    # Solve in the original program order, whatever order an earlier timetable
+    # left the rows in, so re-solving with the same settings changes nothing.
+    # Rows added since then go after the rest.
+    known = [p["program_position"] for p in performances if isinstance(p.get("program_position"), int)]
+    next_position = max(known, default=0) + 1
+    positioned = []
+    for index, performance in enumerate(performances):
+        position = performance.get("program_position")
+        if not isinstance(position, int):
+            position, next_position = next_position, next_position + 1
+        positioned.append((position, index, performance))
+    positioned.sort(key=lambda entry: entry[:2])
+
+    items = []
+    for index, (position, previous, performance) in enumerate(positioned):
+        people = performer_names(performance.get("student_name", ""))
+        keys = {f"person:{name}" for name in people}
+        for name in people:
+            keys.update(family_of.get(name, ()))
+        room = room_names.index(performance["room"]) if keep_rooms and performance.get("room") in room_names else None
+        items.append({"index": index, "position": position, "previous": previous, "room": room, "row": performance,
+                      "minutes": _duration(performance), "group": setup_group(performance.get("instrument", "")),
+                      "keys": keys})
+
+    queues = _assign_rooms(items, len(room_names), changeover_minutes, group_setups)
+
+    # One sweep over time: always extend the room that is furthest behind, so
+    # every placement starts no earlier than the ones before it and "busy
+    # until" per person/family is enough to rule out overlaps
+    busy_until = {}
+    rooms_state = []
+    for room, queue in enumerate(queues):
+        total = sum(item["minutes"] + changeover_minutes for item in queue)
+        sessions = max(1, math.ceil(total / session_minutes))
+        rooms_state.append({
+            "name": room_names[room], "queue": queue, "target": total / sessions, "planned": sessions, "session": 1,
+            "session_start": start_minutes, "last_end": start_minutes, "elapsed": 0.0, "group": None, "sessions": [],
+            "changeovers": 0, "waits": 0.0, "placed": [],
+        })
+    heap = [(start_minutes, room) for room in range(len(rooms_state))]
+    heapq.heapify(heap)
+
+    while heap:
+        now, room = heapq.heappop(heap)
+        state = rooms_state[room]
+        queue = state["queue"]
+        if not queue:
+            continue
+
+        # Prefer the next performance; look further down the queue if its performers are busy
+        choice = None
+        for offset in range(min(LOOKAHEAD, len(queue))):
+            item = queue[offset]
+            setup = SETUP_MINUTES.get(item["group"], 0) if item["group"] != state["group"] else 0
+            if all(busy_until.get(key, 0) <= now + setup for key in item["keys"]):
+                choice = offset
+                break
+        if choice is None:
+            # Everyone nearby is on another stage: wait for the first of them to finish
+            free_at = max(busy_until.get(key, 0) for key in queue[0]["keys"])
+            state["waits"] += free_at - now
+            heapq.heappush(heap, (free_at, room))
+            continue
+
+        item = queue[choice]
+        setup = SETUP_MINUTES.get(item["group"], 0) if item["group"] != state["group"] else 0
+        elapsed = state["elapsed"]
+        day = (now - start_minutes) // (24 * 60)
+        if now + setup + item["minutes"] > day * 24 * 60 + day_end_minutes:
+            # Too late today: close the session and carry on at the start time tomorrow
+            if elapsed > 0:
+                state["sessions"].append((state["session_start"], state["last_end"]))
+                state["session"] += 1
+            tomorrow = (day + 1) * 24 * 60 + start_minutes
+            state.update(session_start=tomorrow, elapsed=0.0, group=None)
+            heapq.heappush(heap, (tomorrow, room))
+            continue
+        # Sessions end near the balanced target (the last one takes the rest) and never run long
+        balanced = elapsed >= state["target"] and state["session"] < state["planned"]
+        if elapsed > 0 and (balanced or elapsed + setup + item["minutes"] > session_minutes):
+            # Close the session; the next stage setup happens during the intermission
+            state["sessions"].append((state["session_start"], state["last_end"]))
+            resume = max(now, state["last_end"] + intermission_minutes)
+            state.update(session=state["session"] + 1, session_start=resume, elapsed=0.0, group=None)
+            heapq.heappush(heap, (resume, room))
+            continue
+
+        queue.pop(choice)
+        if setup:
+            state["changeovers"] += 1
+        begin = now + setup
+        end = begin + item["minutes"]
+        for key in item["keys"]:
+            busy_until[key] = end
+        state["placed"].append((item, state["session"], begin, end))
+        state["last_end"] = end
+        # A harp or drum kit stays on stage (pushed aside) until another setup replaces it
+        state["group"] = item["group"] or state["group"]
+        state["elapsed"] = elapsed + setup + item["minutes"] + changeover_minutes
+        if queue:
+            heapq.heappush(heap, (end + changeover_minutes, room))
+        else:
+            state["sessions"].append((state["session_start"], end))
+
+    scheduled, summary = [], []
+    for state in rooms_state:
+        for item, session, begin, end in state["placed"]:
+            row = dict(item["row"], room=state["name"], session=session, program_position=item["position"],
+                       slot=format_clock(begin), slot_end=format_clock(end))
+            scheduled.append(row)
+        summary.append({
+            "room": state["name"],
+            "performances": len(state["placed"]),
+            "sessions": [{"start": format_clock(a), "end": format_clock(b)} for a, b in state["sessions"]],
+            "end": format_clock(state["sessions"][-1][1]) if state["sessions"] else format_clock(start_minutes),
+            "changeovers": state["changeovers"],
+            "waits": round(state["waits"]),
+        })
+    for order, row in enumerate(scheduled, start=1):
+        row["order"] = order
+
+    ends = [state["sessions"][-1][1] for state in rooms_state if state["sessions"]]
+    end = max(ends) if ends else start_minutes
+    return {
+        "performances": scheduled,
+        "rooms": summary,
+        "start": format_clock(start_minutes),
+        "end": format_clock(end),
+        "days": int((end - start_minutes) // (24 * 60)) + 1,
+        "changeovers": sum(state["changeovers"] for state in rooms_state),
+        "waits": round(sum(state["waits"] for state in rooms_state)),
+    }
@@ -0,0 +1,188 @@
+"""
+MusicNBrain Session Store - Durable, bounded ADK sessions
+Sessions live in SQLite (ADK's SqliteSessionService), so conversations
+survive restarts and redeploys. In front of it sits a small resident cache
+with an LRU cap and idle eviction, and each session's event history is
+truncated to its most recent turns so neither RAM nor the database grows
+without bound.
+"""
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import aiosqlite
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from google.adk.sessions.sqlite_session_service import SqliteSessionService
+
+logger = logging.getLogger(__name__)
+
+# ADK's events table has no delete API; truncation deletes rows by this key
+# directly and only after checking the table still has these columns
+# (SqliteSessionService schema as of google-adk 1.26)
+EVENTS_KEY_COLUMNS = {"app_name", "user_id", "session_id", "id"}
+
+
+class BoundedSessionService(BaseSessionService):
+    """
+    SqliteSessionService plus:
+
+    - a resident cache of at most `max_resident` sessions; entries idle for
+      longer than `idle_ttl_seconds` are dropped (they stay in SQLite)
+    - cache hits need no database round trip: every write this process
+      makes goes through the wrapper and updates the resident copy. A copy
+      left stale by another worker's write fails ADK's own update-time check
+      on the next append; it is then reloaded and the event written on top,
+      so nothing is lost
+    - history truncation: once a session holds more than `max_events`
+      events (plus 25% slack), the oldest whole turns are deleted from
+      memory and storage. Cuts are made at user messages so a tool call is
+      never separated from its response. Storage is only touched if ADK's
+      events table still has the expected key columns (EVENTS_KEY_COLUMNS);
+      otherwise history is truncated in memory only
+    """
+
+    def __init__(self, db_path: str, max_events: int = 200, max_resident: int = 1000,
+                 idle_ttl_seconds: float = 1800, clock=time.monotonic):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.max_events = max_events
+        self.max_resident = max_resident
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._storage = SqliteSessionService(db_path)
+        # Whether ADK's events table has the columns truncation deletes by; checked once
+        self._events_schema_ok: Optional[bool] = None
+        # (app_name, user_id, session_id) -> (last_access, session); oldest access first
+        self._resident: "OrderedDict[tuple, tuple[float, Session]]" = OrderedDict()
+
+    # ------------------------------------------------------------
+    # Resident cache
+    # ------------------------------------------------------------
+    def _remember(self, session: Session) -> None:
+        key = (session.app_name, session.user_id, session.id)
+        self._resident.pop(key, None)
+        self._resident[key] = (self._clock(), session)
+        while len(self._resident) > self.max_resident:
+            self._resident.popitem(last=False)
+
+    def evict_idle(self) -> int:
+        """Drop idle sessions from memory (they stay in storage). Returns the number dropped."""
+        now = self._clock()
+        removed = 0
+        while self._resident:
+            key, (last_access, _) = next(iter(self._resident.items()))
+            if now - last_access <= self.idle_ttl_seconds:
+                break
+            del self._resident[key]
+            removed += 1
+        return removed
+
+    def resident_count(self) -> int:
+        return len(self._resident)
+
+    async def _load(self, app_name: str, user_id: str, session_id: str) -> Optional[Session]:
+        """The session's newest `max_events` events from storage, remembered as resident."""
+        session = await self._storage.get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id,
+            config=GetSessionConfig(num_recent_events=self.max_events),
+        )
+        if session is not None:
+            # A window may start mid-turn; keep it aligned like truncation does
+            if len(session.events) >= self.max_events:
+                session.events = session.events[self._truncation_point(session.events):]
+            self._remember(session)
+        return session
+
+    # ------------------------------------------------------------
+    # History truncation
+    # ------------------------------------------------------------
+    def _truncation_point(self, events: list) -> int:
+        """Index of the first event to keep: a user message within the newest max_events."""
+        for index in range(max(0, len(events) - self.max_events), len(events)):
+            if events[index].author == "user":
+                return index
+        return 0
+
+    async def _truncate(self, session: Session) -> None:
+        if len(session.events) <= self.max_events * 5 // 4:
+            return
+        cut = self._truncation_point(session.events)
+        if cut <= 0:
+            return
+        dropped = [event.id for event in session.events[:cut]]
+        session.events = session.events[cut:]
+        async with aiosqlite.connect(self.db_path) as db:
+            if self._events_schema_ok is None:
+                async with db.execute("PRAGMA table_info(events)") as cursor:
+                    columns = {row[1] for row in await cursor.fetchall()}
+                self._events_schema_ok = EVENTS_KEY_COLUMNS <= columns
+                if not self._events_schema_ok:
+                    logger.warning(f"ADK events table has columns {sorted(columns)}, expected "
+                                   f"{sorted(EVENTS_KEY_COLUMNS)}; truncating session history in memory only")
+            if not self._events_schema_ok:
+                return
+            await db.executemany(
+                "DELETE FROM events WHERE app_name=? AND user_id=? AND session_id=? AND id=?",
+                [(session.app_name, session.user_id, session.id, event_id) for event_id in dropped],
+            )
+            await db.commit()
+        logger.info(f"Truncated session {session.id} history by {len(dropped)} events")
+
+    # ------------------------------------------------------------
+    # BaseSessionService
+    # ------------------------------------------------------------
+    async def create_session(self, *, app_name: str, user_id: str, state: Optional[dict[str, Any]] = None,
+                             session_id: Optional[str] = None) -> Session:
+        session = await self._storage.create_session(app_name=app_name, user_id=user_id, state=state,
+                                                     session_id=session_id)
+        self._remember(session)
+        return session
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str,
+                          config: Optional[GetSessionConfig] = None) -> Optional[Session]:
+        if config is not None:
+            return await self._storage.get_session(app_name=app_name, user_id=user_id,
+                                                   session_id=session_id, config=config)
+
+        self.evict_idle()
+        entry = self._resident.get((app_name, user_id, session_id))
+        if entry is not None:
+            self.hits += 1
+            self._remember(entry[1])
+            return entry[1]
+
+        self.misses += 1
+        return await self._load(app_name, user_id, session_id)
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        return await self._storage.list_sessions(app_name=app_name, user_id=user_id)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        self._resident.pop((app_name, user_id, session_id), None)
+        await self._storage.delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        try:
+            event = await self._storage.append_event(session, event)
+        except ValueError:
+            # Stale (another worker wrote since this copy was loaded): catch up and write on top
+            stored = await self._load(session.app_name, session.user_id, session.id)
+            if stored is None:
+                raise
+            logger.info(f"Session {session.id} changed in another worker; reloaded it before appending")
+            session.events, session.state = stored.events, stored.state
+            session.last_update_time = stored.last_update_time
+            self._remember(session)
+            event = await self._storage.append_event(session, event)
+        if not event.partial:
+            await self._truncate(session)
+            self._remember(session)
+        return event
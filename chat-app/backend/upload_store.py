@@ -0,0 +1,232 @@
+"""
+MusicNBrain Upload Store - Content-addressed files with quotas and expiry
+Uploads are streamed to disk on a worker thread while being hashed, then
+stored once as {root}/{sha256}{extension}: identical files share one copy
+and same-named files no longer overwrite each other. Each session and the
+store as a whole have a byte quota (the least recently used files make
+room), and files unused for longer than the TTL are deleted by
+evict_expired(), which the API runs periodically.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from typing import BinaryIO, Optional
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join("cache", "uploads"))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_SESSION_QUOTA_BYTES = int(os.getenv("UPLOAD_SESSION_QUOTA_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_TOTAL_QUOTA_BYTES = int(os.getenv("UPLOAD_TOTAL_QUOTA_BYTES", str(2 * 1024 * 1024 * 1024)))
+UPLOAD_TTL_SECONDS = float(os.getenv("UPLOAD_TTL_SECONDS", str(7 * 24 * 3600)))
+
+COPY_CHUNK_BYTES = 1024 * 1024
+
+_EXTENSION_PATTERN = re.compile(r"\.[a-z0-9]{1,8}")
+_TMP_SUFFIX = ".tmp"
+
+
+class UploadRejected(ValueError):
+    """Raised when an upload is too large or would exceed a quota."""
+
+
+def safe_extension(filename: Optional[str]) -> str:
+    """Lower-case extension of an uploaded file name, or "" if it is missing or odd."""
+    extension = os.path.splitext(filename or "")[1].lower()
+    return extension if _EXTENSION_PATTERN.fullmatch(extension) else ""
+
+
+class UploadStore:
+    """
+    Files under `root`, named by key (the sha256 of their bytes unless the
+    caller supplies one). The index of sizes and last-use times is built from
+    the directory on first use and kept per process; sessions are tracked
+    only in memory, so after a restart old files count against the total
+    quota alone.
+    """
+
+    def __init__(self, root: str = UPLOAD_DIR, max_file_bytes: int = MAX_UPLOAD_BYTES,
+                 session_quota_bytes: int = UPLOAD_SESSION_QUOTA_BYTES,
+                 total_quota_bytes: int = UPLOAD_TOTAL_QUOTA_BYTES,
+                 ttl_seconds: float = UPLOAD_TTL_SECONDS, clock=time.time):
+        self.root = root
+        self.max_file_bytes = max_file_bytes
+        self.session_quota_bytes = session_quota_bytes
+        self.total_quota_bytes = total_quota_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._files: Optional[dict] = None  # key -> {"path", "size", "last_used"}
+        self._sessions = {}  # session_id -> set of keys
+        self._total = 0
+
+    # ------------------------------------------------------------
+    # Index
+    # ------------------------------------------------------------
+    def _index(self) -> dict:
+        """Caller holds the lock."""
+        if self._files is None:
+            os.makedirs(self.root, exist_ok=True)
+            self._files, self._total = {}, 0
+            for entry in os.scandir(self.root):
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if entry.name.endswith(_TMP_SUFFIX):
+                    # Left behind by an interrupted copy (recent ones may still be in progress)
+                    if stat.st_mtime < time.time() - 3600:
+                        os.remove(entry.path)
+                    continue
+                key = os.path.splitext(entry.name)[0]
+                self._files[key] = {"path": entry.path, "size": stat.st_size, "last_used": stat.st_mtime}
+                self._total += stat.st_size
+        return self._files
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            self._index()
+            return self._total
+
+    def session_bytes(self, session_id: str) -> int:
+        with self._lock:
+            files = self._index()
+            return sum(files[key]["size"] for key in self._sessions.get(session_id, ()) if key in files)
+
+    def find(self, key: str) -> Optional[str]:
+        with self._lock:
+            record = self._index().get(key)
+            return record["path"] if record else None
+
+    def _mark_used(self, record: dict) -> None:
+        """Caller holds the lock. The mtime keeps the use across restarts."""
+        record["last_used"] = self._clock()
+        try:
+            os.utime(record["path"])
+        except FileNotFoundError:
+            pass
+
+    def _remove(self, key: str) -> None:
+        """Caller holds the lock."""
+        record = self._files.pop(key)
+        self._total -= record["size"]
+        for keys in self._sessions.values():
+            keys.discard(key)
+        try:
+            os.remove(record["path"])
+        except FileNotFoundError:
+            pass
+
+    # ------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------
+    def _commit(self, key: str, tmp_path: str, extension: str, size: int, session_id: str) -> dict:
+        """Move a finished temp file into place, or drop it if the key is stored already."""
+        with self._lock:
+            files = self._index()
+            existing = files.get(key)
+            session_keys = self._sessions.setdefault(session_id, set())
+            if existing is not None:
+                os.remove(tmp_path)
+                self._mark_used(existing)
+                session_keys.add(key)
+                return {"key": key, "path": existing["path"], "size": existing["size"], "deduplicated": True}
+
+            session_used = sum(files[k]["size"] for k in session_keys if k in files)
+            if session_used + size > self.session_quota_bytes:
+                os.remove(tmp_path)
+                raise UploadRejected("Upload quota for this conversation is used up. Start a new conversation.")
+            if size > self.total_quota_bytes:
+                os.remove(tmp_path)
+                raise UploadRejected("The file is too large to store.")
+            # Make room by dropping the least recently used files
+            for old_key in sorted(files, key=lambda k: files[k]["last_used"]):
+                if self._total + size <= self.total_quota_bytes:
+                    break
+                self._remove(old_key)
+                logger.info(f"Evicted upload {old_key} to stay under the {self.total_quota_bytes} byte quota")
+
+            path = os.path.join(self.root, key + extension)
+            os.replace(tmp_path, path)
+            files[key] = {"path": path, "size": size, "last_used": self._clock()}
+            self._total += size
+            session_keys.add(key)
+            return {"key": key, "path": path, "size": size, "deduplicated": False}
+
+    def _tmp_path(self) -> str:
+        with self._lock:
+            self._index()
+        return os.path.join(self.root, uuid.uuid4().hex + _TMP_SUFFIX)
+
+    def put_bytes(self, data: bytes, extension: str = "", session_id: str = "", key: Optional[str] = None) -> dict:
+        """Store `data` under `key` (default: its sha256). Returns {"key", "path", "size", "deduplicated"}."""
+        if len(data) > self.max_file_bytes:
+            raise UploadRejected(f"Files can be at most {self.max_file_bytes // (1024 * 1024)} MB.")
+        key = key or hashlib.sha256(data).hexdigest()
+        tmp_path = self._tmp_path()
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        return self._commit(key, tmp_path, extension, len(data), session_id)
+
+    def copy_file(self, source: BinaryIO, extension: str = "", session_id: str = "") -> dict:
+        """Stream a file object into the store in chunks, hashing as it goes (blocking)."""
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = self._tmp_path()
+        try:
+            with open(tmp_path, "wb") as f:
+                while True:
+                    chunk = source.read(COPY_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        raise UploadRejected(f"Files can be at most {self.max_file_bytes // (1024 * 1024)} MB.")
+                    digest.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return self._commit(digest.hexdigest(), tmp_path, extension, size, session_id)
+
+    async def save_upload(self, upload, session_id: str = "") -> dict:
+        """Store a FastAPI UploadFile without blocking the event loop."""
+        return await asyncio.to_thread(self.copy_file, upload.file, safe_extension(upload.filename), session_id)
+
+    def touch(self, key: str, session_id: str = "") -> bool:
+        """Mark a stored file as used (by this session). False if it is not stored."""
+        with self._lock:
+            record = self._index().get(key)
+            if record is None:
+                return False
+            self._mark_used(record)
+            self._sessions.setdefault(session_id, set()).add(key)
+            return True
+
+    # ------------------------------------------------------------
+    # Expiry
+    # ------------------------------------------------------------
+    def evict_expired(self) -> int:
+        """Delete files unused for longer than the TTL. Returns the number deleted."""
+        cutoff = self._clock() - self.ttl_seconds
+        removed = 0
+        with self._lock:
+            files = self._index()
+            for key in [k for k, record in files.items() if record["last_used"] < cutoff]:
+                # Other processes (the MCP server reading images) mark use via mtime
+                try:
+                    files[key]["last_used"] = max(files[key]["last_used"], os.path.getmtime(files[key]["path"]))
+                except FileNotFoundError:
+                    pass
+                if files[key]["last_used"] < cutoff:
+                    self._remove(key)
+                    removed += 1
+            for session_id in [s for s, keys in self._sessions.items() if not keys]:
+                del self._sessions[session_id]
+        return removed
@@ -8,6 +8,34 @@ const SendIcon = () => (
   </svg>
 );
 
+// Phone photos are downscaled in the browser before upload; the server
+// prepares them again (OCR resolution, no EXIF), so this only saves bandwidth
+const UPLOAD_MAX_EDGE = 2000;
+const SHRINK_MIN_BYTES = 512 * 1024;
+
+const shrinkImage = async (file: File): Promise<File> => {
+  if (!/^image\/(jpeg|png|webp)$/.test(file.type) || file.size < SHRINK_MIN_BYTES) return file;
+  try {
+    const bitmap = await createImageBitmap(file);
+    const scale = Math.min(1, UPLOAD_MAX_EDGE / Math.max(bitmap.width, bitmap.height));
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.round(bitmap.width * scale);
+    canvas.height = Math.round(bitmap.height * scale);
+    const context = canvas.getContext('2d');
+    if (!context) return file;
+    context.fillStyle = '#fff';
+    context.fillRect(0, 0, canvas.width, canvas.height);
+    context.drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+    bitmap.close();
+    const blob = await new Promise<Blob | null>(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.85));
+    if (!blob || blob.size >= file.size) return file;
+    return new File([blob], file.name.replace(/\.\w+$/, '') + '.jpg', { type: 'image/jpeg' });
+  } catch {
+    // Formats the browser cannot decode (e.g. HEIC) go up as they are
+    return file;
+  }
+};
+
 const PaperclipIcon = () => (
   <svg xmlns="http://www.w3.org/2000/svg" width="18" height="18" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2" strokeLinecap="round" strokeLinejoin="round">
     <path d="m21.44 11.05-9.19 9.19a6 6 0 0 1-8.49-8.49l8.57-8.57A4 4 0 1 1 18 8.84l-8.59 8.57a2 2 0 0 1-2.83-2.83l8.49-8.48"></path>
@@ -47,6 +75,7 @@ const ChatInterface: React.FC = () => {
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
   const [selectedFile, setSelectedFile] = useState<File | null>(null);
+  const [sessionId, setSessionId] = useState<string | null>(null);
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const fileInputRef = useRef<HTMLInputElement>(null);
   const textareaRef = useRef<HTMLTextAreaElement>(null);
@@ -91,7 +120,10 @@ const ChatInterface: React.FC = () => {
       const formData = new FormData();
       formData.append('message', input || (selectedFile ? "I uploaded a file." : ""));
       if (selectedFile) {
-        formData.append('file', selectedFile);
+        formData.append('file', await shrinkImage(selectedFile));
+      }
+      if (sessionId) {
+        formData.append('session_id', sessionId);
       }
 
       const response = await fetch('/api/chat', {
@@ -102,6 +134,7 @@ const ChatInterface: React.FC = () => {
       if (!response.ok) throw new Error('Failed to send message');
 
       const data = await response.json();
+      if (data.session_id) setSessionId(data.session_id);
 
       setMessages(prev => [...prev, {
         role: 'assistant',